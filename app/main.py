@@ -1,2751 +1,5387 @@
+import codecs
+import io
+import json
+import mmap
+import operator
+import os
+import re
+import struct
 import sys
-
 import traceback
-
-from time import time
-
+import warnings
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from math import isfinite
+from time import sleep, time
+from types import FunctionType, MappingProxyType
 debug = False
-
+# print tier-up events to stderr, set by the --debug-tiering flag
+debug_tiering = False
+# calls or loop back edges after which tree code is recompiled into closures
+tier_up_threshold = 1000
+# call depth budget of the engines keeping their own frame stack, --max-frames
+max_call_frames = 100000
+# run calls in return position without growing the stack, set by --tail-calls
+tail_calls = False
 token_map = {
-
     "(": "LEFT_PAREN",
-
     ")": "RIGHT_PAREN",
-
     "{": "LEFT_BRACE",
-
     "}": "RIGHT_BRACE",
-
     "*": "STAR",
-
     ".": "DOT",
-
     ",": "COMMA",
-
     "+": "PLUS",
-
     "-": "MINUS",
-
     ";": "SEMICOLON",
-
     "=": "EQUAL",
-
     "!": "BANG",
-
     "!=": "BANG_EQUAL",
-
     "==": "EQUAL_EQUAL",
-
     "<=": "LESS_EQUAL",
-
     "<": "LESS",
-
     ">": "GREATER",
-
     ">=": "GREATER_EQUAL",
-
     "/": "SLASH",
-
-    "//": "COMMENT",
-
     "and": "AND",
-
     "class": "CLASS",
-
     "else": "ELSE",
-
     "false": "FALSE",
-
     "for": "FOR",
-
     "fun": "FUN",
-
     "if": "IF",
-
     "nil": "NIL",
-
     "or": "OR",
-
     "print": "PRINT",
-
     "return": "RETURN",
-
     "super": "SUPER",
-
     "this": "THIS",
-
     "true": "TRUE",
-
     "var": "VAR",
-
     "while": "WHILE",
-
 }
-
+# token kinds are stored and compared as these integer codes
+token_kinds = (
+    "LEFT_PAREN",
+    "RIGHT_PAREN",
+    "LEFT_BRACE",
+    "RIGHT_BRACE",
+    "STAR",
+    "DOT",
+    "COMMA",
+    "PLUS",
+    "MINUS",
+    "SEMICOLON",
+    "EQUAL",
+    "BANG",
+    "BANG_EQUAL",
+    "EQUAL_EQUAL",
+    "LESS_EQUAL",
+    "LESS",
+    "GREATER",
+    "GREATER_EQUAL",
+    "SLASH",
+    "AND",
+    "CLASS",
+    "ELSE",
+    "FALSE",
+    "FOR",
+    "FUN",
+    "IF",
+    "NIL",
+    "OR",
+    "PRINT",
+    "RETURN",
+    "SUPER",
+    "THIS",
+    "TRUE",
+    "VAR",
+    "WHILE",
+    "IDENTIFIER",
+    "STRING",
+    "NUMBER",
+    "EOF",
+)
+(
+    TOKEN_LEFT_PAREN,
+    TOKEN_RIGHT_PAREN,
+    TOKEN_LEFT_BRACE,
+    TOKEN_RIGHT_BRACE,
+    TOKEN_STAR,
+    TOKEN_DOT,
+    TOKEN_COMMA,
+    TOKEN_PLUS,
+    TOKEN_MINUS,
+    TOKEN_SEMICOLON,
+    TOKEN_EQUAL,
+    TOKEN_BANG,
+    TOKEN_BANG_EQUAL,
+    TOKEN_EQUAL_EQUAL,
+    TOKEN_LESS_EQUAL,
+    TOKEN_LESS,
+    TOKEN_GREATER,
+    TOKEN_GREATER_EQUAL,
+    TOKEN_SLASH,
+    TOKEN_AND,
+    TOKEN_CLASS,
+    TOKEN_ELSE,
+    TOKEN_FALSE,
+    TOKEN_FOR,
+    TOKEN_FUN,
+    TOKEN_IF,
+    TOKEN_NIL,
+    TOKEN_OR,
+    TOKEN_PRINT,
+    TOKEN_RETURN,
+    TOKEN_SUPER,
+    TOKEN_THIS,
+    TOKEN_TRUE,
+    TOKEN_VAR,
+    TOKEN_WHILE,
+    TOKEN_IDENTIFIER,
+    TOKEN_STRING,
+    TOKEN_NUMBER,
+    TOKEN_EOF,
+) = range(len(token_kinds))
+token_codes = {kind: code for code, kind in enumerate(token_kinds)}
 def debug_output(stuff):
-
     print(stuff)
-
 def convert_primitive_to_str(val):
-
     if isinstance(val, bool):
-
         return str(val).lower()
-
     if val is None:
-
         return "nil"
-
     if isinstance(val, float):
-
         return int(val) if val.is_integer() else val
-
     if isinstance(val, FunctionNode):
-
         return f"<fn {val.func_name}>"
-
+    if isinstance(val, VMClosure):
+        return f"<fn {val.function.name}>"
+    if isinstance(val, FunctionType):
+        return f"<fn {val.__name__}>"
     return val
-
-def contains_next_token(file_contents, idx, token):
-
-    if idx + len(token) >= len(file_contents):
-
-        return False
-
-    return file_contents[idx : idx + len(token)] == token
-
-def get_string_literal(file_contents, idx):
-
-    assert file_contents[idx] == '"'
-
-    str = '"'
-
-    curr_idx = idx + 1
-
-    while curr_idx < len(file_contents) and file_contents[curr_idx] != '"':
-
-        str += file_contents[curr_idx]
-
-        curr_idx += 1
-
-    if curr_idx < len(file_contents) and file_contents[curr_idx] == '"':
-
-        str += '"'
-
-    return str
-
-def get_number_literal(file_contents, idx):
-
-    num = ""
-
-    curr_idx = idx
-
-    while curr_idx < len(file_contents) and (
-
-        file_contents[curr_idx].isnumeric() or file_contents[curr_idx] == "."
-
-    ):
-
-        num += file_contents[curr_idx]
-
-        curr_idx += 1
-
-    return num
-
-def get_identifier(file_contents, idx):
-
-    identifier = ""
-
-    curr_idx = idx
-
-    while curr_idx < len(file_contents) and (
-
-        file_contents[curr_idx].isalnum() or file_contents[curr_idx] == "_"
-
-    ):
-
-        identifier += file_contents[curr_idx]
-
-        curr_idx += 1
-
-    return identifier
-
-def tokenize_with_list(file_contents):
-
-    tokens = []
-
-    # Uncomment this block to pass the first stage
-
-    is_commenting = False
-
-    idx = 0
-
+# one alternative per kind of lexeme, the name of the group that matched picks
+# what gets emitted. runs of whitespace and comments are skipped in one match,
+# anything no other group takes is an unexpected character
+token_pattern = re.compile(
+    r"""
+    (?P<SKIP>(?:[ \t\n]|<\|TAB\|>|<\|SPACE\|>|//[^\n]*)+)
+    |(?P<WORD>[^\W\d]\w*)
+    |(?P<SYMBOL>[!=<>]=|[(){}*.,+\-;=!<>/])
+    |(?P<NUMBER>\d+(?:\.\d+)?)
+    |(?P<STRING>"[^"]*")
+    |(?P<UNTERMINATED>"[^"]*)
+    |(?P<UNEXPECTED>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+# how much text past a token the scanner may need to see before the token is
+# known to have ended: the <|SPACE|> marker
+scan_lookahead = 9
+def scan_tokens(file_contents):
+    # yields (kind, lexeme, literal, offset) for every token, and
+    # ("ERROR", message, line, offset) for every lexical error
+    return scan_token_chunks((file_contents,))
+# what a whole chunk may consist of to only continue an unfinished token of
+# each kind, COMMENT being a SKIP that ends inside a comment
+token_continuations = {
+    "SKIP": re.compile(r"[ \t\n]*"),
+    "COMMENT": re.compile(r"[^\n]*"),
+    "WORD": re.compile(r"\w*"),
+    "NUMBER": re.compile(r"\d*"),
+    "UNTERMINATED": re.compile(r'[^"]*'),
+}
+def scan_token_chunks(chunks):
+    # scan_tokens over source text arriving in pieces. a token that ends close
+    # to the end of the text seen so far might continue in the next piece, so
+    # the text from its start on is carried over and scanned again. pieces
+    # that only continue it are held back until it ends, so a long string or
+    # comment is scanned again once rather than once per piece
     line = 1
-
-    while idx < len(file_contents):
-
-        ch = file_contents[idx]
-
-        if file_contents[idx] == "\n":
-
-            line += 1
-
-            idx += 1
-
-            is_commenting = False
-
-        elif is_commenting:
-
-            idx += 1
-
-        elif file_contents[idx].isnumeric():
-
-            num_literal = get_number_literal(file_contents, idx)
-
-            tokens.append(("NUMBER", num_literal, float(num_literal)))
-
-            idx += len(num_literal)
-
-        elif file_contents[idx] == '"':
-
-            string_literal = get_string_literal(file_contents, idx)
-
-            if string_literal[0] == '"' and string_literal[-1] == '"':
-
-                tokens.append(("STRING", string_literal, string_literal[1:-1]))
-
-            else:
-
-                return None
-
-            idx += len(string_literal)
-
-        elif file_contents[idx] in (" ", "\t"):
-
-            idx += 1
-
-        elif contains_next_token(file_contents, idx, "<|TAB|>"):
-
-            idx += len("<|TAB|>")
-
-        elif contains_next_token(file_contents, idx, "<|SPACE|>"):
-
-            idx += len("<|SPACE|>")
-
-        elif contains_next_token(file_contents, idx, "//"):
-
-            is_commenting = True
-
-            idx += 1
-
-        elif idx + 1 < len(file_contents) and file_contents[idx : idx + 2] in token_map:
-
-            tokens.append(
-
-                (
-
-                    token_map[file_contents[idx : idx + 2]],
-
-                    file_contents[idx : idx + 2],
-
-                    "null",
-
-                )
-
-            )
-
-            idx += 2
-
-        elif ch in token_map:
-
-            tokens.append((token_map[ch], ch, "null"))
-
-            idx += 1
-
-        elif ch.isalpha() or ch == "_":
-
-            word = get_identifier(file_contents, idx)
-
-            if word in token_map:
-
-                tokens.append((token_map[word], word, "null"))
-
+    # source offset of the carried over text
+    base = 0
+    text = ""
+    held_back = []
+    # matches pieces that continue the unfinished token, None when there is none
+    continuation = None
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        following = next(chunks, None)
+        if (
+            continuation is not None
+            and following is not None
+            and continuation.fullmatch(chunk)
+        ):
+            held_back.append(chunk)
+            chunk = following
+            continue
+        text = "".join([text, *held_back, chunk])
+        held_back = []
+        chunk = following
+        if chunk is None:
+            limit = len(text)
+        else:
+            limit = len(text) - scan_lookahead
+        carried = len(text)
+        continuation = None
+        # newlines are only counted when an error needs its line
+        counted_up_to = 0
+        for token in token_pattern.finditer(text):
+            if token.end() > limit:
+                carried = token.start()
+                if token.end() == len(text):
+                    kind = token.lastgroup
+                    if kind == "SKIP":
+                        skipped = token.group()
+                        if skipped.rfind("//") > skipped.rfind("\n"):
+                            kind = "COMMENT"
+                    continuation = token_continuations.get(kind)
+                break
+            kind = token.lastgroup
+            if kind == "SKIP":
+                continue
+            lexeme = token.group()
+            start = token.start()
+            offset = base + start
+            if kind == "WORD":
+                yield (token_map.get(lexeme, "IDENTIFIER"), lexeme, "null", offset)
+            elif kind == "SYMBOL":
+                yield (token_map[lexeme], lexeme, "null", offset)
+            elif kind == "NUMBER":
+                yield ("NUMBER", lexeme, float(lexeme), offset)
+            elif kind == "STRING":
+                yield ("STRING", lexeme, lexeme[1:-1], offset)
             else:
-
-                tokens.append(("IDENTIFIER", word, "null"))
-
-            idx += len(word)
-
+                line += text.count("\n", counted_up_to, start)
+                counted_up_to = start
+                if kind == "UNTERMINATED":
+                    yield ("ERROR", "Unterminated string.", line, offset)
+                else:
+                    message = f"Unexpected character: {lexeme}"
+                    yield ("ERROR", message, line, offset)
+        line += text.count("\n", counted_up_to, carried)
+        base += carried
+        text = text[carried:]
+# characters read from the source at a time when streaming it
+source_chunk_size = 1 << 20
+def source_chunks(filename):
+    # yields the text of a file piece by piece, "-" reads standard input
+    if filename == "-":
+        while True:
+            chunk = sys.stdin.read(source_chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder("utf-8")(), translate=True
+    )
+    with open(filename, "rb") as file:
+        # mmap refuses empty files
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            for start in range(0, len(source), source_chunk_size):
+                yield decoder.decode(source[start : start + source_chunk_size])
+    yield decoder.decode(b"", final=True)
+def read_source(filename):
+    if filename == "-":
+        return sys.stdin.read()
+    with open(filename) as file:
+        return file.read()
+class TokenStore:
+    # tokens as parallel arrays of kind code, interned lexeme id and source
+    # offset. every distinct lexeme is stored once, with its literal value.
+    # indexing gives the (kind, lexeme, literal) tuples the token walkers use
+    def __init__(self):
+        self.kinds = array("B")
+        self.lexeme_ids = array("I")
+        # 64 bit, sources may be larger than 4 GiB
+        self.offsets = array("Q")
+        self.lexemes = []
+        self.literals = []
+        self.lexeme_index = {}
+        # for every bracket how far ahead (or back, when negative) its partner
+        # is, filled by match_brackets. distances stay valid when tokens move
+        self.matching = array("i")
+        # the lexed text, positions are only worked out from it on demand
+        self.source = ""
+        self.newline_offsets = None
+    def append(self, kind, lexeme, literal, offset):
+        lexeme_id = self.lexeme_index.get(lexeme)
+        if lexeme_id is None:
+            lexeme_id = self.lexeme_index[lexeme] = len(self.lexemes)
+            self.lexemes.append(lexeme)
+            self.literals.append(literal)
+        self.kinds.append(kind)
+        self.lexeme_ids.append(lexeme_id)
+        self.offsets.append(offset)
+    def intern_lexemes(self, tokens):
+        # the ids in this store of the lexemes of another store
+        lexeme_index = self.lexeme_index
+        lexeme_ids = []
+        for lexeme, literal in zip(tokens.lexemes, tokens.literals):
+            lexeme_id = lexeme_index.get(lexeme)
+            if lexeme_id is None:
+                lexeme_id = lexeme_index[lexeme] = len(self.lexemes)
+                self.lexemes.append(lexeme)
+                self.literals.append(literal)
+            lexeme_ids.append(lexeme_id)
+        return lexeme_ids
+    def extend(self, tokens, offset):
+        # appends the tokens of another store whose offsets start at offset
+        lexeme_ids = self.intern_lexemes(tokens)
+        self.kinds.extend(tokens.kinds)
+        self.lexeme_ids.extend(array("I", [lexeme_ids[i] for i in tokens.lexeme_ids]))
+        self.offsets.extend(array("Q", [start + offset for start in tokens.offsets]))
+    def splice(self, start, end, tokens, shift):
+        # replaces the tokens in [start, end) with those of another store, whose
+        # offsets are already in place, and moves the offsets of the tokens
+        # after them by shift characters. the new brackets are left for
+        # match_brackets
+        lexeme_ids = self.intern_lexemes(tokens)
+        self.kinds = self.kinds[:start] + tokens.kinds + self.kinds[end:]
+        self.lexeme_ids = (
+            self.lexeme_ids[:start]
+            + array("I", [lexeme_ids[i] for i in tokens.lexeme_ids])
+            + self.lexeme_ids[end:]
+        )
+        self.offsets = (
+            self.offsets[:start]
+            + tokens.offsets
+            + array("Q", map(shift.__add__, self.offsets[end:]))
+        )
+        self.matching = (
+            self.matching[:start] + array("i", [0]) * len(tokens) + self.matching[end:]
+        )
+        self.newline_offsets = None
+    def position(self, idx):
+        # (line, column) of the token at idx counted from 1, past the last
+        # token it is the end of the source
+        if self.newline_offsets is None:
+            newline_offsets = array("Q")
+            newline = self.source.find("\n")
+            while newline != -1:
+                newline_offsets.append(newline)
+                newline = self.source.find("\n", newline + 1)
+            self.newline_offsets = newline_offsets
+        if idx < len(self.offsets):
+            offset = self.offsets[idx]
         else:
-
-            print(f"[line {line}] Error: Unexpected character: {ch}", file=sys.stderr)
-
-            idx += 1
-
-            return None
-
+            offset = len(self.source)
+        line = bisect_left(self.newline_offsets, offset)
+        line_start = self.newline_offsets[line - 1] + 1 if line else 0
+        return line + 1, offset - line_start + 1
+    def line(self, idx):
+        return self.position(idx)[0]
+    def lexeme(self, idx):
+        return self.lexemes[self.lexeme_ids[idx]]
+    def literal(self, idx):
+        return self.literals[self.lexeme_ids[idx]]
+    def __len__(self):
+        return len(self.kinds)
+    def match_brackets(self, start=0, end=None):
+        # pairs up every paren and brace in [start, end), returns the index of
+        # the first bracket without a partner there or None when all of them
+        # are balanced
+        if len(self.matching) != len(self.kinds):
+            self.matching = array("i", [0]) * len(self.kinds)
+        matching = self.matching
+        open_brackets = []
+        kinds = self.kinds[start:end]
+        for idx, kind in enumerate(kinds, start):
+            if kind == TOKEN_LEFT_PAREN or kind == TOKEN_LEFT_BRACE:
+                open_brackets.append(idx)
+            elif kind == TOKEN_RIGHT_PAREN or kind == TOKEN_RIGHT_BRACE:
+                # each closing kind code directly follows its opening one
+                if not open_brackets or kinds[open_brackets[-1] - start] != kind - 1:
+                    return idx
+                opening = open_brackets.pop()
+                matching[opening] = idx - opening
+                matching[idx] = opening - idx
+        return open_brackets[-1] if open_brackets else None
+    def __getitem__(self, idx):
+        lexeme_id = self.lexeme_ids[idx]
+        return (
+            token_kinds[self.kinds[idx]],
+            self.lexemes[lexeme_id],
+            self.literals[lexeme_id],
+        )
+    def __iter__(self):
+        for idx in range(len(self.kinds)):
+            yield self[idx]
+class TokenCursor:
+    # reads the tokens in [start, end) of a TokenStore without copying them,
+    # peeking gives TOKEN_EOF past the end
+    __slots__ = ("tokens", "kinds", "idx", "end")
+    def __init__(self, tokens, start=0, end=None):
+        self.tokens = tokens
+        self.kinds = tokens.kinds
+        self.idx = start
+        self.end = len(tokens) if end is None else end
+    def at_end(self):
+        return self.idx >= self.end
+    def peek(self):
+        if self.idx < self.end:
+            return self.kinds[self.idx]
+        return TOKEN_EOF
+    def advance(self):
+        self.idx += 1
+        return self.idx - 1
+    def lexeme(self, idx):
+        return self.tokens.lexeme(idx)
+    def literal(self, idx):
+        return self.tokens.literal(idx)
+# sources at least this long are lexed on all cores
+parallel_lex_threshold = 1 << 22
+def lex_piece(text):
+    # lexes text into a TokenStore with offsets and lines relative to text.
+    # returns the store, the errors as (message, line, offset) and the offset
+    # of the string still open at the end of text, if any. that string is an
+    # error too, unless the text was cut off from a longer source
+    tokens = TokenStore()
+    errors = []
+    open_string = None
+    for kind, lexeme, literal, offset in scan_tokens(text):
+        if kind == "ERROR":
+            errors.append((lexeme, literal, offset))
+            # an unterminated string always runs to the end of text
+            if lexeme == "Unterminated string.":
+                open_string = offset
+        else:
+            tokens.append(token_codes[kind], lexeme, literal, offset)
+    return tokens, errors, open_string
+def split_at_newlines(source, count):
+    # about count (start, end) ranges covering source, each ending after a
+    # newline. no token but a string spans a newline
+    size = len(source) // count + 1
+    pieces = []
+    start = 0
+    while start < len(source):
+        end = source.find("\n", start + size)
+        end = len(source) if end == -1 else end + 1
+        pieces.append((start, end))
+        start = end
+    return pieces
+def lex_in_parallel(source, workers):
+    # lexes pieces of source in worker processes and stitches them together.
+    # returns the tokens and the errors of the first piece that has any, with
+    # their lines counted from the start of source
+    pieces = split_at_newlines(source, workers * 4)
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(lex_piece, [source[a:b] for a, b in pieces]))
+    tokens = TokenStore()
+    line = 1
+    for idx, (start, end) in enumerate(pieces):
+        piece_tokens, errors, open_string = results[idx]
+        if open_string is not None and idx + 1 < len(pieces):
+            # the string goes on in the next piece, which was lexed as if it
+            # started outside of one: lex that piece again from the string on
+            errors.pop()
+            end = start + open_string
+            pieces[idx + 1] = (end, pieces[idx + 1][1])
+            results[idx + 1] = lex_piece(source[end : pieces[idx + 1][1]])
+        if errors:
+            errors = [
+                (message, line + error_line - 1, offset + start)
+                for message, error_line, offset in errors
+            ]
+            return tokens, errors
+        tokens.extend(piece_tokens, start)
+        line += source.count("\n", start, end)
+    return tokens, []
+def tokenize_with_list(file_contents):
+    workers = os.cpu_count() or 1
+    if workers > 1 and len(file_contents) >= parallel_lex_threshold:
+        tokens, errors = lex_in_parallel(file_contents, workers)
+    else:
+        tokens, errors, _ = lex_piece(file_contents)
+    if errors:
+        message, line, _ = errors[0]
+        print(f"[line {line}] Error: {message}", file=sys.stderr)
+        return None
+    tokens.source = file_contents
+    unmatched = tokens.match_brackets()
+    if unmatched is not None:
+        line = tokens.line(unmatched)
+        bracket = tokens.lexeme(unmatched)
+        print(
+            f"[line {line}] Error at '{bracket}': Unmatched '{bracket}'.",
+            file=sys.stderr,
+        )
+        return None
     return tokens
-
 def is_executable(maybe_executable):
-
-    return (
-
-        isinstance(maybe_executable, Executable)
-
-        or isinstance(maybe_executable, BlockNode)
-
-        or isinstance(maybe_executable, VariableNode)
-
-        or isinstance(maybe_executable, ElseIfBlockNode)
-
-        or isinstance(maybe_executable, WhileNode)
-
-        or isinstance(maybe_executable, ForNode)
-
-        or isinstance(maybe_executable, FunctionCallNode)
-
-        or isinstance(maybe_executable, FunctionNode)
-
-    )
-
+    return isinstance(maybe_executable, executable_types)
+def is_declaration(node):
+    return isinstance(node, Executable) and node.command in ("var", "fun")
+def runtime_error(error, token_idx):
+    # gives a runtime error the token of the innermost node that knows one, the
+    # nodes around it leave the error as it is
+    if getattr(error, "token_idx", None) is None:
+        error.token_idx = token_idx
+    return error
+def arity_error(expected, got):
+    return Exception(f"Expected {expected} arguments but got {got}.")
 class BlockNode:
-
-    def __init__(self, tokens, scope):
-
-        # instead of a list of executables, this should be a list of lexemes that we evaluate and then execute
-
-        self.tokens = tokens
-
-        self.scope = scope
-
-    def execute(self):
-
-        interpreter = Interpreter(self.tokens)
-
-        interpreter.execute_all(self.scope)
-
+    def __init__(self, statements):
+        self.statements = statements
+        # nothing gets defined in a block without declarations, so it can share
+        # the outer scope. slot_count is set by the Resolver, None means unresolved
+        self.needs_scope = any(is_declaration(statement) for statement in statements)
+        self.slot_count = None
+        # for function bodies: where each upvalue is captured from when the
+        # function is declared, and which parameters closures capture
+        self.captures = ()
+        self.captured_args = ()
+        # (start, end) of the node's tokens in the token store, set by Parser
+        self.token_range = None
+        # when the block is a function body, every FunctionNode created from the
+        # same declaration shares these, so the count survives new closures
+        self.call_count = 0
+        self.compiled = None
+    def execute(self, scope=None):
+        if self.needs_scope:
+            scope = Scope(scope, slots=new_slots(self.slot_count))
+        self.execute_statements(scope)
+    def execute_statements(self, scope):
+        for statement in self.statements:
+            statement.execute(scope)
+            if scope.has_returned:
+                return
 class ElseIfBlockNode:
-
     def __init__(self, if_nodes, else_statement):
-
         self.if_nodes = if_nodes
-
         self.else_statement = else_statement
-
-    def execute(self):
-
+    def execute(self, scope=None):
         for if_node in self.if_nodes:
-
-            if is_executable(if_node.truth_val):
-
-                if_node.truth_val = if_node.truth_val.execute()
-
-            if if_node.truth_val:
-
-                if_node.block.execute()
-
+            if is_truthy(get_literal_val(if_node.truth_val, scope)):
+                if_node.block.execute(scope)
                 return
-
-        self.else_statement.execute()
-
+        self.else_statement.execute(scope)
 class IfNode:
-
     def __init__(self, truth_val, block):
-
         self.truth_val = truth_val
-
         self.block = block
-
 class ElseNode:
-
     def __init__(self, block):
-
         self.block = block
-
 class Executable:
-
     def __init__(self, command, value, value_two=None):
-
         self.command = command
-
         self.value = value
-
         self.value_two = value_two
-
+        # the Resolver sets the slot of declarations made in a local scope, a
+        # captured declaration keeps a VariableNode cell in its slot
+        self.slot = None
+        self.is_captured = False
+        # index of the token errors about a declaration or return point at
+        self.token_idx = None
     def execute(self, scope=None):
-
         if self.command == "print":
-
-            print_val = self.value
-
-            if is_executable(self.value):
-
-                print_val = self.value.execute()
-
+            print_val = get_literal_val(self.value, scope)
             print(convert_primitive_to_str(print_val))
-
             return None
-
         elif self.command == "if":
-
-            truth_val = self.value
-
-            if is_executable(self.value):
-
-                truth_val = self.value.execute()
-
-            if truth_val:
-
-                self.value_two.execute()
-
+            truth_val = get_literal_val(self.value, scope)
+            if is_truthy(truth_val):
+                self.value_two.execute(scope)
         elif self.command == "=":
-
-            set_value = self.value_two
-
-            if is_executable(self.value_two):
-
-                set_value = self.value_two.execute()
-
+            set_value = get_literal_val(self.value_two, scope)
             self.value.var_val = set_value
-
             return set_value
-
-        elif self.command == "while":
-
-            while self.value.execute():
-
-                self.value_two.execute()
-
+        elif self.command == "var":
+            self.define_variable(scope, get_literal_val(self.value_two, scope))
+        elif self.command == "fun":
+            self.define_function(scope)
+        elif self.command == "expression":
+            return get_literal_val(self.value, scope)
         elif self.command == "return":
-
-            # debug_output("RETURNING THIS")
-
-            # debug_output(self.value.parent.var_map)
-
-            # debug_output(self.value_two)
-
-            # debug_output(get_literal_val(self.value_two))
-
-            literal_val = get_literal_val(self.value_two)
-
-            curr_scope = self.value
-
-            # if the return is nested, we have to make sure the return value bubbles to function scope
-
-            while not curr_scope.is_function_scope:
-
-                curr_scope.set_return_val(literal_val)
-
-                curr_scope.has_returned = True
-
-                curr_scope = curr_scope.parent
-
-            curr_scope.set_return_val(literal_val)
-
-            curr_scope.has_returned = True
-
+            if tail_calls and isinstance(self.value, FunctionCallNode):
+                scope.set_returned(self.value.tail_call(scope))
+            else:
+                scope.set_returned(get_literal_val(self.value, scope))
+    def define_variable(self, scope, var_val):
+        if self.slot is None:
+            scope.init_variable(self.value, VariableNode(self.value, var_val))
+        elif self.is_captured:
+            scope.slots[self.slot] = VariableNode(self.value, var_val)
+        else:
+            scope.slots[self.slot] = var_val
+    def define_function(self, scope):
+        if self.is_captured:
+            # the function may capture itself, so its cell has to exist first
+            scope.slots[self.slot] = VariableNode(self.value, None)
+        # value_two is the unbound function, it gets its closure scope here
+        arg_names = self.value_two.arg_names
+        body = self.value_two.execution
+        if body.slot_count is None:
+            function = FunctionNode(self.value, arg_names, body, scope)
+        else:
+            # a resolved function keeps only the cells it captures
+            upvalues = capture_upvalues(body.captures, scope)
+            function = FunctionNode(
+                self.value, arg_names, body, scope.global_scope, upvalues
+            )
+        if self.slot is None:
+            scope.init_function(self.value, function)
+        elif self.is_captured:
+            scope.slots[self.slot].var_val = function
+        else:
+            scope.slots[self.slot] = function
     def __repr__(self):
-
         return f"({self.command} {self.value})"
-
 class VariableNode:
-
     def __init__(self, var_name, var_val):
-
         self.var_name = var_name
-
         self.var_val = var_val
-
     def execute(self, scope=None):
-
         if isinstance(self.var_val, VariableNode):
-
             return self.var_val.execute()
-
         return self.var_val
-
     def __repr__(self):
-
         return f"(variable with name {self.var_name} and value {self.var_val})"
-
-def get_literal_val(val):
-
+class IdentifierNode:
+    def __init__(self, var_name):
+        self.var_name = var_name
+        # set by the Resolver, a distance of -1 is a global, -2 an upvalue whose
+        # index is the slot, and None is unresolved
+        self.scope_distance = None
+        self.slot = None
+        self.is_captured = False
+        self.token_idx = None
+    def execute(self, scope=None):
+        if self.scope_distance is not None:
+            if self.scope_distance == -1:
+                try:
+                    return scope.get_global(self.var_name)
+                except Exception as e:
+                    raise runtime_error(e, self.token_idx)
+            if self.scope_distance == -2:
+                return scope.upvalues[self.slot].var_val
+            value = scope.ancestor(self.scope_distance).slots[self.slot]
+            return value.var_val if self.is_captured else value
+        if scope.variable_exists(self.var_name):
+            return scope.get_variable(self.var_name).execute()
+        if scope.function_exists(self.var_name):
+            return scope.get_function(self.var_name)
+        raise runtime_error(
+            Exception(f"Undefined variable '{self.var_name}'."), self.token_idx
+        )
+    def __repr__(self):
+        return f"(identifier {self.var_name})"
+class AssignNode:
+    def __init__(self, var_name, value, token_idx=None):
+        self.var_name = var_name
+        self.value = value
+        self.scope_distance = None
+        self.slot = None
+        self.is_captured = False
+        self.token_idx = token_idx
+    def execute(self, scope=None):
+        set_value = get_literal_val(self.value, scope)
+        try:
+            return self.assign(scope, set_value)
+        except Exception as e:
+            raise runtime_error(e, self.token_idx)
+    def assign(self, scope, set_value):
+        if self.scope_distance is not None:
+            if self.scope_distance == -1:
+                scope.set_global(self.var_name, set_value)
+            elif self.scope_distance == -2:
+                scope.upvalues[self.slot].var_val = set_value
+            elif self.is_captured:
+                scope.ancestor(self.scope_distance).slots[self.slot].var_val = set_value
+            else:
+                scope.ancestor(self.scope_distance).slots[self.slot] = set_value
+            return set_value
+        if not scope.variable_exists(self.var_name):
+            raise Exception(f"Undefined variable '{self.var_name}'.")
+        scope.get_variable(self.var_name).var_val = set_value
+        return set_value
+class BinaryNode:
+    def __init__(self, symbol, left, right, token_idx=None):
+        self.symbol = symbol
+        self.left = left
+        self.right = right
+        # the operator, runtime errors of the node point at its line
+        self.token_idx = token_idx
+    def execute(self, scope=None):
+        left_val = get_literal_val(self.left, scope)
+        if self.symbol == "or":
+            if is_truthy(left_val):
+                return left_val
+            return get_literal_val(self.right, scope)
+        if self.symbol == "and":
+            if not is_truthy(left_val):
+                return left_val
+            return get_literal_val(self.right, scope)
+        right_val = get_literal_val(self.right, scope)
+        try:
+            return apply_binary(self.symbol, left_val, right_val)
+        except Exception as e:
+            raise runtime_error(e, self.token_idx)
+class UnaryNode:
+    def __init__(self, symbol, operand, token_idx=None):
+        self.symbol = symbol
+        self.operand = operand
+        self.token_idx = token_idx
+    def execute(self, scope=None):
+        unary_val = get_literal_val(self.operand, scope)
+        try:
+            return apply_unary(self.symbol, unary_val)
+        except Exception as e:
+            raise runtime_error(e, self.token_idx)
+def get_literal_val(val, scope=None):
     if is_executable(val):
-
-        return val.execute()
-
+        return val.execute(scope)
     return val
-
 class ForNode:
-
-    def __init__(self, params, execution, scope):
-
-        self.params = params
-
-        self.execution = execution
-
-        self.scope = scope
-
-        self.parse_params()
-
-        initializer, condition, increment = self.parse_params()
-
+    def __init__(self, initializer, condition, increment, execution):
         self.initializer = initializer
-
         self.condition = condition
-
         self.increment = increment
-
-    def parse_params(self):
-
-        # initializer, condition, execution
-
-        blocks = []
-
-        curr_block = []
-
-        assert self.params[0][0] == "LEFT_PAREN"
-
-        assert self.params[-1][0] == "RIGHT_PAREN"
-
-        for token in self.params[1:-1]:
-
-            if token[0] == "SEMICOLON":
-
-                curr_block.append(token)
-
-                blocks.append(curr_block)
-
-                curr_block = []
-
-            else:
-
-                curr_block.append(token)
-
-        if curr_block:
-
-            curr_block.append(("SEMICOLON", ";", None))
-
-            blocks.append(curr_block)
-
-        if len(blocks) == 2:
-
-            blocks.append([])
-
-        assert len(blocks) == 3
-
-        return blocks
-
-    def execute(self):
-
-        init_interpreter = Interpreter(self.initializer)
-
-        init_interpreter.execute_all(self.scope)
-
-        while self.evaluate_condition():
-
-            interpreter = Interpreter(self.execution)
-
-            interpreter.execute_all(self.scope)
-
-            increment_interpreter = Interpreter(self.increment)
-
-            increment_interpreter.execute_all(self.scope)
-
-            if self.scope.has_returned:
-
-                break
-
-    def evaluate_condition(self):
-
-        interpreter = Interpreter(self.condition)
-
-        interpreter.evaluate_all(self.scope)
-
-        while interpreter.stack[-1] == ";":
-
-            interpreter.stack.pop()
-
-        res = get_literal_val(interpreter.stack.pop())
-
-        return is_truthy(res)
-
+        self.execution = execution
+        self.needs_scope = is_declaration(initializer)
+        self.slot_count = None
+        self.token_range = None
+        self.back_edges = 0
+        self.compiled = None
+    def execute(self, scope=None):
+        loop_scope = scope
+        if self.needs_scope:
+            loop_scope = Scope(scope, slots=new_slots(self.slot_count))
+        if self.initializer is not None:
+            self.initializer.execute(loop_scope)
+        while self.compiled is None and self.evaluate_condition(loop_scope):
+            self.execution.execute(loop_scope)
+            if loop_scope.has_returned:
+                return
+            get_literal_val(self.increment, loop_scope)
+            self.back_edges += 1
+            if self.back_edges == tier_up_threshold:
+                # the initializer already ran, only the loop itself is swapped
+                remaining_loop = ForNode(
+                    None, self.condition, self.increment, self.execution
+                )
+                self.compiled = tier_up(remaining_loop, "for loop", self.back_edges)
+        if self.compiled is not None:
+            returned = self.compiled(loop_scope)
+            if returned is not None:
+                loop_scope.set_returned(returned[0])
+    def evaluate_condition(self, scope):
+        if self.condition is None:
+            return True
+        return is_truthy(get_literal_val(self.condition, scope))
 class WhileNode:
-
-    def __init__(self, condition, execution, scope):
-
+    def __init__(self, condition, execution):
         self.condition = condition
-
         self.execution = execution
-
-        self.scope = scope
-
-    def execute(self):
-
-        while self.evaluate_condition():
-
-            interpreter = Interpreter(self.execution)
-
-            interpreter.execute_all(self.scope)
-
-            if self.scope.has_returned:
-
-                break
-
-    def evaluate_condition(self):
-
-        interpreter = Interpreter(self.condition)
-
-        interpreter.evaluate_all(self.scope)
-
-        res = get_literal_val(interpreter.stack.pop())
-
-        return is_truthy(res)
-
+        self.token_range = None
+        self.back_edges = 0
+        self.compiled = None
+    def execute(self, scope=None):
+        while self.compiled is None and self.evaluate_condition(scope):
+            self.execution.execute(scope)
+            if scope.has_returned:
+                return
+            self.back_edges += 1
+            if self.back_edges == tier_up_threshold:
+                self.compiled = tier_up(self, "while loop", self.back_edges)
+        if self.compiled is not None:
+            returned = self.compiled(scope)
+            if returned is not None:
+                scope.set_returned(returned[0])
+    def evaluate_condition(self, scope):
+        return is_truthy(get_literal_val(self.condition, scope))
 class FunctionCallNode:
-
-    def __init__(self, function, args):
-
+    def __init__(self, function, args, token_idx=None):
+        self.function = function
+        self.args = args
+        # the closing paren
+        self.token_idx = token_idx
+    def execute(self, scope=None):
+        function = get_literal_val(self.function, scope)
+        if not isinstance(function, (FunctionNode, Clock)):
+            raise runtime_error(
+                Exception("Can only call functions and classes."), self.token_idx
+            )
+        args = [get_literal_val(arg, scope) for arg in self.args]
+        try:
+            return function.call_function(args)
+        except Exception as e:
+            raise runtime_error(e, self.token_idx)
+    def tail_call(self, scope):
+        function = get_literal_val(self.function, scope)
+        if not isinstance(function, (FunctionNode, Clock)):
+            raise runtime_error(
+                Exception("Can only call functions and classes."), self.token_idx
+            )
+        args = [get_literal_val(arg, scope) for arg in self.args]
+        return TailCall(function, args, self.token_idx)
+class TailCall:
+    # returned by a return statement whose value is a call when tail_calls is
+    # set, the call_function that receives it runs the callee in its place
+    __slots__ = ("function", "args", "token_idx")
+    def __init__(self, function, args, token_idx=None):
         self.function = function
-
         self.args = args
-
-    def execute(self):
-
-        return self.function.call_function(self.args)
-
+        # the closing paren of the call, for its errors
+        self.token_idx = token_idx
+def run_tail_calls(return_val):
+    while type(return_val) is TailCall:
+        function = return_val.function
+        try:
+            if isinstance(function, FunctionNode):
+                return_val = function.call_function(return_val.args, is_tail_call=True)
+            else:
+                return_val = function.call_function(return_val.args)
+        except Exception as e:
+            raise runtime_error(e, return_val.token_idx)
+    return return_val
 class Clock:
-
     def __init__(self):
-
         pass
-
-    def execute(self):
-
+    def execute(self, scope=None):
         return self
-
     def call_function(self, args):
-
         return int(time())
-
+    def __call__(self, *args):
+        # the python engine calls it directly
+        return self.call_function(args)
+# shared by every resolved scope, their locals live in slots instead
+empty_map = MappingProxyType({})
+def new_slots(slot_count):
+    if slot_count is None:
+        return None
+    return [None] * slot_count
 class Scope:
-
     # used to manage scopes
-
-    def __init__(self, parent=None, is_function_scope=False):
-
-        self.var_map = {}
-
+    __slots__ = (
+        "var_map",
+        "parent",
+        "slots",
+        "global_scope",
+        "upvalues",
+        "func_map",
+        "return_val",
+        "has_returned",
+        "is_function_scope",
+    )
+    def __init__(self, parent=None, is_function_scope=False, slots=None):
         self.parent = parent
-
-        self.func_map = {}
-
-        self.init_func_map()
-
+        # locals bound by the Resolver live in slots, globals stay in the maps
+        self.slots = slots
+        if slots is None:
+            self.var_map = {}
+            self.func_map = {}
+        else:
+            self.var_map = empty_map
+            self.func_map = empty_map
+        if parent is None:
+            self.global_scope = self
+            self.upvalues = None
+            self.init_func_map()
+        else:
+            self.global_scope = parent.global_scope
+            # blocks reach the upvalues of the function they are in
+            self.upvalues = parent.upvalues
         self.return_val = None
-
         self.has_returned = False
-
         self.is_function_scope = is_function_scope
-
     def get_return_val(self):
-
         return self.return_val
-
     def set_return_val(self, value):
-
         self.return_val = value
-
+    def set_returned(self, value):
+        curr_scope = self
+        # if the return is nested, we have to make sure the return value bubbles to function scope
+        while not curr_scope.is_function_scope:
+            curr_scope.set_return_val(value)
+            curr_scope.has_returned = True
+            curr_scope = curr_scope.parent
+        curr_scope.set_return_val(value)
+        curr_scope.has_returned = True
     def init_func_map(self):
-
         self.func_map["clock"] = Clock()
-
     def get_var_map(self):
-
         return self.var_map
-
     def function_exists(self, func_name):
-
         if self.parent is None:
-
             return func_name in self.func_map
-
         if func_name in self.func_map:
-
             return True
-
         return self.parent.function_exists(func_name)
-
     def get_function(self, func_name):
-
         if self.parent is None:
-
             return self.func_map[func_name]
-
         if func_name in self.func_map:
-
             return self.func_map[func_name]
-
         return self.parent.get_function(func_name)
-
     def variable_exists(self, var_name):
-
         if self.parent is None:
-
             return var_name in self.var_map
-
         if var_name in self.var_map:
-
             return True
-
         return self.parent.variable_exists(var_name)
-
     def get_variable(self, var_name):
-
         if self.parent is None:
-
             return self.var_map[var_name]
-
         if var_name in self.var_map:
-
             return self.var_map[var_name]
-
         return self.parent.get_variable(var_name)
-
     def init_variable(self, var_name, var_node):
-
         self.var_map[var_name] = var_node
-
+    def ancestor(self, scope_distance):
+        scope = self
+        while scope_distance:
+            scope = scope.parent
+            scope_distance -= 1
+        return scope
+    def get_global(self, var_name):
+        global_scope = self.global_scope
+        if var_name in global_scope.var_map:
+            return global_scope.var_map[var_name].execute()
+        if var_name in global_scope.func_map:
+            return global_scope.func_map[var_name]
+        raise Exception(f"Undefined variable '{var_name}'.")
+    def set_global(self, var_name, value):
+        global_scope = self.global_scope
+        if var_name not in global_scope.var_map:
+            raise Exception(f"Undefined variable '{var_name}'.")
+        global_scope.var_map[var_name].var_val = value
     def init_function(self, func_name, function_node):
-
         self.func_map[func_name] = function_node
-
     def set_variable(self, var_name, var_node):
-
         if self.parent is None:
-
             assert var_name in self.var_map
-
             self.var_map[var_name] = var_node
-
         if var_name in self.var_map:
-
             self.var_map[var_name] = var_node
-
         else:
-
             self.parent.set_variable(var_name, var_node)
-
 class FunctionNode:
-
-    def __init__(self, func_name, arg_tokens, execution, scope):
-
+    def __init__(self, func_name, arg_names, execution, scope, upvalues=None):
         self.func_name = func_name
-
-        self.arg_names = self.get_arg_names(arg_tokens)
-
+        self.arg_names = arg_names
+        # execution is the compiled BlockNode of the function body
         self.execution = execution
-
         self.scope = scope
-
-    def get_arg_names(self, arg_tokens):
-
-        assert arg_tokens[0][0] == "LEFT_PAREN"
-
-        assert arg_tokens[-1][0] == "RIGHT_PAREN"
-
-        arg_names = []
-
-        idx = 0
-
-        arg_token_spliced = arg_tokens[1:-1]
-
-        while idx < len(arg_token_spliced):
-
-            arg_names.append(arg_token_spliced[idx][1])
-
-            idx += 1
-
-            if idx < len(arg_token_spliced):
-
-                assert arg_token_spliced[idx][1] == ","
-
-                idx += 1
-
-        return arg_names
-
-    def get_arg_literals(self, args):
-
-        assert args[0][0] == "LEFT_PAREN"
-
-        assert args[-1][0] == "RIGHT_PAREN"
-
-        arg_literals = []
-
-        idx = 0
-
-        arg_token_spliced = args[1:-1]
-
-        while idx < len(arg_token_spliced):
-
-            arg_literals.append(arg_token_spliced[idx][1])
-
-            idx += 1
-
-            if idx < len(arg_token_spliced):
-
-                assert arg_token_spliced[idx][1] == ","
-
-                idx += 1
-
-        return args
-
-    def call_function(self, args):
-
-        func_scope = Scope(self.scope, is_function_scope=True)
-
-        assert len(self.arg_names) == len(args), (self.arg_names, args)
-
-        for key, val in zip(self.arg_names, args):
-
-            func_scope.init_variable(key, val)
-
-        execution_interpreter = Interpreter(self.execution)
-
-        execution_interpreter.execute_all(func_scope)
-
-        return func_scope.get_return_val()
-
-    def execute(self):
-
+        # the cells of the outer variables a resolved function uses
+        self.upvalues = upvalues
+        # (start, end) of the declaration's tokens, set by Parser
+        self.token_range = None
+    def call_function(self, args, is_tail_call=False):
+        if len(args) != len(self.arg_names):
+            raise arity_error(len(self.arg_names), len(args))
+        execution = self.execution
+        func_scope = new_function_scope(self, args, execution)
+        if execution.compiled is None:
+            execution.call_count += 1
+            if execution.call_count == tier_up_threshold:
+                execution.compiled = tier_up(
+                    execution, f"function {self.func_name}", execution.call_count
+                )
+        if execution.compiled is not None:
+            returned = execution.compiled(func_scope)
+            return_val = None if returned is None else returned[0]
+        else:
+            execution.execute_statements(func_scope)
+            return_val = func_scope.get_return_val()
+        if execution.slot_count is not None:
+            release_function_scope(func_scope)
+        if type(return_val) is TailCall and not is_tail_call:
+            # the frame is gone, tail calls loop here instead of nesting
+            return run_tail_calls(return_val)
+        return return_val
+    def execute(self, scope=None):
         return self
-
+free_frames = []
+max_free_frames = 256
+def capture_upvalues(captures, scope):
+    upvalues = []
+    for scope_distance, slot in captures:
+        if scope_distance == -2:
+            upvalues.append(scope.upvalues[slot])
+        else:
+            upvalues.append(scope.ancestor(scope_distance).slots[slot])
+    return upvalues
+def new_function_scope(function, args, body):
+    slot_count = body.slot_count
+    if slot_count is None:
+        func_scope = Scope(function.scope, is_function_scope=True)
+        for key, val in zip(function.arg_names, args):
+            func_scope.init_variable(key, VariableNode(key, val))
+        return func_scope
+    for index in body.captured_args:
+        args[index] = VariableNode(function.arg_names[index], args[index])
+    # the parameters take the first slots of the function scope
+    args.extend([None] * (slot_count - len(args)))
+    if free_frames:
+        func_scope = free_frames.pop()
+        func_scope.parent = function.scope
+        func_scope.global_scope = function.scope.global_scope
+        func_scope.slots = args
+    else:
+        func_scope = Scope(function.scope, is_function_scope=True, slots=args)
+    func_scope.upvalues = function.upvalues
+    return func_scope
+def release_function_scope(func_scope):
+    # closures never reference a resolved call frame, so it can be reused
+    if len(free_frames) < max_free_frames:
+        func_scope.parent = None
+        func_scope.slots = None
+        func_scope.upvalues = None
+        func_scope.return_val = None
+        func_scope.has_returned = False
+        free_frames.append(func_scope)
+def tier_up(node, description, count):
+    if isinstance(node, BlockNode):
+        # function bodies run directly in the function scope
+        compiled = ClosureCompiler().compile_statements(node.statements)
+    else:
+        compiled = ClosureCompiler().compile_statement(node)
+    if debug_tiering:
+        print(f"[tier-up] {description} after {count} runs", file=sys.stderr)
+    return compiled
+executable_types = (
+    Executable,
+    BlockNode,
+    VariableNode,
+    ElseIfBlockNode,
+    WhileNode,
+    ForNode,
+    FunctionCallNode,
+    FunctionNode,
+    IdentifierNode,
+    AssignNode,
+    BinaryNode,
+    UnaryNode,
+)
 def is_truthy(val):
-
     if isinstance(val, bool) and not val:
-
         return False
-
     if val == "":
-
         return True
-
     if val == 0:
-
         return True
-
     return bool(val)
-
+def is_numeric_literal(val):
+    if isinstance(val, bool):
+        return False
+    return isinstance(val, int) or isinstance(val, float)
+def is_str_literal(val):
+    return isinstance(val, str)
+def apply_unary(symbol, unary_val):
+    if symbol == "!":
+        return not is_truthy(unary_val)
+    if not is_numeric_literal(unary_val):
+        raise Exception("Operand must be a number.")
+    return -1 * unary_val
+def apply_binary(symbol, left_val, right_val):
+    if symbol == "*":
+        if not is_numeric_literal(left_val) or not is_numeric_literal(right_val):
+            raise Exception("Operand must be a number.")
+        return_val = left_val * right_val
+    elif symbol == "/":
+        if not is_numeric_literal(left_val) or not is_numeric_literal(right_val):
+            raise Exception("Operand must be a number.")
+        return_val = left_val / right_val
+        return_val = (
+            int(return_val)
+            if isinstance(return_val, float) and return_val.is_integer()
+            else return_val
+        )
+    elif symbol == "-":
+        if not is_numeric_literal(left_val) or not is_numeric_literal(right_val):
+            raise Exception("Operand must be a number.")
+        return_val = left_val - right_val
+    elif symbol == "+":
+        if not (
+            (is_str_literal(left_val) and is_str_literal(right_val))
+            or (is_numeric_literal(left_val) and is_numeric_literal(right_val))
+        ):
+            raise Exception("Operand must be both number or strings.")
+        return_val = left_val + right_val
+    elif symbol == ">":
+        if not is_numeric_literal(left_val) or not is_numeric_literal(right_val):
+            raise Exception("Operand must be a number.")
+        return_val = left_val > right_val
+    elif symbol == "<":
+        if not is_numeric_literal(left_val) or not is_numeric_literal(right_val):
+            raise Exception("Operand must be a number.")
+        return_val = left_val < right_val
+    elif symbol == "<=":
+        if not is_numeric_literal(left_val) or not is_numeric_literal(right_val):
+            raise Exception("Operand must be a number.")
+        return_val = left_val <= right_val
+    elif symbol == ">=":
+        if not is_numeric_literal(left_val) or not is_numeric_literal(right_val):
+            raise Exception("Operand must be a number.")
+        return_val = left_val >= right_val
+    elif symbol == "==":
+        return_val = left_val == right_val
+    elif symbol == "!=":
+        return_val = left_val != right_val
+    elif symbol == "or":
+        return_val = left_val or right_val
+    elif symbol == "and":
+        res = is_truthy(left_val) and is_truthy(right_val)
+        if res:
+            return_val = right_val
+        else:
+            return_val = False
+    else:
+        return_val = None
+    return return_val
+# the binary operators by token kind, as (symbol, binding power). operators
+# with a higher power bind tighter, all of them are left associative
+binary_operators = {
+    TOKEN_OR: ("or", 1),
+    TOKEN_AND: ("and", 2),
+    TOKEN_EQUAL_EQUAL: ("==", 3),
+    TOKEN_BANG_EQUAL: ("!=", 3),
+    TOKEN_GREATER: (">", 4),
+    TOKEN_GREATER_EQUAL: (">=", 4),
+    TOKEN_LESS: ("<", 4),
+    TOKEN_LESS_EQUAL: ("<=", 4),
+    TOKEN_MINUS: ("-", 5),
+    TOKEN_PLUS: ("+", 5),
+    TOKEN_SLASH: ("/", 6),
+    TOKEN_STAR: ("*", 6),
+}
+# tokens an operand can start with
+operand_kinds = {
+    TOKEN_NIL,
+    TOKEN_FALSE,
+    TOKEN_TRUE,
+    TOKEN_NUMBER,
+    TOKEN_STRING,
+    TOKEN_IDENTIFIER,
+    TOKEN_LEFT_PAREN,
+    TOKEN_BANG,
+    TOKEN_MINUS,
+}
+def syntax_error(tokens, idx, end, message):
+    # a compile error pointing at the token at idx, or at the end once idx
+    # reaches end
+    where = "end" if idx >= end else f"'{tokens.lexeme(idx)}'"
+    return Exception(f"[line {tokens.line(idx)}] Error at {where}: {message}")
+def parse_binary_operators(kinds, reader, operand, combine):
+    # precedence climbing over the tokens from reader.idx up to reader.end.
+    # operand reads the next operand and combine joins two of them around an
+    # operator, given with the index of its token. operators still waiting for
+    # their right side are kept on a stack, so an expression of any length is
+    # read in one loop
+    operands = [operand()]
+    waiting = []
+    while True:
+        operator = None
+        if reader.idx < reader.end:
+            operator = binary_operators.get(kinds[reader.idx])
+        power = 0 if operator is None else operator[1]
+        while waiting and waiting[-1][1] >= power:
+            right = operands.pop()
+            symbol, _, operator_idx = waiting.pop()
+            operands[-1] = combine(symbol, operands[-1], right, operator_idx)
+        if operator is None:
+            return operands[0]
+        waiting.append((*operator, reader.idx))
+        reader.idx += 1
+        operands.append(operand())
 class Interpreter:
-
-    def __init__(self, tokens):
-
+    # runs the tokens in [start, end) of the shared token store
+    def __init__(self, tokens, start=0, end=None):
         self.tokens = tokens
-
-        self.idx = 0
-
+        self.idx = start
+        self.end = len(tokens) if end is None else end
         self.stack = []
-
-        self.processing_add_minus = False
-
-        self.is_comparing = False
-
-        self.is_defining = False
-
     def execute_all(self, scope=None):
-
         var_map = Scope() if scope is None else scope
-
         assert var_map.has_returned == False, "scope marked as return true"
-
-        while self.idx < len(self.tokens):
-
+        while self.idx < self.end:
             self.evaluate_next(var_map)
-
             if not self.stack:
-
                 continue
-
             was_complete_statement = False
-
             while self.stack and self.stack[-1] == ";":
-
                 self.stack.pop()
-
                 was_complete_statement = True
-
             if not self.stack:
-
                 return
-
             res = self.stack.pop()
-
             if is_executable(res) and not isinstance(res, VariableNode):
-
-                self.stack.append(res.execute())
-
+                self.stack.append(res.execute(var_map))
             else:
-
                 self.stack.append(res)
-
             if was_complete_statement:
-
                 self.stack = []
-
             if var_map.has_returned:
-
                 return
-
     def evaluate_all(self, var_map=None):
-
         if var_map is None:
-
             var_map = Scope()
-
-        while self.idx < len(self.tokens):
-
+        while self.idx < self.end:
             self.evaluate_next(var_map)
-
     def evaluate_next(self, var_map, auto_execute=True):
-
         # print(self.stack)
-
-        token, word, value = self.tokens[self.idx]
-
+        kind = self.tokens.kinds[self.idx]
         if debug:
-
             print(self.stack)
-
-            print(token, word)
-
-        if token in ("NIL", "FALSE", "TRUE"):
-
-            self.idx += 1
-
-            if token == "NIL":
-
-                self.stack.append(None)
-
-            elif token == "FALSE":
-
-                self.stack.append(False)
-
-            elif token == "TRUE":
-
-                self.stack.append(True)
-
-        if token == "NUMBER":
-
-            self.idx += 1
-
-            self.stack.append(int(value) if value.is_integer() else value)
-
-            if (
-
-                (self.processing_add_minus or self.is_comparing)
-
-                and self.idx < len(self.tokens)
-
-                and self.tokens[self.idx][0] in ("SLASH", "STAR")
-
-            ):
-
-                self.evaluate_next(var_map, auto_execute)
-
-        if token == "STRING":
-
-            self.idx += 1
-
-            self.stack.append(value)
-
-        if token == "LEFT_PAREN":
-
-            self.idx += 1
-
-            if (
-
-                self.stack
-
-                and not is_executable(self.stack[-1])
-
-                and self.stack[-1] is not None
-
-            ):
-
-                raise Exception("INVALID FUNCTION CALL")
-
-            if self.stack and is_executable(self.stack[-1]):
-
-                res = self.stack.pop().execute()
-
-                assert isinstance(
-
-                    res, FunctionNode
-
-                ), "function call is not function return"
-
-                self.stack.append(res)
-
-            if self.stack and isinstance(self.stack[-1], FunctionNode):
-
-                func_args = self.parse_func_args(var_map)
-
-                function = self.stack.pop()
-
-                self.stack.append(FunctionCallNode(function, func_args))
-
-                return
-
-            self.match(")", var_map)
-
-            self.stack.append(self.stack.pop())
-
-            if (
-
-                (self.processing_add_minus or self.is_comparing or self.is_defining)
-
-                and self.idx < len(self.tokens)
-
-                and self.tokens[self.idx][0] in ("SLASH", "STAR", "MINUS", "PLUS")
-
-            ):
-
-                self.evaluate_next(var_map, auto_execute)
-
-        if token == "RIGHT_PAREN":
-
+            print(token_kinds[kind], self.tokens.lexeme(self.idx))
+        if kind in operand_kinds:
+            self.evaluate_expression(var_map)
+            return None
+        if kind in binary_operators:
+            raise Exception(
+                f"[line {self.tokens.line(self.idx)}] Error at "
+                f"'{self.tokens.lexeme(self.idx)}': Expect expression."
+            )
+        # one branch per kind, compared as integer codes
+        if kind == TOKEN_RIGHT_PAREN:
             self.idx += 1
-
             self.stack.append(")")
-
-        if token == "BANG":
-
+        elif kind == TOKEN_EQUAL:
             self.idx += 1
-
-            self.evaluate_next(var_map, auto_execute)
-
-            res = self.stack.pop()
-
-            if is_executable(res):
-
-                res = res.execute()
-
-            return_val = not res
-
-            self.stack.append(return_val)
-
-        if token == "MINUS":
-
-            if len(self.stack) > 0:
-
-                self.processing_add_minus = True
-
-                self.evaluate_binary("-", var_map)
-
-                self.processing_add_minus = False
-
-            else:
-
-                self.idx += 1
-
-                self.evaluate_next(var_map, auto_execute)
-
-                unary_val = self.stack.pop()
-
-                if isinstance(unary_val, bool):
-
-                    raise Exception("Operand must be a number, not bool.")
-
-                if not isinstance(unary_val, float) and not isinstance(unary_val, int):
-
-                    raise Exception("Operand must be a number.")
-
-                return_val = -1 * unary_val
-
-                self.stack.append(return_val)
-
-        if token == "STAR":
-
-            self.evaluate_binary("*", var_map)
-
-            if (
-
-                self.is_comparing
-
-                and self.idx < len(self.tokens)
-
-                and self.tokens[self.idx][0] in ("SLASH", "STAR", "MINUS", "PLUS")
-
-            ):
-
-                self.evaluate_next(var_map, auto_execute)
-
-        if token == "SLASH":
-
-            self.evaluate_binary("/", var_map)
-
-            if (
-
-                self.is_comparing
-
-                and self.idx < len(self.tokens)
-
-                and self.tokens[self.idx][0] in ("SLASH", "STAR", "MINUS", "PLUS")
-
-            ):
-
-                self.evaluate_next(var_map, auto_execute)
-
-        if token == "PLUS":
-
-            self.processing_add_minus = True
-
-            self.evaluate_binary("+", var_map)
-
-            if (
-
-                self.is_comparing
-
-                and self.idx < len(self.tokens)
-
-                and self.tokens[self.idx][0] in ("SLASH", "STAR", "MINUS", "PLUS")
-
-            ):
-
-                self.evaluate_next(var_map, auto_execute)
-
-            self.processing_add_minus = False
-
-        if token == "LESS":
-
-            self.is_comparing = True
-
-            self.evaluate_binary("<", var_map)
-
-            self.is_comparing = False
-
-        if token == "GREATER":
-
-            self.idx += 1
-
-            self.is_comparing = True
-
-            # self.evaluate_binary('>', var_map)
-
             left = self.stack.pop()
-
-            left = get_literal_val(left)
-
-            token = self.match_multiple_or_end([")", ";", "}"], var_map)
-
+            token = self.match_multiple([";", ")"], var_map)
             right = self.stack.pop()
-
-            right = get_literal_val(right)
-
-            if not self.is_numeric_literal(left) or not self.is_numeric_literal(right):
-
-                raise Exception("Operand must be a number.")
-
-            self.stack.append(left > right)
-
-            if token:
-
-                self.stack.append(token)
-
-            self.is_comparing = False
-
-        if token == "GREATER_EQUAL":
-
-            self.is_comparing = True
-
-            self.evaluate_binary(">=", var_map)
-
-            self.is_comparing = False
-
-        if token == "LESS_EQUAL":
-
-            self.is_comparing = True
-
-            self.evaluate_binary("<=", var_map)
-
-            self.is_comparing = False
-
-        if token == "EQUAL":
-
-            if self.is_defining:
-
-                self.idx += 1
-
-                self.stack.append("=")
-
-            else:
-
-                self.idx += 1
-
-                left = self.stack.pop()
-
-                token = self.match_multiple([";", ")"], var_map)
-
-                right = self.stack.pop()
-
-                if isinstance(right, VariableNode):
-
-                    right = right.execute()
-
-                self.stack.append(Executable("=", left, right))
-
-                # left.var_val = right
-
-                # self.stack.append(right)
-
-                self.stack.append(token)
-
-        if token == "EQUAL_EQUAL":
-
-            self.is_comparing = True
-
-            self.evaluate_binary("==", var_map)
-
-            self.is_comparing = False
-
-        if token == "BANG_EQUAL":
-
-            self.is_comparing = True
-
-            self.evaluate_binary("!=", var_map)
-
-            self.is_comparing = False
-
-        if token == "SEMICOLON":
-
+            if isinstance(right, VariableNode):
+                right = right.execute()
+            self.stack.append(Executable("=", left, right))
+            # left.var_val = right
+            # self.stack.append(right)
+            self.stack.append(token)
+        elif kind == TOKEN_SEMICOLON:
             self.idx += 1
-
-            self.is_defining = False
-
             self.stack.append(";")
-
-        if token == "PRINT":
-
+        elif kind == TOKEN_PRINT:
             self.idx += 1
-
             self.match(";", var_map)
-
             unary_val = self.stack.pop()
-
             self.stack.append(Executable("print", unary_val))
-
             self.stack.append(";")  # moved semicolon after unary val
-
-        if token == "VAR":
-
-            self.is_defining = True
-
+        elif kind == TOKEN_VAR:
             self.idx += 1
-
-            self.evaluate_next(var_map, auto_execute)
-
-            var_name = self.stack.pop()
-
-            self.evaluate_next(var_map, auto_execute)
-
-            if self.stack[-1] == ";":
-
-                self.stack.pop()
-
+            if self.idx >= self.end or self.tokens.kinds[self.idx] != TOKEN_IDENTIFIER:
+                raise syntax_error(
+                    self.tokens, self.idx, self.end, "Expect variable name."
+                )
+            var_name = self.tokens.lexeme(self.idx)
+            self.idx += 1
+            kind = self.tokens.kinds[self.idx] if self.idx < self.end else TOKEN_EOF
+            if kind == TOKEN_SEMICOLON:
+                self.idx += 1
                 var_node = VariableNode(var_name, None)
-
                 var_map.init_variable(var_name, var_node)
-
                 return
-
-            assert self.stack.pop() == "="
-
-            self.is_defining = False
-
+            if kind != TOKEN_EQUAL:
+                raise syntax_error(
+                    self.tokens,
+                    self.idx,
+                    self.end,
+                    "Expect ';' after variable declaration.",
+                )
+            self.idx += 1
             try:
-
                 self.evaluate_next(var_map, auto_execute)
-
                 while self.stack[-1] != ";":
-
                     self.evaluate_next(var_map, auto_execute)
-
             except IndexError:
-
-                raise Exception("[line 1] expect close")
-
+                raise syntax_error(
+                    self.tokens,
+                    self.idx,
+                    self.end,
+                    "Expect ';' after variable declaration.",
+                )
             self.stack.pop()
-
             var_val = get_literal_val(self.stack.pop())
-
             var_node = VariableNode(var_name, var_val)
-
             var_map.init_variable(var_name, var_node)
-
-        if token == "IDENTIFIER":
-
+        elif kind == TOKEN_RIGHT_BRACE:
             self.idx += 1
-
-            if (
-
-                not self.is_defining
-
-                and not var_map.variable_exists(word)
-
-                and not var_map.function_exists(word)
-
-            ):
-
-                raise Exception("undefined var")
-
-            if self.is_defining:
-
-                self.stack.append(word)
-
-            elif var_map.variable_exists(word):
-
-                self.stack.append(var_map.get_variable(word))
-
-            elif var_map.function_exists(word):
-
-                if self.tokens[self.idx][0] == "LEFT_PAREN":
-
-                    self.idx += 1
-
-                    func_args = []
-
-                    self.stack.append("(")
-
-                    popped_token = None
-
-                    while popped_token != ")":
-
-                        while self.stack[-1] not in [",", ")"]:
-
-                            self.evaluate_next(var_map)
-
-                        popped_token = self.stack.pop()
-
-                        if self.stack[-1] != "(":
-
-                            func_args.append(get_literal_val(self.stack.pop()))
-
-                    left_paren = self.stack.pop()
-
-                    assert left_paren == "(", left_paren
-
-                    self.stack.append(
-
-                        FunctionCallNode(var_map.get_function(word), func_args)
-
-                    )
-
-                else:
-
-                    self.stack.append(var_map.get_function(word))
-
-            else:
-
-                raise Exception("SOME OTHER THING")
-
-        if token == "RIGHT_BRACE":
-
-            self.idx += 1
-
             self.stack.append("}")
-
-        if token == "COMMA":
-
+        elif kind == TOKEN_COMMA:
             self.idx += 1
-
             self.stack.append(",")
-
-        if token == "LEFT_BRACE":
-
-            self.idx += 1
-
-            block_tokens = []
-
-            braces = ["{"]
-
-            next_var_map = Scope(var_map)
-
-            while braces:
-
-                next_token, next_word, _ = self.tokens[self.idx]
-
-                if next_token == "LEFT_BRACE":
-
-                    braces.append("{")
-
-                elif next_token == "RIGHT_BRACE":
-
-                    braces.pop()
-
-                block_tokens.append(self.tokens[self.idx])
-
-                self.idx += 1
-
-            # popping off the right brace
-
-            assert block_tokens.pop()[0] == "RIGHT_BRACE", "not right brace"
-
-            block_node = BlockNode(block_tokens, next_var_map)
-
+        elif kind == TOKEN_LEFT_BRACE:
+            block_node = self.compile_next_statement(self.idx)
             if auto_execute:
-
-                block_node.execute()
-
+                block_node.execute(var_map)
             else:
-
                 self.stack.append(block_node)
-
-        if token == "IF":
-
+        elif kind == TOKEN_IF:
             self.idx += 1
-
             self.evaluate_next(var_map, auto_execute)
-
             truth_val = self.stack.pop()
-
             self.evaluate_next(var_map, auto_execute=False)
-
             while self.stack[-1] == ";":
-
                 self.stack.pop()
-
             executable = self.stack.pop()
-
-            if self.idx >= len(self.tokens) or (
-
-                self.idx < len(self.tokens) and self.tokens[self.idx][0] != "ELSE"
-
-            ):
-
+            if self.idx >= self.end or self.tokens.kinds[self.idx] != TOKEN_ELSE:
                 self.stack.append(Executable("if", truth_val, executable))
-
                 return
-
             self.evaluate_next(var_map, auto_execute)
-
             else_if_block = self.stack.pop()
-
             self.stack.append(
-
                 ElseIfBlockNode(
-
                     [IfNode(truth_val, executable)] + else_if_block.if_nodes,
-
                     else_if_block.else_statement,
-
                 )
-
             )
-
-        if token == "ELSE":
-
+        elif kind == TOKEN_ELSE:
             self.idx += 1
-
             self.evaluate_next(var_map, auto_execute=False)
-
             while self.stack[-1] == ";":
-
                 self.stack.pop()
-
             executable = self.stack.pop()
-
             self.stack.append(ElseIfBlockNode([], executable))
-
-        if token == "RETURN":
-
+        elif kind == TOKEN_RETURN:
             self.idx += 1
-
             self.stack.append("return")
-
             self.match(";", var_map)
-
             if self.stack[-1] == "return":
-
                 self.stack.pop()
-
-                self.stack.append(Executable("return", var_map, None))
-
+                self.stack.append(Executable("return", None))
                 return
-
             return_val = self.stack.pop()
-
             # pop the return token
-
             assert self.stack.pop() == "return"
-
             # if var_map.get_variable('n') == 2:
-
             #    debug_output(("N", return_val))
-
-            self.stack.append(Executable("return", var_map, return_val))
-
-        if token == "OR":
-
-            self.evaluate_binary("or", var_map)
-
-        if token == "AND":
-
-            self.evaluate_binary("and", var_map)
-
-        if token == "WHILE":
-
-            self.idx += 1
-
-            evaluation_tokens = []
-
-            assert self.tokens[self.idx][0] == "LEFT_PAREN"
-
+            self.stack.append(Executable("return", return_val))
+        elif kind == TOKEN_WHILE or kind == TOKEN_FOR:
+            start = self.idx
             self.idx += 1
-
-            paren_stack = ["("]
-
-            while paren_stack:
-
-                if self.tokens[self.idx][0] == "LEFT_PAREN":
-
-                    paren_stack.append("(")
-
-                elif self.tokens[self.idx][0] == "RIGHT_PAREN":
-
-                    paren_stack.pop()
-
-                evaluation_tokens.append(self.tokens[self.idx])
-
-                self.idx += 1
-
-            assert evaluation_tokens.pop()[0] == "RIGHT_PAREN"
-
-            # self.evaluate_next(var_map)
-
-            # self.clear_semicolons()
-
-            block_tokens = self.get_next_statement_or_block_tokens()
-
-            self.stack.append(WhileNode(evaluation_tokens, block_tokens, var_map))
-
-        if token == "FOR":
-
+            self.skip_next_parens()
+            self.stack.append(self.compile_next_statement(start))
+        elif kind == TOKEN_FUN:
+            start = self.idx
+            # skipping the fun keyword and the function name
+            self.idx += 2
+            self.skip_next_parens()
+            self.compile_next_statement(start).execute(var_map)
+        return None
+    def evaluate_expression(self, var_map):
+        # pushes the value of the operands and binary operators from idx. a
+        # lone variable or call is pushed as it is, for its user to run
+        value = self.evaluate_operators(var_map)
+        if isinstance(value, (BinaryNode, UnaryNode)):
+            value = value.execute()
+        self.stack.append(value)
+    def evaluate_operators(self, var_map):
+        return parse_binary_operators(
+            self.tokens.kinds,
+            self,
+            lambda: self.evaluate_operand(var_map),
+            self.evaluate_binary,
+        )
+    def evaluate_binary(self, symbol, left_val, right_val, token_idx):
+        # operators become nodes, so operands run left to right once the whole
+        # expression is read and "and" and "or" can skip their right side.
+        # plain values are combined right away to keep long chains shallow,
+        # unless that fails and the error has to wait until the node runs
+        node = BinaryNode(symbol, left_val, right_val, token_idx)
+        if is_executable(left_val) or is_executable(right_val):
+            return node
+        try:
+            return node.execute()
+        except Exception:
+            return node
+    def evaluate_operand(self, var_map):
+        # a literal, name, group or call, or a unary operator applied to one
+        if self.idx >= self.end:
+            raise Exception(
+                f"[line {self.tokens.line(self.idx)}] Error at end: "
+                "Expect expression."
+            )
+        kind = self.tokens.kinds[self.idx]
+        if kind == TOKEN_BANG or kind == TOKEN_MINUS:
+            symbol_idx = self.idx
             self.idx += 1
-
-            parens = self.get_next_parens()
-
-            execution = self.get_next_statement_or_block_tokens()
-
-            self.stack.append(ForNode(parens, execution, var_map))
-
-        if token == "FUN":
-
+            operand = self.evaluate_operand(var_map)
+            return UnaryNode(self.tokens.lexeme(symbol_idx), operand, symbol_idx)
+        value = self.evaluate_primary(var_map)
+        while self.idx < self.end and self.tokens.kinds[self.idx] == TOKEN_LEFT_PAREN:
+            paren_idx = self.idx
             self.idx += 1
-
-            self.is_defining = True
-
-            self.evaluate_next(var_map)
-
-            func_name = self.stack.pop()
-
-            parens = self.get_next_parens()
-
-            executable = self.get_next_statement_or_block_tokens()
-
-            var_map.init_function(
-
-                func_name, FunctionNode(func_name, parens, executable, var_map)
-
-            )
-
-            self.is_defining = False
-
-        return None
-
+            if is_executable(value):
+                value = value.execute()
+            if not isinstance(value, FunctionNode):
+                raise runtime_error(
+                    Exception("Can only call functions and classes."), paren_idx
+                )
+            args = self.parse_func_args(var_map)
+            value = FunctionCallNode(value, args, self.idx - 1)
+        return value
+    def evaluate_primary(self, var_map):
+        kind = self.tokens.kinds[self.idx]
+        self.idx += 1
+        if kind == TOKEN_NIL:
+            return None
+        if kind == TOKEN_FALSE:
+            return False
+        if kind == TOKEN_TRUE:
+            return True
+        if kind == TOKEN_NUMBER:
+            value = self.tokens.literal(self.idx - 1)
+            return int(value) if value.is_integer() else value
+        if kind == TOKEN_STRING:
+            return self.tokens.literal(self.idx - 1)
+        if kind == TOKEN_IDENTIFIER:
+            word = self.tokens.lexeme(self.idx - 1)
+            if var_map.variable_exists(word):
+                return var_map.get_variable(word)
+            if not var_map.function_exists(word):
+                raise runtime_error(
+                    Exception(f"Undefined variable '{word}'."), self.idx - 1
+                )
+            function = var_map.get_function(word)
+            if self.idx < self.end and self.tokens.kinds[self.idx] == TOKEN_LEFT_PAREN:
+                self.idx += 1
+                args = self.parse_func_args(var_map)
+                return FunctionCallNode(function, args, self.idx - 1)
+            return function
+        if kind == TOKEN_LEFT_PAREN:
+            value = self.evaluate_operators(var_map)
+            if self.idx < self.end and self.tokens.kinds[self.idx] == TOKEN_RIGHT_PAREN:
+                self.idx += 1
+                return value
+            # the rest, like an assignment, is left to the statement walker
+            self.stack.append(value)
+            self.match(")", var_map)
+            return self.stack.pop()
+        raise Exception(
+            f"[line {self.tokens.line(self.idx - 1)}] Error at "
+            f"'{self.tokens.lexeme(self.idx - 1)}': Expect expression."
+        )
+    def compile_next_statement(self, start):
+        # compiles the next statement or block once, so loop and function
+        # bodies are not re-interpreted from tokens on every iteration
+        self.skip_statement_or_block()
+        return Parser(self.tokens, start, self.idx).compile_declaration()
     def match(self, symbol, var_map, pop_token=True):
-
         self.evaluate_next(var_map)
-
         try:
-
             while self.stack[-1] != symbol:
-
                 self.evaluate_next(var_map)
-
         except IndexError:
-
-            raise Exception(f"[line 1] expect {symbol}")
-
+            raise syntax_error(self.tokens, self.idx, self.end, f"Expect '{symbol}'.")
         if pop_token:
-
             self.stack.pop()
-
-    def match_multiple_or_end(self, symbols, var_map):
-
-        self.evaluate_next(var_map)
-
-        while self.idx < len(self.tokens) and self.stack[-1] not in symbols:
-
-            self.evaluate_next(var_map)
-
-        if self.stack and self.stack[-1] in symbols:
-
-            return self.stack.pop()
-
-        return None
-
     def match_multiple(self, symbols, var_map):
-
         self.evaluate_next(var_map)
-
         try:
-
             while self.stack[-1] not in symbols:
-
                 self.evaluate_next(var_map)
-
         except IndexError:
-
-            raise Exception(f"[line 1] expect {symbols}")
-
+            expected = " or ".join(f"'{symbol}'" for symbol in symbols)
+            raise syntax_error(self.tokens, self.idx, self.end, f"Expect {expected}.")
         return self.stack.pop()
-
-    def is_numeric_literal(self, val):
-
-        if isinstance(val, bool):
-
-            return False
-
-        return isinstance(val, int) or isinstance(val, float)
-
-    def is_str_literal(self, val):
-
-        return isinstance(val, str)
-
     def clear_semicolons(self):
-
         if not self.stack:
-
             return
-
         while self.stack[-1] == ";":
-
             self.stack.pop()
-
     def parse_func_args(self, var_map):
-
         func_args = []
-
         self.stack.append("(")
-
         popped_token = None
-
         while popped_token != ")":
-
             while self.stack[-1] not in [",", ")"]:
-
                 self.evaluate_next(var_map)
-
             popped_token = self.stack.pop()
-
             if self.stack[-1] != "(":
-
                 func_args.append(get_literal_val(self.stack.pop()))
-
         left_paren = self.stack.pop()
-
         assert left_paren == "(", left_paren
-
         return func_args
-
-    def evaluate_binary(self, symbol, var_map):
-
-        self.idx += 1
-
-        left_val = self.stack.pop()
-
-        self.evaluate_next(var_map)
-
-        right_val = self.stack.pop()
-
-        if is_executable(left_val):
-
-            left_val = left_val.execute()
-
-        if left_val and symbol == "or":
-
-            self.stack.append(left_val)
-
-            return
-
-        if left_val != "" and not left_val and symbol == "and":
-
-            self.stack.append(False)
-
+    def skip_statement_or_block(self):
+        kinds = self.tokens.kinds
+        if kinds[self.idx] == TOKEN_LEFT_BRACE:
+            self.idx += self.tokens.matching[self.idx] + 1
             return
-
-        if is_executable(right_val):
-
-            right_val = right_val.execute()
-
-        if symbol == "*":
-
-            if not self.is_numeric_literal(left_val) or not self.is_numeric_literal(
-
-                right_val
-
-            ):
-
-                raise Exception("Operand must be a number.")
-
-            return_val = left_val * right_val
-
-        elif symbol == "/":
-
-            if not self.is_numeric_literal(left_val) or not self.is_numeric_literal(
-
-                right_val
-
-            ):
-
-                raise Exception("Operand must be a number.")
-
-            return_val = left_val / right_val
-
-            return_val = (
-
-                int(return_val)
-
-                if isinstance(return_val, float) and return_val.is_integer()
-
-                else return_val
-
-            )
-
-        elif symbol == "-":
-
-            if not self.is_numeric_literal(left_val) or not self.is_numeric_literal(
-
-                right_val
-
-            ):
-
-                raise Exception("Operand must be a number.")
-
-            return_val = left_val - right_val
-
-        elif symbol == "+":
-
-            if not (
-
-                (self.is_str_literal(left_val) and self.is_str_literal(right_val))
-
-                or (
-
-                    self.is_numeric_literal(left_val)
-
-                    and self.is_numeric_literal(right_val)
-
-                )
-
-            ):
-
-                raise Exception("Operand must be both number or strings.")
-
-            return_val = left_val + right_val
-
-        elif symbol == ">":
-
-            if not self.is_numeric_literal(left_val) or not self.is_numeric_literal(
-
-                right_val
-
-            ):
-
-                raise Exception("Operand must be a number.")
-
-            return_val = left_val > right_val
-
-        elif symbol == "<":
-
-            if not self.is_numeric_literal(left_val) or not self.is_numeric_literal(
-
-                right_val
-
-            ):
-
-                raise Exception("Operand must be a number.")
-
-            return_val = left_val < right_val
-
-        elif symbol == "<=":
-
-            if not self.is_numeric_literal(left_val) or not self.is_numeric_literal(
-
-                right_val
-
-            ):
-
-                raise Exception("Operand must be a number.")
-
-            return_val = left_val <= right_val
-
-        elif symbol == ">=":
-
-            if not self.is_numeric_literal(left_val) or not self.is_numeric_literal(
-
-                right_val
-
-            ):
-
-                raise Exception("Operand must be a number.")
-
-            return_val = left_val >= right_val
-
-        elif symbol == "==":
-
-            return_val = left_val == right_val
-
-        elif symbol == "!=":
-
-            return_val = left_val != right_val
-
-        elif symbol == "or":
-
-            return_val = left_val or right_val
-
-        elif symbol == "and":
-
-            res = is_truthy(left_val) and is_truthy(right_val)
-
-            if res:
-
-                return_val = right_val
-
-            else:
-
-                return_val = False
-
-        else:
-
-            return_val = None
-
-        self.stack.append(return_val)
-
-    def get_next_statement_or_block_tokens(self):
-
-        executable_tokens = []
-
-        if self.tokens[self.idx][0] == "LEFT_BRACE":
-
-            executable_tokens.append(self.tokens[self.idx])
-
+        while kinds[self.idx] != TOKEN_SEMICOLON:
             self.idx += 1
-
-            brace_stack = ["{"]
-
-            while brace_stack:
-
-                if self.tokens[self.idx][0] == "LEFT_BRACE":
-
-                    brace_stack.append("{")
-
-                elif self.tokens[self.idx][0] == "RIGHT_BRACE":
-
-                    brace_stack.pop()
-
-                executable_tokens.append(self.tokens[self.idx])
-
-                self.idx += 1
-
-            return executable_tokens
-
-        while self.tokens[self.idx][0] != "SEMICOLON":
-
-            executable_tokens.append(self.tokens[self.idx])
-
-            self.idx += 1
-
-        executable_tokens.append(self.tokens[self.idx])
-
         self.idx += 1
-
-        return executable_tokens
-
-    def get_next_parens(self):
-
-        executable_tokens = []
-
-        assert self.tokens[self.idx][0] == "LEFT_PAREN"
-
-        executable_tokens.append(self.tokens[self.idx])
-
-        self.idx += 1
-
-        brace_stack = ["("]
-
-        while brace_stack:
-
-            if self.tokens[self.idx][0] == "LEFT_PAREN":
-
-                brace_stack.append("{")
-
-            elif self.tokens[self.idx][0] == "RIGHT_PAREN":
-
-                brace_stack.pop()
-
-            executable_tokens.append(self.tokens[self.idx])
-
-            self.idx += 1
-
-        return executable_tokens
-
+    def skip_next_parens(self):
+        assert self.tokens.kinds[self.idx] == TOKEN_LEFT_PAREN
+        self.idx += self.tokens.matching[self.idx] + 1
+class SyntaxNode:
+    # a parenthesized form of the parse tree, its children are nodes or the
+    # text of literals and names. the function form is printed unclosed
+    __slots__ = ("kind", "children", "close")
+    def __init__(self, kind, children, close=")"):
+        self.kind = kind
+        self.children = children
+        self.close = close
+    def __repr__(self):
+        return syntax_text(self)
+def write_syntax(node, write):
+    # writes the S-expression of a parse tree visiting every node once and
+    # without recursing, so deep trees print in linear time
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if type(node) is not SyntaxNode:
+            write(node)
+            continue
+        write("(" + node.kind + " ")
+        pending.append(node.close)
+        children = node.children
+        for idx in range(len(children) - 1, 0, -1):
+            pending.append(children[idx])
+            pending.append(" ")
+        if children:
+            pending.append(children[0])
+def has_syntax_kind(node, kind):
+    # whether the tree holds a node of the kind, searched without recursing
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if type(node) is SyntaxNode:
+            if node.kind == kind:
+                return True
+            pending.extend(node.children)
+    return False
+def syntax_text(node):
+    parts = []
+    write_syntax(node, parts.append)
+    return "".join(parts)
 class Parser:
-
-    def __init__(self, tokens):
-
+    # parses the tokens in [start, end) of the shared token store
+    def __init__(self, tokens, start=0, end=None):
         self.tokens = tokens
-
         self.idx = 0
-
+        # the compile_* methods read tokens through the cursor, parse_next
+        # walks the (kind, lexeme, literal) views with self.idx
+        self.cursor = TokenCursor(tokens, start, end)
+        # parse_next walks from 0 but stops at the end of the range
+        self.end = self.cursor.end
         self.stack = []
-
         self.evaluating_stack = []
-
-        self.processing_add_minus = False
-
-        self.is_defining = False
-
         self.num_groups = 0
-
     def parse_all(self):
-
         while self.idx < len(self.tokens):
-
             self.parse_next()
-
     def match(self, symbol, err_msg=""):
-
         self.parse_next()
-
         try:
-
             while self.stack[-1] != symbol:
-
                 self.parse_next()
-
         except Exception as e:
-
             if not err_msg:
-
                 raise e
-
             else:
-
                 raise Exception(err_msg)
-
         self.stack.pop()
-
     def match_multiple(self, symbols, err_msg=""):
-
         self.parse_next()
-
         try:
-
             while self.stack[-1] not in symbols:
-
                 self.parse_next()
-
         except Exception as e:
-
             if not err_msg:
-
                 raise e
-
             else:
-
                 raise Exception(err_msg)
-
         return self.stack.pop()
-
     def parse_next(self):
-
-        token, word, value = self.tokens[self.idx]
-
+        kind = self.tokens.kinds[self.idx]
         if debug:
-
             print(self.stack)
-
-            print(token)
-
+            print(token_kinds[kind])
         # print(self.stack)
-
         # print(token)
-
-        if token in ("NIL", "FALSE", "TRUE"):
-
-            self.idx += 1
-
-            self.stack.append(word)
-
-        if token == "NUMBER":
-
-            self.idx += 1
-
-            self.stack.append(value)
-
-            if (
-
-                self.processing_add_minus
-
-                and self.idx < len(self.tokens)
-
-                and self.tokens[self.idx][0] in ("SLASH", "STAR")
-
-            ):
-
-                self.parse_next()
-
-        if token == "STRING":
-
-            self.idx += 1
-
-            self.stack.append(value)
-
-        if token == "LEFT_PAREN":
-
-            self.num_groups += 1
-
-            self.idx += 1
-
-            params = []
-
-            token = None
-
-            # Fix this to only match on right_paren
-
-            while token != ")":
-
-                token = self.match_multiple([")", ";", ","])
-
-                if self.stack:
-
-                    params.append(self.stack.pop())
-
-            self.num_groups -= 1
-
-            value = f'(group {" ".join([str(param) for param in params])})'
-
-            self.stack.append(value)
-
-            if (
-
-                (self.processing_add_minus or self.is_defining)
-
-                and self.idx < len(self.tokens)
-
-                and self.tokens[self.idx][0] in ("SLASH", "STAR", "MINUS", "PLUS")
-
-            ):
-
-                self.parse_next()
-
-        if token == "RIGHT_PAREN":
-
+        if kind in operand_kinds:
+            self.parse_expression()
+            return None
+        if kind in binary_operators:
+            raise Exception(
+                f"[line {self.tokens.line(self.idx)}] Error at "
+                f"'{self.tokens.lexeme(self.idx)}': Expect expression."
+            )
+        # one branch per kind, compared as integer codes
+        if kind == TOKEN_RIGHT_PAREN:
             self.idx += 1
-
             self.stack.append(")")
-
-        if token == "BANG":
-
+        elif kind == TOKEN_EQUAL:
             self.idx += 1
-
-            self.parse_next()
-
-            return_val = f"(! {self.stack.pop()})"
-
-            self.stack.append(return_val)
-
-        if token == "MINUS":
-
-            if len(self.stack) > 0:
-
-                self.processing_add_minus = True
-
-                self.parse_binary("-")
-
-                self.processing_add_minus = False
-
-            else:
-
-                self.idx += 1
-
-                self.parse_next()
-
-                return_val = f"(- {self.stack.pop()})"
-
-                self.stack.append(return_val)
-
-        if token == "STAR":
-
-            self.parse_binary("*")
-
-        if token == "SLASH":
-
-            self.parse_binary("/")
-
-        if token == "PLUS":
-
-            self.processing_add_minus = True
-
-            self.parse_binary("+")
-
-            self.processing_add_minus = False
-
-        if token == "EQUAL":
-
-            if self.is_defining:
-
-                self.idx += 1
-
-                self.stack.append("=")
-
-            else:
-
-                self.idx += 1
-
-                left = self.stack.pop()
-
-                popped_token = self.match_multiple([";", ")"])
-
-                right = self.stack.pop()
-
-                self.stack.append(f"(= {left} {right})")
-
-                self.stack.append(popped_token)
-
-        if token == "LESS":
-
-            self.parse_binary("<")
-
-        if token == "GREATER":
-
-            self.parse_binary(">")
-
-        if token == "GREATER_EQUAL":
-
-            self.parse_binary(">=")
-
-        if token == "LESS_EQUAL":
-
-            self.parse_binary("<=")
-
-        if token == "EQUAL_EQUAL":
-
-            self.parse_binary("==")
-
-        if token == "BANG_EQUAL":
-
-            self.parse_binary("!=")
-
-        if token == "SEMICOLON":
-
-            self.is_defining = False
-
+            left = self.stack.pop()
+            popped_token = self.match_multiple([";", ")"])
+            right = self.stack.pop()
+            self.stack.append(SyntaxNode("=", [left, right]))
+            self.stack.append(popped_token)
+        elif kind == TOKEN_SEMICOLON:
             self.idx += 1
-
             self.stack.append(";")
-
-        if token == "PRINT":
-
+        elif kind == TOKEN_PRINT:
             self.idx += 1
-
             self.parse_next()
-
             try:
-
                 while self.stack[-1] != ";":
-
                     self.parse_next()
-
             except IndexError:
-
-                raise Exception("[line 1] expect close")
-
+                raise syntax_error(
+                    self.tokens, self.idx, self.end, "Expect ';' after value."
+                )
             self.stack.pop()
-
             val = self.stack.pop()
-
-            self.stack.append(f"(print {val})")
-
-        if token == "VAR":
-
-            self.is_defining = True
-
+            self.stack.append(SyntaxNode("print", [val]))
+        elif kind == TOKEN_VAR:
             self.idx += 1
-
-            self.parse_next()
-
+            self.parse_primary()
             var_name = self.stack.pop()
-
-            self.parse_next()
-
-            if self.stack[-1] == ";":
-
-                self.stack.pop()
-
-                self.stack.append(f"(var {var_name} nil)")
-
+            kind = self.tokens.kinds[self.idx] if self.idx < self.end else TOKEN_EOF
+            if kind == TOKEN_SEMICOLON:
+                self.idx += 1
+                self.stack.append(SyntaxNode("var", [var_name, "nil"]))
                 return
-
-            assert self.stack.pop() == "="
-
-            self.is_defining = False
-
+            if kind != TOKEN_EQUAL:
+                raise syntax_error(
+                    self.tokens,
+                    self.idx,
+                    self.end,
+                    "Expect ';' after variable declaration.",
+                )
+            self.idx += 1
             try:
-
                 self.parse_next()
-
                 while self.stack[-1] != ";":
-
                     self.parse_next()
-
             except IndexError:
-
-                raise Exception("[line 1] expect close")
-
+                raise syntax_error(
+                    self.tokens,
+                    self.idx,
+                    self.end,
+                    "Expect ';' after variable declaration.",
+                )
             self.stack.pop()
-
             var_val = self.stack.pop()
-
-            self.stack.append(f"(var {var_name} {var_val})")
-
-        if token == "IDENTIFIER":
-
+            self.stack.append(SyntaxNode("var", [var_name, var_val]))
+        elif kind == TOKEN_RIGHT_BRACE:
             self.idx += 1
-
-            self.stack.append("var_" + word)
-
-            if self.idx < len(self.tokens) and self.tokens[self.idx][0] == "IDENTIFIER":
-
-                raise Exception("missing comma")
-
-            if (
-
-                self.idx < len(self.tokens)
-
-                and self.tokens[self.idx][0] == "RIGHT_PAREN"
-
-                and self.num_groups == 0
-
-            ):
-
-                raise Exception("no closing parens")
-
-        if token == "RIGHT_BRACE":
-
-            self.idx += 1
-
             self.stack.append("}")
-
-        if token == "COMMA":
-
+        elif kind == TOKEN_COMMA:
             self.idx += 1
-
             self.stack.append(",")
-
-        if token == "LEFT_BRACE":
-
+        elif kind == TOKEN_LEFT_BRACE:
             self.idx += 1
-
             self.stack.append("{")
-
             self.match("}")
-
             executables = []
-
             while self.stack[-1] != "{":
-
                 executables.append(self.stack.pop())
-
             executables.reverse()
-
             self.stack.pop()
-
-            self.stack.append(f'(block {" ".join(executables)})')
-
-        if token == "IF":
-
+            self.stack.append(SyntaxNode("block", executables))
+        elif kind == TOKEN_IF:
             self.idx += 1
-
             self.parse_next()
-
             truth_val = self.stack.pop()
-
             self.parse_next()
-
             executable = self.stack.pop()
-
-            if self.idx >= len(self.tokens) or (
-
-                self.idx < len(self.tokens) and self.tokens[self.idx][0] != "ELSE"
-
+            if (
+                self.idx >= len(self.tokens)
+                or self.tokens.kinds[self.idx] != TOKEN_ELSE
             ):
-
-                self.stack.append(f"(if {truth_val} {executable})")
-
+                self.stack.append(SyntaxNode("if", [truth_val, executable]))
                 return
-
             self.parse_next()
-
             else_if_block = self.stack.pop()
-
-            self.stack.append(f"(if {truth_val} {executable} {else_if_block})")
-
-        if token == "ELSE":
-
+            self.stack.append(
+                SyntaxNode("if", [truth_val, executable, else_if_block])
+            )
+        elif kind == TOKEN_ELSE:
             self.idx += 1
-
             self.parse_next()
-
             executable = self.stack.pop()
-
-            if self.idx >= len(self.tokens) or (
-
-                self.idx < len(self.tokens) and self.tokens[self.idx][0] != "IF"
-
-            ):
-
-                self.stack.append(f"(else {executable})")
-
+            if self.idx >= len(self.tokens) or self.tokens.kinds[self.idx] != TOKEN_IF:
+                self.stack.append(SyntaxNode("else", [executable]))
                 return
-
             self.parse_next()
-
-        if token == "OR":
-
-            self.parse_binary("or")
-
-        if token == "AND":
-
-            self.parse_binary("and")
-
-        if token == "WHILE":
-
+        elif kind == TOKEN_WHILE:
             self.idx += 1
-
             self.parse_next()
-
             condition = self.stack.pop()
-
             self.parse_next()
-
             block = self.stack.pop()
-
-            self.stack.append(f"(while {condition} {block})")
-
-        if token == "FOR":
-
+            self.stack.append(SyntaxNode("while", [condition, block]))
+        elif kind == TOKEN_FOR:
+            line = self.tokens.line(self.idx)
             self.idx += 1
-
             self.parse_next()
-
             val = self.stack.pop()
-
-            if val == "(group ;)" or val == "(group ; ;)" or val == "(group )":
-
-                raise Exception("[line 1] Error at 'var': Expect expression.")
-
-            if "block" in val:
-
-                raise Exception("EXPECTED EXPRESSION")
-
+            # the clauses are the children of a group, empty ones leave only
+            # their semicolons
+            if type(val) is SyntaxNode and val.kind == "group":
+                if val.children in ([], [";"], [";", ";"]):
+                    raise Exception(
+                        f"[line {line}] Error at 'var': Expect expression."
+                    )
+            if has_syntax_kind(val, "block"):
+                raise Exception(f"[line {line}] Error at '{{': Expect expression.")
             self.parse_next()
-
             block = self.stack.pop()
-
-            self.stack.append(f"(for {val} {block})")
-
-        if token == "FUN":
-
+            self.stack.append(SyntaxNode("for", [val, block]))
+        elif kind == TOKEN_FUN:
             self.idx += 1
-
             self.parse_next()
-
             func_name = self.stack.pop()
-
             self.parse_next()
-
             args = self.stack.pop()
-
-            if self.tokens[self.idx][0] != "LEFT_BRACE":
-
-                raise Exception("Function definition must have brace")
-
+            if self.tokens.kinds[self.idx] != TOKEN_LEFT_BRACE:
+                raise syntax_error(
+                    self.tokens, self.idx, self.end, "Expect '{' before function body."
+                )
             self.parse_next()
-
             executable = self.stack.pop()
-
-            self.stack.append(f"(fun {func_name} {args} {executable}")
-
-        if token == "RETURN":
-
+            self.stack.append(
+                SyntaxNode("fun", [func_name, args, executable], close="")
+            )
+        elif kind == TOKEN_RETURN:
             self.idx += 1
-
             self.parse_next()
-
-            self.stack.append(f"(return {self.stack.pop()})")
-
+            self.stack.append(SyntaxNode("return", [self.stack.pop()]))
         return None
-
-    def parse_binary(self, symbol):
-
-        self.idx += 1
-
-        left_val = self.stack.pop()
-
-        self.parse_next()
-
-        right_val = self.stack.pop()
-
-        return_val = f"({symbol} {left_val} {right_val})"
-
-        self.stack.append(return_val)
-
+    def parse_expression(self):
+        # pushes the tree of the operands and binary operators from idx
+        self.stack.append(
+            parse_binary_operators(
+                self.tokens.kinds, self, self.parse_operand, self.join_binary
+            )
+        )
+    def join_binary(self, symbol, left, right, token_idx):
+        return SyntaxNode(symbol, [left, right])
+    def parse_operand(self):
+        # returns the tree of a literal, name or group, or of a unary operator
+        # applied to one
+        if self.idx >= self.end:
+            raise Exception(
+                f"[line {self.tokens.line(self.idx)}] Error at end: "
+                "Expect expression."
+            )
+        kind = self.tokens.kinds[self.idx]
+        if kind == TOKEN_BANG or kind == TOKEN_MINUS:
+            symbol = self.tokens.lexeme(self.idx)
+            self.idx += 1
+            return SyntaxNode(symbol, [self.parse_operand()])
+        self.parse_primary()
+        return self.stack.pop()
+    def parse_primary(self):
+        kind = self.tokens.kinds[self.idx]
+        if kind == TOKEN_NIL or kind == TOKEN_FALSE or kind == TOKEN_TRUE:
+            self.idx += 1
+            self.stack.append(self.tokens.lexeme(self.idx - 1))
+        elif kind == TOKEN_NUMBER or kind == TOKEN_STRING:
+            self.idx += 1
+            self.stack.append(str(self.tokens.literal(self.idx - 1)))
+        elif kind == TOKEN_LEFT_PAREN:
+            self.num_groups += 1
+            self.idx += 1
+            params = []
+            token = None
+            # Fix this to only match on right_paren
+            while token != ")":
+                token = self.match_multiple([")", ";", ","])
+                if self.stack:
+                    params.append(self.stack.pop())
+            self.num_groups -= 1
+            self.stack.append(SyntaxNode("group", params))
+        elif kind == TOKEN_IDENTIFIER:
+            self.idx += 1
+            self.stack.append("var_" + self.tokens.lexeme(self.idx - 1))
+            kinds = self.tokens.kinds
+            if self.idx < len(self.tokens) and kinds[self.idx] == TOKEN_IDENTIFIER:
+                raise syntax_error(
+                    self.tokens, self.idx, self.end, "Expect ';' after expression."
+                )
+            if (
+                self.idx < len(self.tokens)
+                and kinds[self.idx] == TOKEN_RIGHT_PAREN
+                and self.num_groups == 0
+            ):
+                raise syntax_error(
+                    self.tokens, self.idx, self.end, "Expect ';' after expression."
+                )
+        else:
+            raise Exception(
+                f"[line {self.tokens.line(self.idx)}] Error at "
+                f"'{self.tokens.lexeme(self.idx)}': Expect expression."
+            )
+    def expect_token(self, token_kind, err_msg):
+        # returns the lexeme of the expected token
+        if self.cursor.peek() != token_kind:
+            raise syntax_error(self.tokens, self.cursor.idx, self.end, err_msg)
+        return self.cursor.lexeme(self.cursor.advance())
+    def compile_program(self):
+        statements = []
+        while not self.cursor.at_end():
+            statements.append(self.compile_declaration())
+        return statements
+    def compile_declaration(self):
+        token = self.cursor.peek()
+        if token == TOKEN_VAR:
+            self.cursor.advance()
+            name_idx = self.cursor.idx
+            var_name = self.expect_token(TOKEN_IDENTIFIER, "Expect variable name.")
+            var_val = None
+            if self.cursor.peek() == TOKEN_EQUAL:
+                self.cursor.advance()
+                var_val = self.compile_expression()
+            self.expect_token(TOKEN_SEMICOLON, "Expect ';' after variable declaration.")
+            declaration = Executable("var", var_name, var_val)
+            declaration.token_idx = name_idx
+            return declaration
+        if token == TOKEN_FUN:
+            start = self.cursor.advance()
+            func_name = self.expect_token(TOKEN_IDENTIFIER, "Expect function name.")
+            self.expect_token(TOKEN_LEFT_PAREN, "Expect '(' after function name.")
+            arg_names = []
+            while self.cursor.peek() != TOKEN_RIGHT_PAREN:
+                if arg_names:
+                    self.expect_token(TOKEN_COMMA, "Expect ',' between parameters.")
+                arg_names.append(
+                    self.expect_token(TOKEN_IDENTIFIER, "Expect parameter name.")
+                )
+            self.expect_token(TOKEN_RIGHT_PAREN, "Expect ')' after parameters.")
+            if self.cursor.peek() != TOKEN_LEFT_BRACE:
+                raise syntax_error(
+                    self.tokens,
+                    self.cursor.idx,
+                    self.end,
+                    "Expect '{' before function body.",
+                )
+            execution = self.compile_block()
+            function = FunctionNode(func_name, arg_names, execution, None)
+            function.token_range = (start, self.cursor.idx)
+            declaration = Executable("fun", func_name, function)
+            declaration.token_idx = start + 1
+            return declaration
+        return self.compile_statement()
+    def compile_block(self):
+        start = self.cursor.idx
+        self.expect_token(TOKEN_LEFT_BRACE, "Expect '{' before block.")
+        statements = []
+        # a statement never consumes the closing brace, brackets are balanced
+        end = start + self.tokens.matching[start]
+        while self.cursor.idx < end:
+            statements.append(self.compile_declaration())
+        self.expect_token(TOKEN_RIGHT_BRACE, "Expect '}' after block.")
+        block = BlockNode(statements)
+        block.token_range = (start, self.cursor.idx)
+        return block
+    def compile_statement(self):
+        token = self.cursor.peek()
+        if token == TOKEN_PRINT:
+            self.cursor.advance()
+            value = self.compile_expression()
+            self.expect_token(TOKEN_SEMICOLON, "Expect ';' after value.")
+            return Executable("print", value)
+        if token == TOKEN_LEFT_BRACE:
+            return self.compile_block()
+        if token == TOKEN_IF:
+            self.cursor.advance()
+            self.expect_token(TOKEN_LEFT_PAREN, "Expect '(' after 'if'.")
+            truth_val = self.compile_expression()
+            self.expect_token(TOKEN_RIGHT_PAREN, "Expect ')' after if condition.")
+            executable = self.compile_statement()
+            if self.cursor.peek() != TOKEN_ELSE:
+                return Executable("if", truth_val, executable)
+            self.cursor.advance()
+            else_statement = self.compile_statement()
+            return ElseIfBlockNode([IfNode(truth_val, executable)], else_statement)
+        if token == TOKEN_WHILE:
+            start = self.cursor.advance()
+            self.expect_token(TOKEN_LEFT_PAREN, "Expect '(' after 'while'.")
+            condition = self.compile_expression()
+            self.expect_token(TOKEN_RIGHT_PAREN, "Expect ')' after condition.")
+            loop = WhileNode(condition, self.compile_statement())
+            loop.token_range = (start, self.cursor.idx)
+            return loop
+        if token == TOKEN_FOR:
+            start = self.cursor.advance()
+            self.expect_token(TOKEN_LEFT_PAREN, "Expect '(' after 'for'.")
+            initializer = None
+            if self.cursor.peek() == TOKEN_SEMICOLON:
+                self.cursor.advance()
+            elif self.cursor.peek() == TOKEN_VAR:
+                initializer = self.compile_declaration()
+            else:
+                initializer = self.compile_expression_statement()
+            condition = None
+            if self.cursor.peek() != TOKEN_SEMICOLON:
+                condition = self.compile_expression()
+            self.expect_token(TOKEN_SEMICOLON, "Expect ';' after loop condition.")
+            increment = None
+            if self.cursor.peek() != TOKEN_RIGHT_PAREN:
+                increment = self.compile_expression()
+            self.expect_token(TOKEN_RIGHT_PAREN, "Expect ')' after for clauses.")
+            execution = self.compile_statement()
+            loop = ForNode(initializer, condition, increment, execution)
+            loop.token_range = (start, self.cursor.idx)
+            return loop
+        if token == TOKEN_RETURN:
+            return_idx = self.cursor.advance()
+            return_val = None
+            if self.cursor.peek() != TOKEN_SEMICOLON:
+                return_val = self.compile_expression()
+            self.expect_token(TOKEN_SEMICOLON, "Expect ';' after return value.")
+            statement = Executable("return", return_val)
+            statement.token_idx = return_idx
+            return statement
+        return self.compile_expression_statement()
+    def compile_expression_statement(self):
+        value = self.compile_expression()
+        self.expect_token(TOKEN_SEMICOLON, "Expect ';' after expression.")
+        if is_executable(value):
+            return value
+        # literals are wrapped so every statement can be executed
+        return Executable("expression", value)
+    def compile_expression(self):
+        left = parse_binary_operators(
+            self.cursor.kinds, self.cursor, self.compile_unary, BinaryNode
+        )
+        if self.cursor.peek() != TOKEN_EQUAL:
+            return left
+        equals_idx = self.cursor.advance()
+        value = self.compile_expression()
+        if not isinstance(left, IdentifierNode):
+            raise Exception(
+                f"[line {self.tokens.line(equals_idx)}] Error at '=': "
+                "Invalid assignment target."
+            )
+        return AssignNode(left.var_name, value, left.token_idx)
+    def compile_unary(self):
+        token = self.cursor.peek()
+        if token == TOKEN_BANG:
+            symbol_idx = self.cursor.advance()
+            return UnaryNode("!", self.compile_unary(), symbol_idx)
+        if token == TOKEN_MINUS:
+            symbol_idx = self.cursor.advance()
+            return UnaryNode("-", self.compile_unary(), symbol_idx)
+        return self.compile_call()
+    def compile_call(self):
+        function = self.compile_primary()
+        while self.cursor.peek() == TOKEN_LEFT_PAREN:
+            self.cursor.advance()
+            args = []
+            if self.cursor.peek() != TOKEN_RIGHT_PAREN:
+                args.append(self.compile_expression())
+                while self.cursor.peek() == TOKEN_COMMA:
+                    self.cursor.advance()
+                    args.append(self.compile_expression())
+            paren_idx = self.cursor.idx
+            self.expect_token(TOKEN_RIGHT_PAREN, "Expect ')' after arguments.")
+            function = FunctionCallNode(function, args, paren_idx)
+        return function
+    def compile_primary(self):
+        cursor = self.cursor
+        if cursor.at_end():
+            raise Exception(
+                f"[line {self.tokens.line(cursor.idx)}] Error at end: "
+                "Expect expression."
+            )
+        idx = cursor.advance()
+        token = cursor.kinds[idx]
+        if token == TOKEN_NUMBER:
+            value = cursor.literal(idx)
+            return int(value) if value.is_integer() else value
+        if token == TOKEN_STRING:
+            return cursor.literal(idx)
+        if token == TOKEN_TRUE:
+            return True
+        if token == TOKEN_FALSE:
+            return False
+        if token == TOKEN_NIL:
+            return None
+        if token == TOKEN_IDENTIFIER:
+            identifier = IdentifierNode(cursor.lexeme(idx))
+            identifier.token_idx = idx
+            return identifier
+        if token == TOKEN_LEFT_PAREN:
+            value = self.compile_expression()
+            self.expect_token(TOKEN_RIGHT_PAREN, "Expect ')' after expression.")
+            return value
+        raise Exception(
+            f"[line {self.tokens.line(idx)}] Error at '{cursor.lexeme(idx)}': "
+            "Expect expression."
+        )
+class ScopeWalker:
+    # goes over a program in the order it runs with one dict per local scope,
+    # scoped like the Resolver: a local is declared before its initializer, so
+    # the initializer sees it, and a global only after. the passes walking a
+    # program give declarations, reads and assignments their meaning
+    def __init__(self):
+        self.scopes = []
+    def enter_scope(self, node):
+        # node is the block, for loop or function the scope is made for
+        self.scopes.append({})
+    def leave_scope(self, node):
+        self.scopes.pop()
+    def declare(self, node, var_name):
+        # node is the declaration, or the function declaring a parameter
+        pass
+    def define(self, node, var_name):
+        # the name declared last can be read from here on
+        pass
+    def read(self, node):
+        pass
+    def assign(self, node):
+        pass
+    def walk_statements(self, statements):
+        for statement in statements:
+            self.walk_statement(statement)
+    def walk_statement(self, node):
+        if isinstance(node, BlockNode):
+            self.enter_scope(node)
+            self.walk_statements(node.statements)
+            self.leave_scope(node)
+        elif isinstance(node, Executable):
+            if node.command == "var":
+                if self.scopes:
+                    self.declare(node, node.value)
+                    self.walk_expression(node.value_two)
+                else:
+                    self.walk_expression(node.value_two)
+                    self.declare(node, node.value)
+                self.define(node, node.value)
+            elif node.command == "fun":
+                # a function may refer to itself
+                self.declare(node, node.value)
+                self.define(node, node.value)
+                self.walk_function(node.value_two)
+            elif node.command == "if":
+                self.walk_expression(node.value)
+                self.walk_statement(node.value_two)
+            else:
+                self.walk_expression(node.value)
+        elif isinstance(node, ElseIfBlockNode):
+            for if_node in node.if_nodes:
+                self.walk_expression(if_node.truth_val)
+                self.walk_statement(if_node.block)
+            self.walk_statement(node.else_statement)
+        elif isinstance(node, WhileNode):
+            self.walk_expression(node.condition)
+            self.walk_statement(node.execution)
+        elif isinstance(node, ForNode):
+            self.enter_scope(node)
+            if node.initializer is not None:
+                self.walk_statement(node.initializer)
+            self.walk_expression(node.condition)
+            self.walk_expression(node.increment)
+            self.walk_statement(node.execution)
+            self.leave_scope(node)
+        else:
+            self.walk_expression(node)
+    def walk_function(self, function):
+        self.enter_scope(function)
+        for arg_name in function.arg_names:
+            self.declare(function, arg_name)
+            self.define(function, arg_name)
+        # the body statements run directly in the function scope
+        self.walk_statements(function.execution.statements)
+        self.leave_scope(function)
+    def walk_expression(self, node):
+        if isinstance(node, IdentifierNode):
+            self.read(node)
+        elif isinstance(node, AssignNode):
+            self.walk_expression(node.value)
+            self.assign(node)
+        elif isinstance(node, BinaryNode):
+            self.walk_expression(node.left)
+            self.walk_expression(node.right)
+        elif isinstance(node, UnaryNode):
+            self.walk_expression(node.operand)
+        elif isinstance(node, FunctionCallNode):
+            self.walk_expression(node.function)
+            for arg in node.args:
+                self.walk_expression(arg)
+class TemporaryWalker(ScopeWalker):
+    # a ScopeWalker for passes adding variables of their own. their names start
+    # with a prefix none of the program's names start with, and they are
+    # declared at the start of their function or program
+    def __init__(self, temp_prefix):
+        super().__init__()
+        # every name the program declares or uses
+        self.names = set()
+        self.temp_prefix = temp_prefix
+        self.temp_count = 0
+        self.new_declarations = []
+    def walk_program(self, statements):
+        self.walk_statements(statements)
+        while any(name.startswith(self.temp_prefix) for name in self.names):
+            self.temp_prefix = "_" + self.temp_prefix
+    def in_function(self, statements, rewrite):
+        # rewrites the statements of a function body or the program and
+        # declares the temporaries made for them first
+        outer_declarations = self.new_declarations
+        self.new_declarations = []
+        statements = rewrite(statements)
+        statements = self.new_declarations + statements
+        self.new_declarations = outer_declarations
+        return statements
+    def new_temporary(self):
+        # returns the declaration of a new temporary
+        name = f"{self.temp_prefix}{self.temp_count}"
+        self.temp_count += 1
+        declaration = Executable("var", name, None)
+        self.new_declarations.append(declaration)
+        return declaration
+class ResolverFunctionContext:
+    def __init__(self, body, base):
+        self.body = body
+        # index of the function's own scope in Resolver.scopes
+        self.base = base
+        self.captures = []
+        self.upvalue_indexes = {}
+class Resolver(ScopeWalker):
+    # binds every local name to a (scope distance, slot) pair before running, so
+    # the engines index into scope slots instead of searching maps up the chain.
+    # its scopes mirror the ones created at runtime: function calls, blocks with
+    # declarations and for loops declaring their variable. names not found in
+    # any local scope are globals, which stay late bound. a function reads the
+    # variables of enclosing functions through upvalues: the cells it captured
+    # when it was declared, so it does not keep the whole scope chain alive
+    def __init__(self, tokens=None):
+        super().__init__()
+        # the TokenStore the program was parsed from, for error lines
+        self.tokens = tokens
+        # the functions being resolved, innermost last, top level code first
+        self.functions = [ResolverFunctionContext(None, 0)]
+    def resolve_program(self, statements):
+        self.walk_statements(statements)
+    def begin_scope(self):
+        self.scopes.append({})
+    def end_scope(self):
+        scope = self.scopes.pop()
+        # every use of the scope's variables is resolved by now
+        for _, _, is_captured, declaration, references in scope.values():
+            # set either way, a program resolved again may capture less
+            if declaration is not None:
+                declaration.is_captured = is_captured
+            for node in references:
+                node.is_captured = is_captured
+        return len(scope)
+    def enter_scope(self, node):
+        if isinstance(node, FunctionNode):
+            self.begin_scope()
+            body = node.execution
+            self.functions.append(ResolverFunctionContext(body, len(self.scopes) - 1))
+        elif node.needs_scope:
+            self.begin_scope()
+    def leave_scope(self, node):
+        if not isinstance(node, FunctionNode):
+            node.slot_count = self.end_scope() if node.needs_scope else 0
+            return
+        context = self.functions.pop()
+        body = node.execution
+        body.captures = context.captures
+        function_scope = self.scopes[-1]
+        body.captured_args = [
+            index
+            for index, arg_name in enumerate(node.arg_names)
+            if function_scope[arg_name][2]
+        ]
+        body.slot_count = self.end_scope()
+    def error_line(self, node):
+        if self.tokens is None or node is None or node.token_idx is None:
+            return 1
+        return self.tokens.line(node.token_idx)
+    def declare(self, node, var_name):
+        # parameters have no declaration of their own
+        declaration = node if isinstance(node, Executable) else None
+        if not self.scopes:
+            slot = None
+        else:
+            scope = self.scopes[-1]
+            if var_name in scope:
+                raise Exception(
+                    f"[line {self.error_line(declaration)}] Error at '{var_name}': "
+                    "Already a variable with this name in this scope."
+                )
+            slot = len(scope)
+            # [slot, is_initialized, is_captured, declaration, references]
+            scope[var_name] = [slot, False, False, declaration, []]
+        if declaration is not None:
+            declaration.slot = slot
+    def define(self, node, var_name):
+        if self.scopes:
+            self.scopes[-1][var_name][1] = True
+    def read(self, node):
+        self.resolve_name(node)
+    def assign(self, node):
+        self.resolve_name(node)
+    def walk_statement(self, node):
+        if isinstance(node, Executable) and node.command == "return":
+            if len(self.functions) == 1:
+                raise Exception(
+                    f"[line {self.error_line(node)}] Error at 'return': "
+                    "Can't return from top-level code."
+                )
+        super().walk_statement(node)
+    def resolve_name(self, node):
+        for index in range(len(self.scopes) - 1, -1, -1):
+            binding = self.scopes[index].get(node.var_name)
+            if binding is None:
+                continue
+            if not binding[1] and isinstance(node, IdentifierNode):
+                raise Exception(
+                    f"[line {self.error_line(node)}] Error at '{node.var_name}': "
+                    "Can't read local variable in its own initializer."
+                )
+            if index >= self.functions[-1].base:
+                node.scope_distance = len(self.scopes) - 1 - index
+                node.slot = binding[0]
+                binding[4].append(node)
+            else:
+                binding[2] = True
+                node.scope_distance = -2
+                node.slot = self.add_upvalue(len(self.functions) - 1, index, binding)
+            return
+        node.scope_distance = -1
+    def add_upvalue(self, level, index, binding):
+        function = self.functions[level]
+        if id(binding) in function.upvalue_indexes:
+            return function.upvalue_indexes[id(binding)]
+        if index >= self.functions[level - 1].base:
+            # captured from the scope the function is declared in, which is
+            # the one just outside its own scope
+            capture = (function.base - 1 - index, binding[0])
+        else:
+            capture = (-2, self.add_upvalue(level - 1, index, binding))
+        function.upvalue_indexes[id(binding)] = len(function.captures)
+        function.captures.append(capture)
+        return function.upvalue_indexes[id(binding)]
+def is_constant(value):
+    # whether an expression folded to a value. the python engine writes values
+    # with repr, which has no literal for an infinite or nan number
+    if isinstance(value, float):
+        return isfinite(value)
+    return not is_executable(value)
+def empty_block():
+    block = BlockNode([])
+    block.slot_count = 0
+    return block
+class Optimizer(ScopeWalker):
+    # folds operators on constants, replaces reads of variables that are never
+    # assigned after their declaration with its constant value and drops code
+    # that can never run. it runs on resolved programs, so errors found while
+    # resolving still show up and removed declarations only leave a slot unused.
+    # operators that fail stay in place to fail when the program gets there
+    def __init__(self):
+        super().__init__()
+        # bindings are [is_assigned, has_value, value]. globals are late bound,
+        # only reads after the declaration see it
+        self.globals = {}
+        self.assigned_globals = set()
+        # the binding of every declaration and of every read that has one
+        self.bindings = {}
+    def optimize_program(self, statements):
+        self.walk_statements(statements)
+        for name in self.assigned_globals:
+            if name in self.globals:
+                self.globals[name][0] = True
+        return self.optimize_statements(statements)
+    def declare(self, node, var_name):
+        # only variables start with a value that may be constant
+        is_assigned = not (isinstance(node, Executable) and node.command == "var")
+        if not self.scopes:
+            binding = self.globals.get(var_name)
+            if binding is not None:
+                # a global declared again is assigned as far as reads go
+                binding[0] = True
+            else:
+                binding = self.globals[var_name] = [is_assigned, False, None]
+        else:
+            binding = self.scopes[-1][var_name] = [is_assigned, False, None]
+        if isinstance(node, Executable):
+            self.bindings[id(node)] = binding
+    def lookup(self, var_name):
+        for scope in reversed(self.scopes):
+            if var_name in scope:
+                return scope[var_name]
+        return self.globals.get(var_name)
+    def read(self, node):
+        binding = self.lookup(node.var_name)
+        if binding is not None:
+            self.bindings[id(node)] = binding
+    def assign(self, node):
+        binding = self.lookup(node.var_name)
+        if binding is not None and binding is not self.globals.get(node.var_name):
+            binding[0] = True
+        else:
+            # assignments anywhere reach the global, even before it exists
+            self.assigned_globals.add(node.var_name)
+    def optimize_statements(self, statements):
+        optimized = []
+        for statement in statements:
+            statement = self.optimize_statement(statement)
+            if statement is None:
+                continue
+            optimized.append(statement)
+            if isinstance(statement, Executable) and statement.command == "return":
+                break
+        return optimized
+    def optimize_body(self, node):
+        # statements that are part of another one are replaced, not removed
+        node = self.optimize_statement(node)
+        return empty_block() if node is None else node
+    def optimize_statement(self, node):
+        # returns the statement to run instead, None when there is nothing to run
+        if isinstance(node, BlockNode):
+            node.statements = self.optimize_statements(node.statements)
+        elif isinstance(node, Executable):
+            if node.command == "var":
+                node.value_two = self.fold(node.value_two)
+                binding = self.bindings[id(node)]
+                if not binding[0] and is_constant(node.value_two):
+                    binding[1] = True
+                    binding[2] = node.value_two
+            elif node.command == "fun":
+                body = node.value_two.execution
+                body.statements = self.optimize_statements(body.statements)
+            elif node.command == "if":
+                node.value = self.fold(node.value)
+                if is_constant(node.value):
+                    if is_truthy(node.value):
+                        return self.optimize_statement(node.value_two)
+                    return None
+                node.value_two = self.optimize_body(node.value_two)
+            else:
+                node.value = self.fold(node.value)
+                if node.command == "expression" and is_constant(node.value):
+                    return None
+        elif isinstance(node, ElseIfBlockNode):
+            if_nodes = []
+            for if_node in node.if_nodes:
+                if_node.truth_val = self.fold(if_node.truth_val)
+                if not is_constant(if_node.truth_val):
+                    if_node.block = self.optimize_body(if_node.block)
+                    if_nodes.append(if_node)
+                elif is_truthy(if_node.truth_val):
+                    # the branches after it never run
+                    if not if_nodes:
+                        return self.optimize_statement(if_node.block)
+                    node.else_statement = if_node.block
+                    break
+            else:
+                if not if_nodes:
+                    return self.optimize_statement(node.else_statement)
+            node.if_nodes = if_nodes
+            node.else_statement = self.optimize_body(node.else_statement)
+        elif isinstance(node, WhileNode):
+            node.condition = self.fold(node.condition)
+            if is_constant(node.condition) and not is_truthy(node.condition):
+                return None
+            node.execution = self.optimize_body(node.execution)
+        elif isinstance(node, ForNode):
+            if node.initializer is not None:
+                node.initializer = self.optimize_statement(node.initializer)
+            node.condition = self.fold(node.condition)
+            node.increment = self.fold(node.increment)
+            if is_constant(node.increment):
+                node.increment = None
+            node.execution = self.optimize_body(node.execution)
+        else:
+            node = self.fold(node)
+            if is_constant(node):
+                return None
+        return node
+    def fold(self, node):
+        # returns the expression with every operator on constants computed
+        if isinstance(node, IdentifierNode):
+            binding = self.bindings.get(id(node))
+            if binding is not None and binding[1]:
+                return binding[2]
+        elif isinstance(node, AssignNode):
+            node.value = self.fold(node.value)
+        elif isinstance(node, BinaryNode):
+            node.left = self.fold(node.left)
+            node.right = self.fold(node.right)
+            if not is_constant(node.left):
+                return node
+            if node.symbol == "or":
+                return node.left if is_truthy(node.left) else node.right
+            if node.symbol == "and":
+                return node.right if is_truthy(node.left) else node.left
+            if is_constant(node.right):
+                return self.fold_value(node)
+        elif isinstance(node, UnaryNode):
+            node.operand = self.fold(node.operand)
+            if is_constant(node.operand):
+                return self.fold_value(node)
+        elif isinstance(node, FunctionCallNode):
+            node.function = self.fold(node.function)
+            node.args = [self.fold(arg) for arg in node.args]
+        return node
+    def fold_value(self, node):
+        try:
+            value = node.execute()
+        except Exception:
+            return node
+        return value if is_constant(value) else node
+class ValueBinding:
+    # what the SubexpressionOptimizer knows about a variable. a global has one
+    # for its name
+    def __init__(self, function_depth):
+        # how deep the declaring function is nested, 0 for the top level
+        self.function_depth = function_depth
+        # every value stored in it, None for one that is not known statically
+        self.values = []
+        # code in another function assigns it, so calls may change it
+        self.assigned_by_calls = False
+        self.is_numeric = False
+class SubexpressionOptimizer(TemporaryWalker):
+    # stops recomputing expressions that have no effects. expressions that give
+    # the same value on every iteration of a loop move into temporaries declared
+    # before it. such an expression then runs even if the loop does not, so it
+    # moves only if it cannot fail or if the loop condition evaluates it before
+    # anything else happens anyway. in straight-line code the first evaluation
+    # of an expression that comes again is kept in a temporary until a variable
+    # it reads may change. the temporaries need resolving afterwards
+    def __init__(self):
+        super().__init__("_t")
+        self.globals = {}
+        # globals declared so far, reading one of these cannot fail
+        self.declared_globals = set()
+        self.function_depth = 0
+        self.all_bindings = []
+        # the binding of every read, assignment and declaration
+        self.bindings = {}
+        # reads of variables that are always defined when they run
+        self.defined_reads = set()
+        self.call_clobbered = []
+        # expressions are keyed by small ints, keys_by_binding lists the keys
+        # of the expressions reading each binding
+        self.keys = {}
+        self.keys_by_binding = {}
+        self.key_bindings = []
+        # the loop being hoisted from
+        self.changed = set()
+        self.has_calls = False
+        self.effects = False
+        self.hoisted = {}
+        self.hoisted_assignments = []
+        # the straight-line code being reused in
+        self.counting = False
+        self.counts = {}
+        self.available = {}
+        self.generations = {}
+        self.epoch = 0
+    def optimize_program(self, statements):
+        self.walk_program(statements)
+        self.infer_numbers()
+        # the variables a call may change
+        self.call_clobbered = [
+            binding for binding in self.all_bindings if binding.assigned_by_calls
+        ]
+        statements = self.in_function(statements, self.hoist_statements)
+        return self.in_function(statements, self.reuse_statements)
+    def new_binding(self):
+        binding = ValueBinding(self.function_depth)
+        self.all_bindings.append(binding)
+        return binding
+    def global_binding(self, var_name):
+        binding = self.globals.get(var_name)
+        if binding is None:
+            binding = self.globals[var_name] = ValueBinding(0)
+            self.all_bindings.append(binding)
+        return binding
+    def enter_scope(self, node):
+        if isinstance(node, FunctionNode):
+            self.function_depth += 1
+        super().enter_scope(node)
+    def leave_scope(self, node):
+        super().leave_scope(node)
+        if isinstance(node, FunctionNode):
+            self.function_depth -= 1
+    def declare(self, node, var_name):
+        self.names.add(var_name)
+        if self.scopes:
+            binding = self.scopes[-1][var_name] = self.new_binding()
+        else:
+            binding = self.global_binding(var_name)
+            self.declared_globals.add(var_name)
+        # the values of functions and parameters are not known statically
+        value = None
+        if isinstance(node, Executable):
+            self.bindings[id(node)] = binding
+            if node.command == "var":
+                value = node.value_two
+        binding.values.append(value)
+    def lookup(self, node):
+        self.names.add(node.var_name)
+        for scope in reversed(self.scopes):
+            binding = scope.get(node.var_name)
+            if binding is not None:
+                self.defined_reads.add(id(node))
+                break
+        else:
+            binding = self.global_binding(node.var_name)
+            if node.var_name in self.declared_globals:
+                self.defined_reads.add(id(node))
+        self.bindings[id(node)] = binding
+        return binding
+    def read(self, node):
+        self.lookup(node)
+    def assign(self, node):
+        binding = self.lookup(node)
+        binding.values.append(node.value)
+        if binding.function_depth != self.function_depth:
+            binding.assigned_by_calls = True
+    def infer_numbers(self):
+        # a variable holds numbers when every value stored in it is one. all of
+        # them are taken to until a value shows otherwise
+        for binding in self.all_bindings:
+            binding.is_numeric = bool(binding.values)
+        changed = True
+        while changed:
+            changed = False
+            for binding in self.all_bindings:
+                if binding.is_numeric and not all(
+                    self.is_number(value) for value in binding.values
+                ):
+                    binding.is_numeric = False
+                    changed = True
+    def is_number(self, node):
+        # whether the expression gives a number whenever it does not fail
+        if isinstance(node, IdentifierNode):
+            return self.bindings[id(node)].is_numeric
+        if isinstance(node, AssignNode):
+            return self.is_number(node.value)
+        if isinstance(node, UnaryNode):
+            return node.symbol == "-"
+        if isinstance(node, BinaryNode):
+            if node.symbol == "+":
+                return self.is_number(node.left) and self.is_number(node.right)
+            return node.symbol in ("-", "*", "/")
+        return is_numeric_literal(node)
+    def key(self, parts, bindings):
+        # the key of an expression made of parts, reading the given bindings
+        key = self.keys.get(parts)
+        if key is None:
+            key = self.keys[parts] = len(self.key_bindings)
+            self.key_bindings.append(bindings)
+            for binding in bindings:
+                self.keys_by_binding.setdefault(binding, []).append(key)
+        return key
+    def constant_key(self, value):
+        return self.key((type(value), repr(value)), frozenset())
+    def read_key(self, node):
+        binding = id(self.bindings[id(node)])
+        return self.key(("read", binding), frozenset((binding,)))
+    def operator_key(self, node, *operands):
+        bindings = frozenset().union(*(self.key_bindings[key] for key in operands))
+        return self.key((node.symbol, *operands), bindings)
+    def new_temporary(self):
+        declaration = super().new_temporary()
+        self.bindings[id(declaration)] = self.new_binding()
+        return declaration
+    def assign_temporary(self, declaration, value):
+        assignment = AssignNode(declaration.value, value)
+        self.bindings[id(assignment)] = self.bindings[id(declaration)]
+        return assignment
+    def read_temporary(self, declaration):
+        read = IdentifierNode(declaration.value)
+        self.bindings[id(read)] = self.bindings[id(declaration)]
+        self.defined_reads.add(id(read))
+        return read
+    def hoist_statements(self, statements):
+        return [self.hoist_statement(statement) for statement in statements]
+    def hoist_statement(self, node):
+        # hoists out of the loops in the statement, inner loops first. returns
+        # the statement to run instead
+        if isinstance(node, BlockNode):
+            node.statements = self.hoist_statements(node.statements)
+        elif isinstance(node, Executable):
+            if node.command == "fun":
+                body = node.value_two.execution
+                body.statements = self.in_function(
+                    body.statements, self.hoist_statements
+                )
+            elif node.command == "if":
+                node.value_two = self.hoist_statement(node.value_two)
+        elif isinstance(node, ElseIfBlockNode):
+            for if_node in node.if_nodes:
+                if_node.block = self.hoist_statement(if_node.block)
+            node.else_statement = self.hoist_statement(node.else_statement)
+        elif isinstance(node, (WhileNode, ForNode)):
+            node.execution = self.hoist_statement(node.execution)
+            return self.hoist_loop(node)
+        return node
+    def hoist_loop(self, loop):
+        self.changed = set()
+        self.has_calls = False
+        self.find_changes(loop.condition)
+        self.find_changes(loop.execution)
+        if isinstance(loop, ForNode):
+            self.find_changes(loop.increment)
+        self.hoisted = {}
+        self.hoisted_assignments = []
+        # the first evaluation of the condition comes right after the hoisted
+        # ones, so anything it evaluates before an effect may move
+        self.effects = False
+        if loop.condition is not None:
+            condition, invariant = self.hoist_expression(loop.condition, True)
+            loop.condition = self.hoist_part(condition, invariant)
+        loop.execution = self.hoist_from_statement(loop.execution)
+        if isinstance(loop, WhileNode):
+            if not self.hoisted_assignments:
+                return loop
+            return BlockNode(self.hoisted_assignments + [loop])
+        if loop.increment is not None:
+            loop.increment = self.hoist_anywhere(loop.increment)
+        if not self.hoisted_assignments:
+            return loop
+        # the initializer runs once before the hoisted expressions
+        inner_loop = ForNode(None, loop.condition, loop.increment, loop.execution)
+        inner_loop.token_range = loop.token_range
+        statements = self.hoisted_assignments + [inner_loop]
+        if loop.initializer is not None:
+            statements.insert(0, loop.initializer)
+        return BlockNode(statements)
+    def find_changes(self, node):
+        # collects the bindings the loop assigns or declares and whether it calls
+        if isinstance(node, (AssignNode, Executable)):
+            if id(node) in self.bindings:
+                self.changed.add(self.bindings[id(node)])
+        if isinstance(node, FunctionCallNode):
+            self.has_calls = True
+        if isinstance(node, BlockNode):
+            children = node.statements
+        elif isinstance(node, Executable):
+            children = (node.value, node.value_two)
+        elif isinstance(node, FunctionNode):
+            children = (node.execution,)
+        elif isinstance(node, ElseIfBlockNode):
+            children = [node.else_statement]
+            for if_node in node.if_nodes:
+                children += (if_node.truth_val, if_node.block)
+        elif isinstance(node, WhileNode):
+            children = (node.condition, node.execution)
+        elif isinstance(node, ForNode):
+            children = (
+                node.initializer,
+                node.condition,
+                node.increment,
+                node.execution,
+            )
+        elif isinstance(node, AssignNode):
+            children = (node.value,)
+        elif isinstance(node, BinaryNode):
+            children = (node.left, node.right)
+        elif isinstance(node, UnaryNode):
+            children = (node.operand,)
+        elif isinstance(node, FunctionCallNode):
+            children = [node.function] + node.args
+        else:
+            return
+        for child in children:
+            self.find_changes(child)
+    def is_invariant(self, binding):
+        if binding in self.changed:
+            return False
+        return not (self.has_calls and binding.assigned_by_calls)
+    def hoist_from_statement(self, node):
+        # hoists from every expression the loop runs, function declarations
+        # aside. returns the statement to run instead
+        if isinstance(node, BlockNode):
+            node.statements = [self.hoist_from_statement(s) for s in node.statements]
+        elif isinstance(node, Executable):
+            if node.command == "var":
+                node.value_two = self.hoist_anywhere(node.value_two)
+            elif node.command == "if":
+                node.value = self.hoist_anywhere(node.value)
+                node.value_two = self.hoist_from_statement(node.value_two)
+            elif node.command != "fun":
+                node.value = self.hoist_anywhere(node.value)
+        elif isinstance(node, ElseIfBlockNode):
+            for if_node in node.if_nodes:
+                if_node.truth_val = self.hoist_anywhere(if_node.truth_val)
+                if_node.block = self.hoist_from_statement(if_node.block)
+            node.else_statement = self.hoist_from_statement(node.else_statement)
+        elif isinstance(node, WhileNode):
+            node.condition = self.hoist_anywhere(node.condition)
+            node.execution = self.hoist_from_statement(node.execution)
+        elif isinstance(node, ForNode):
+            if node.initializer is not None:
+                node.initializer = self.hoist_from_statement(node.initializer)
+            node.condition = self.hoist_anywhere(node.condition)
+            node.increment = self.hoist_anywhere(node.increment)
+            node.execution = self.hoist_from_statement(node.execution)
+        else:
+            node = self.hoist_anywhere(node)
+        return node
+    def hoist_anywhere(self, node):
+        return self.hoist_part(*self.hoist_expression(node, False))
+    def hoist_expression(self, node, first):
+        # returns the expression and, when it is invariant, its key, whether it
+        # cannot fail, whether it is a number and whether it may move because it
+        # is evaluated first. first is whether the loop condition evaluates the
+        # expression in its first iteration before any effect
+        first = first and not self.effects
+        if not is_executable(node):
+            number = is_numeric_literal(node)
+            return node, (self.constant_key(node), True, number, first)
+        if isinstance(node, IdentifierNode):
+            binding = self.bindings[id(node)]
+            if not self.is_invariant(binding):
+                return node, None
+            safe = id(node) in self.defined_reads
+            return node, (self.read_key(node), safe, binding.is_numeric, first)
+        if isinstance(node, UnaryNode):
+            node.operand, operand = self.hoist_expression(node.operand, first)
+            if operand is None:
+                return node, None
+            key = self.operator_key(node, operand[0])
+            if node.symbol == "!":
+                return node, (key, operand[1], False, first)
+            return node, (key, operand[1] and operand[2], True, first)
+        if isinstance(node, BinaryNode):
+            symbol = node.symbol
+            node.left, left = self.hoist_expression(node.left, first)
+            node.right, right = self.hoist_expression(
+                node.right, first and symbol not in ("and", "or")
+            )
+            if left is None or right is None:
+                # the invariant operand is as large as it gets
+                node.left = self.hoist_part(node.left, left)
+                node.right = self.hoist_part(node.right, right)
+                return node, None
+            key = self.operator_key(node, left[0], right[0])
+            numbers = left[2] and right[2]
+            if symbol in ("==", "!=", "and", "or"):
+                safe = True
+            elif symbol == "/":
+                safe = numbers and is_numeric_literal(node.right) and node.right != 0
+            else:
+                safe = numbers
+            number = numbers if symbol == "+" else symbol in ("-", "*", "/")
+            return node, (key, safe and left[1] and right[1], number, first)
+        if isinstance(node, AssignNode):
+            node.value = self.hoist_part(*self.hoist_expression(node.value, first))
+            self.effects = True
+        elif isinstance(node, FunctionCallNode):
+            function, invariant = self.hoist_expression(node.function, first)
+            node.function = self.hoist_part(function, invariant)
+            args = []
+            for arg in node.args:
+                args.append(self.hoist_part(*self.hoist_expression(arg, first)))
+            node.args = args
+            self.effects = True
+        return node, None
+    def hoist_part(self, node, invariant):
+        # moves an invariant expression with an operator into a temporary
+        if invariant is None or not isinstance(node, (BinaryNode, UnaryNode)):
+            return node
+        key, safe, number, first = invariant
+        declaration = self.hoisted.get(key)
+        if declaration is None:
+            if not (safe or first):
+                # parts of it may still move
+                if isinstance(node, UnaryNode):
+                    node.operand = self.hoist_anywhere(node.operand)
+                else:
+                    node.left = self.hoist_anywhere(node.left)
+                    node.right = self.hoist_anywhere(node.right)
+                return node
+            declaration = self.hoisted[key] = self.new_temporary()
+            self.bindings[id(declaration)].is_numeric = number
+            self.hoisted_assignments.append(self.assign_temporary(declaration, node))
+        return self.read_temporary(declaration)
+    def reuse_statements(self, statements):
+        # goes over the straight-line code twice, counting the occurrences of
+        # every expression first. returns the statements to run instead
+        state = (
+            self.counting,
+            self.counts,
+            self.available,
+            self.generations,
+            self.epoch,
+        )
+        self.counts = {}
+        for counting in (True, False):
+            self.counting = counting
+            self.available = {}
+            self.generations = {}
+            self.epoch = 0
+            reused = [self.reuse_statement(statement) for statement in statements]
+        self.counting, self.counts, self.available, self.generations, self.epoch = state
+        return reused
+    def reuse_body(self, node):
+        return self.reuse_statements([node])[0]
+    def end_straight_line(self):
+        self.available = {}
+        self.epoch += 1
+    def kill(self, binding):
+        # the variable changes, expressions reading it have to be evaluated again.
+        # only expressions seen so far count, so both passes agree
+        for key in self.keys_by_binding.get(id(binding), ()):
+            if key in self.generations:
+                self.generations[key] += 1
+                self.available.pop(key, None)
+    def reuse_statement(self, node):
+        if isinstance(node, Executable):
+            if node.command == "var":
+                node.value_two = self.reuse_expression(node.value_two, False)[0]
+                self.kill(self.bindings[id(node)])
+            elif node.command == "fun":
+                self.kill(self.bindings[id(node)])
+                if not self.counting:
+                    body = node.value_two.execution
+                    body.statements = self.in_function(
+                        body.statements, self.reuse_statements
+                    )
+            elif node.command == "if":
+                node.value = self.reuse_expression(node.value, False)[0]
+                self.end_straight_line()
+                if not self.counting:
+                    node.value_two = self.reuse_body(node.value_two)
+            else:
+                node.value = self.reuse_expression(node.value, False)[0]
+        elif isinstance(node, ElseIfBlockNode):
+            if_node = node.if_nodes[0]
+            if_node.truth_val = self.reuse_expression(if_node.truth_val, False)[0]
+            self.end_straight_line()
+            if not self.counting:
+                for if_node in node.if_nodes:
+                    if_node.block = self.reuse_body(if_node.block)
+                node.else_statement = self.reuse_body(node.else_statement)
+        elif isinstance(node, BlockNode):
+            self.end_straight_line()
+            if not self.counting:
+                node.statements = self.reuse_statements(node.statements)
+        elif isinstance(node, (WhileNode, ForNode)):
+            self.end_straight_line()
+            if not self.counting:
+                node.execution = self.reuse_body(node.execution)
+        else:
+            node = self.reuse_expression(node, False)[0]
+        return node
+    def reuse_expression(self, node, conditional):
+        # returns the expression and its key, None when it has an effect.
+        # conditional is whether it may be skipped, the first evaluation of an
+        # expression can only be kept where it cannot
+        if not is_executable(node):
+            return node, self.constant_key(node)
+        if isinstance(node, IdentifierNode):
+            return node, self.read_key(node)
+        if isinstance(node, UnaryNode):
+            node.operand, operand = self.reuse_expression(node.operand, conditional)
+            if operand is None:
+                return node, None
+            return self.reuse(node, self.operator_key(node, operand), conditional)
+        if isinstance(node, BinaryNode):
+            node.left, left = self.reuse_expression(node.left, conditional)
+            node.right, right = self.reuse_expression(
+                node.right, conditional or node.symbol in ("and", "or")
+            )
+            if left is None or right is None:
+                return node, None
+            return self.reuse(node, self.operator_key(node, left, right), conditional)
+        if isinstance(node, AssignNode):
+            node.value = self.reuse_expression(node.value, conditional)[0]
+            self.kill(self.bindings[id(node)])
+        elif isinstance(node, FunctionCallNode):
+            node.function = self.reuse_expression(node.function, conditional)[0]
+            node.args = [
+                self.reuse_expression(arg, conditional)[0] for arg in node.args
+            ]
+            for binding in self.call_clobbered:
+                self.kill(binding)
+        return node, None
+    def reuse(self, node, key, conditional):
+        occurrence = (key, self.generations.setdefault(key, 0), self.epoch)
+        if self.counting:
+            self.counts[occurrence] = self.counts.get(occurrence, 0) + 1
+            return node, key
+        declaration = self.available.get(key)
+        if declaration is not None:
+            return self.read_temporary(declaration), key
+        if conditional or self.counts[occurrence] < 2:
+            return node, key
+        declaration = self.available[key] = self.new_temporary()
+        return self.assign_temporary(declaration, node), key
+# the most nodes the expressions of a function body may have to be inlined
+max_inline_size = 16
+class Inliner(TemporaryWalker):
+    # replaces calls of small functions with their body. a function qualifies
+    # when its body only declares variables and returns, its expressions have
+    # no effects and no calls, and its name is never assigned or declared
+    # again. arguments that are not constants or reads of defined variables
+    # nothing can change before the body runs go to temporaries assigned in
+    # order ahead of it, and so do the function's own locals, so the inlined
+    # body reads the same values and fails where the call would have. a body
+    # reading a name the call site binds differently is not inlined. the
+    # program needs resolving afterwards
+    def __init__(self):
+        super().__init__("_i")
+        self.globals = {}
+        self.declared_globals = set()
+        # the binding of every read and assignment: [is_assigned, function]
+        self.bindings = {}
+        # reads of variables that are always defined when they run
+        self.defined_reads = set()
+        # the inlinable body of each function: its locals with their values,
+        # the returned expression and the bindings of the names it reads
+        self.bodies = {}
+        # the binding of the function each inlinable call calls
+        self.calls = {}
+        self.inlined_count = 0
+    def inline_program(self, statements):
+        self.walk_program(statements)
+        return self.in_function(statements, self.inline_statements)
+    def global_binding(self, var_name):
+        binding = self.globals.get(var_name)
+        if binding is None:
+            binding = self.globals[var_name] = [False, None]
+        return binding
+    def leave_scope(self, node):
+        if isinstance(node, FunctionNode):
+            body = self.inline_body(node)
+            if body is not None:
+                self.bodies[id(node)] = body
+        super().leave_scope(node)
+    def declare(self, node, var_name):
+        self.names.add(var_name)
+        if self.scopes:
+            binding = self.scopes[-1][var_name] = [False, None]
+        else:
+            binding = self.global_binding(var_name)
+            if var_name in self.declared_globals:
+                # a global declared again is assigned as far as calls go
+                binding[0] = True
+            self.declared_globals.add(var_name)
+        if isinstance(node, Executable) and node.command == "fun":
+            binding[1] = node.value_two
+    def find(self, var_name):
+        self.names.add(var_name)
+        for scope in reversed(self.scopes):
+            binding = scope.get(var_name)
+            if binding is not None:
+                return binding
+        return self.global_binding(var_name)
+    def lookup(self, node):
+        binding = self.bindings[id(node)] = self.find(node.var_name)
+        if binding is not self.globals.get(node.var_name):
+            self.defined_reads.add(id(node))
+        elif node.var_name in self.declared_globals:
+            self.defined_reads.add(id(node))
+        return binding
+    def read(self, node):
+        self.lookup(node)
+    def assign(self, node):
+        self.lookup(node)[0] = True
+    def walk_expression(self, node):
+        super().walk_expression(node)
+        if not isinstance(node, FunctionCallNode):
+            return
+        if id(node.function) not in self.defined_reads:
+            return
+        binding = self.bindings[id(node.function)]
+        function = binding[1]
+        body = self.bodies.get(id(function))
+        if body is None or len(function.arg_names) != len(node.args):
+            return
+        # the body's names have to mean the same at the call
+        if all(self.find(name) is read for name, read in body[2]):
+            self.calls[id(node)] = binding
+    def inline_body(self, function):
+        # the body of a function in the innermost scope as (locals, returned
+        # expression, reads of outer names), None when it cannot be inlined
+        statements = function.execution.statements
+        declarations = []
+        returned = None
+        size = 0
+        for index, statement in enumerate(statements):
+            if not isinstance(statement, Executable):
+                return None
+            if statement.command == "var":
+                value = statement.value_two
+                declarations.append((statement.value, value))
+            elif statement.command == "return" and index == len(statements) - 1:
+                value = returned = statement.value
+            else:
+                return None
+            value_size = self.expression_size(value)
+            if value_size is None:
+                return None
+            size += value_size
+        if size > max_inline_size:
+            return None
+        own_bindings = [id(binding) for binding in self.scopes[-1].values()]
+        reads = []
+        for _, value in declarations:
+            self.collect_reads(value, reads)
+        self.collect_reads(returned, reads)
+        outer_reads = [
+            (node.var_name, self.bindings[id(node)])
+            for node in reads
+            if id(self.bindings[id(node)]) not in own_bindings
+        ]
+        return declarations, returned, outer_reads
+    def expression_size(self, node):
+        # the number of nodes in an expression, None when it has effects
+        if isinstance(node, BinaryNode):
+            left = self.expression_size(node.left)
+            right = self.expression_size(node.right)
+            if left is None or right is None:
+                return None
+            return left + right + 1
+        if isinstance(node, UnaryNode):
+            operand = self.expression_size(node.operand)
+            return None if operand is None else operand + 1
+        if isinstance(node, (AssignNode, FunctionCallNode)):
+            return None
+        return 1
+    def collect_reads(self, node, reads):
+        if isinstance(node, IdentifierNode):
+            reads.append(node)
+        elif isinstance(node, BinaryNode):
+            self.collect_reads(node.left, reads)
+            self.collect_reads(node.right, reads)
+        elif isinstance(node, UnaryNode):
+            self.collect_reads(node.operand, reads)
+    def has_effects(self, node):
+        if isinstance(node, (AssignNode, FunctionCallNode)):
+            return True
+        if isinstance(node, BinaryNode):
+            return self.has_effects(node.left) or self.has_effects(node.right)
+        if isinstance(node, UnaryNode):
+            return self.has_effects(node.operand)
+        return False
+    def inline_statements(self, statements):
+        return [self.inline_statement(statement) for statement in statements]
+    def inline_statement(self, node):
+        # returns the statement to run instead
+        if isinstance(node, BlockNode):
+            node.statements = self.inline_statements(node.statements)
+        elif isinstance(node, Executable):
+            if node.command == "var":
+                node.value_two = self.inline_expression(node.value_two)
+            elif node.command == "fun":
+                body = node.value_two.execution
+                body.statements = self.in_function(
+                    body.statements, self.inline_statements
+                )
+            elif node.command == "if":
+                node.value = self.inline_expression(node.value)
+                node.value_two = self.inline_statement(node.value_two)
+            else:
+                node.value = self.inline_expression(node.value)
+        elif isinstance(node, ElseIfBlockNode):
+            for if_node in node.if_nodes:
+                if_node.truth_val = self.inline_expression(if_node.truth_val)
+                if_node.block = self.inline_statement(if_node.block)
+            node.else_statement = self.inline_statement(node.else_statement)
+        elif isinstance(node, WhileNode):
+            node.condition = self.inline_expression(node.condition)
+            node.execution = self.inline_statement(node.execution)
+        elif isinstance(node, ForNode):
+            if node.initializer is not None:
+                node.initializer = self.inline_statement(node.initializer)
+            node.condition = self.inline_expression(node.condition)
+            node.increment = self.inline_expression(node.increment)
+            node.execution = self.inline_statement(node.execution)
+        else:
+            node = self.inline_expression(node)
+            if not is_executable(node):
+                # literals are wrapped so every statement can be executed
+                node = Executable("expression", node)
+        return node
+    def inline_expression(self, node):
+        if isinstance(node, AssignNode):
+            node.value = self.inline_expression(node.value)
+        elif isinstance(node, BinaryNode):
+            node.left = self.inline_expression(node.left)
+            node.right = self.inline_expression(node.right)
+        elif isinstance(node, UnaryNode):
+            node.operand = self.inline_expression(node.operand)
+        elif isinstance(node, FunctionCallNode):
+            node.args = [self.inline_expression(arg) for arg in node.args]
+            binding = self.calls.get(id(node))
+            if binding is not None and not binding[0]:
+                return self.inline_call(node, binding[1])
+        return node
+    def inline_call(self, call, function):
+        declarations, returned, _ = self.bodies[id(function)]
+        # what each parameter and local reads as in the body
+        values = {}
+        assignments = []
+        later_effects = False
+        movable = []
+        for arg in reversed(call.args):
+            if isinstance(arg, IdentifierNode):
+                movable.append(id(arg) in self.defined_reads and not later_effects)
+            else:
+                movable.append(not is_executable(arg))
+            later_effects = later_effects or self.has_effects(arg)
+        movable.reverse()
+        for arg_name, arg, is_movable in zip(function.arg_names, call.args, movable):
+            if is_movable:
+                values[arg_name] = arg
+            else:
+                values[arg_name] = self.assign_temporary(assignments, arg)
+        for var_name, value in declarations:
+            value = self.substitute(value, values)
+            if is_executable(value):
+                value = self.assign_temporary(assignments, value)
+            values[var_name] = value
+        inlined = self.substitute(returned, values)
+        for assignment in reversed(assignments):
+            # an assignment or true is always true, so and goes on to the body
+            inlined = BinaryNode("and", BinaryNode("or", assignment, True), inlined)
+        self.inlined_count += 1
+        return inlined
+    def assign_temporary(self, assignments, value):
+        # returns a read of a new temporary assigned the value first
+        name = self.new_temporary().value
+        assignments.append(AssignNode(name, value))
+        return IdentifierNode(name)
+    def substitute(self, node, values):
+        # a copy of a body expression reading the given values for its names
+        if isinstance(node, IdentifierNode):
+            if node.var_name in values:
+                return self.substitute(values[node.var_name], {})
+            read = IdentifierNode(node.var_name)
+            read.token_idx = node.token_idx
+            return read
+        if isinstance(node, BinaryNode):
+            return BinaryNode(
+                node.symbol,
+                self.substitute(node.left, values),
+                self.substitute(node.right, values),
+                node.token_idx,
+            )
+        if isinstance(node, UnaryNode):
+            operand = self.substitute(node.operand, values)
+            return UnaryNode(node.symbol, operand, node.token_idx)
+        return node
+class ClosureFunctionNode(FunctionNode):
+    # a function whose body was compiled by the ClosureCompiler
+    def __init__(self, func_name, arg_names, execution, scope, upvalues, body):
+        super().__init__(func_name, arg_names, execution, scope, upvalues)
+        self.body = body
+    def call_function(self, args, is_tail_call=False):
+        if len(args) != len(self.arg_names):
+            raise arity_error(len(self.arg_names), len(args))
+        func_scope = new_function_scope(self, args, self.body)
+        returned = self.execution(func_scope)
+        release_function_scope(func_scope)
+        if returned is None:
+            return None
+        if type(returned[0]) is TailCall and not is_tail_call:
+            return run_tail_calls(returned[0])
+        return returned[0]
+number_types = (int, float)
+closure_numeric_operators = {
+    "-": operator.sub,
+    "*": operator.mul,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+class ClosureCompiler:
+    # turns the compiled node tree into nested python closures, so running a
+    # program is just calling closures instead of dispatching on every node.
+    # statement closures return None, or a 1-tuple holding the return value
+    # once a return statement ran. expression closures return their value.
+    def compile_statements(self, statements):
+        closures = [self.compile_statement(statement) for statement in statements]
+        if len(closures) == 1:
+            return closures[0]
+        def execute_statements(scope):
+            for closure in closures:
+                returned = closure(scope)
+                if returned is not None:
+                    return returned
+        return execute_statements
+    def compile_block(self, node):
+        execution = self.compile_statements(node.statements)
+        if not node.needs_scope:
+            return execution
+        slot_count = node.slot_count
+        def block(scope):
+            return execution(Scope(scope, slots=new_slots(slot_count)))
+        return block
+    def compile_statement(self, node):
+        if isinstance(node, BlockNode):
+            return self.compile_block(node)
+        if isinstance(node, Executable):
+            return self.compile_executable(node)
+        if isinstance(node, ElseIfBlockNode):
+            return self.compile_else_if(node)
+        if isinstance(node, WhileNode):
+            return self.compile_while(node)
+        if isinstance(node, ForNode):
+            return self.compile_for(node)
+        expression = self.compile_expression(node)
+        def expression_statement(scope):
+            expression(scope)
+        return expression_statement
+    def compile_executable(self, node):
+        if node.command == "print":
+            value = self.compile_expression(node.value)
+            def print_statement(scope):
+                print(convert_primitive_to_str(value(scope)))
+            return print_statement
+        if node.command == "if":
+            condition = self.compile_expression(node.value)
+            execution = self.compile_statement(node.value_two)
+            def if_statement(scope):
+                truth_val = condition(scope)
+                # inlined is_truthy
+                if truth_val is not None and truth_val is not False:
+                    return execution(scope)
+            return if_statement
+        if node.command == "var":
+            var_name = node.value
+            var_val = self.compile_expression(node.value_two)
+            slot = node.slot
+            if node.is_captured:
+                def captured_var_statement(scope):
+                    scope.slots[slot] = VariableNode(var_name, var_val(scope))
+                return captured_var_statement
+            if slot is not None:
+                def local_var_statement(scope):
+                    scope.slots[slot] = var_val(scope)
+                return local_var_statement
+            def var_statement(scope):
+                scope.init_variable(var_name, VariableNode(var_name, var_val(scope)))
+            return var_statement
+        if node.command == "fun":
+            func_name = node.value
+            arg_names = node.value_two.arg_names
+            execution = self.compile_statements(node.value_two.execution.statements)
+            body = node.value_two.execution
+            captures = body.captures
+            slot = node.slot
+            is_captured = node.is_captured
+            def fun_statement(scope):
+                if is_captured:
+                    # the function may capture itself, its cell has to exist first
+                    scope.slots[slot] = VariableNode(func_name, None)
+                function = ClosureFunctionNode(
+                    func_name,
+                    arg_names,
+                    execution,
+                    scope.global_scope,
+                    capture_upvalues(captures, scope),
+                    body,
+                )
+                if slot is None:
+                    scope.init_function(func_name, function)
+                elif is_captured:
+                    scope.slots[slot].var_val = function
+                else:
+                    scope.slots[slot] = function
+            return fun_statement
+        if node.command == "return":
+            if tail_calls and isinstance(node.value, FunctionCallNode):
+                return self.compile_tail_call(node.value)
+            value = self.compile_expression(node.value)
+            def return_statement(scope):
+                return (value(scope),)
+            return return_statement
+        if node.command == "expression":
+            value = self.compile_expression(node.value)
+            def expression_statement(scope):
+                value(scope)
+            return expression_statement
+        raise Exception(f"Cannot compile command {node.command}")
+    def compile_tail_call(self, node):
+        function = self.compile_expression(node.function)
+        args = [self.compile_expression(arg) for arg in node.args]
+        token_idx = node.token_idx
+        def tail_call_statement(scope):
+            callee = function(scope)
+            if not isinstance(callee, (FunctionNode, Clock)):
+                raise runtime_error(
+                    Exception("Can only call functions and classes."), token_idx
+                )
+            return (TailCall(callee, [arg(scope) for arg in args], token_idx),)
+        return tail_call_statement
+    def compile_else_if(self, node):
+        branches = [
+            (
+                self.compile_expression(if_node.truth_val),
+                self.compile_statement(if_node.block),
+            )
+            for if_node in node.if_nodes
+        ]
+        else_statement = self.compile_statement(node.else_statement)
+        def else_if_statement(scope):
+            for condition, execution in branches:
+                truth_val = condition(scope)
+                if truth_val is not None and truth_val is not False:
+                    return execution(scope)
+            return else_statement(scope)
+        return else_if_statement
+    def compile_while(self, node):
+        condition = self.compile_expression(node.condition)
+        execution = self.compile_statement(node.execution)
+        def while_statement(scope):
+            while True:
+                truth_val = condition(scope)
+                if truth_val is None or truth_val is False:
+                    return None
+                returned = execution(scope)
+                if returned is not None:
+                    return returned
+        return while_statement
+    def compile_for(self, node):
+        initializer = None
+        if node.initializer is not None:
+            initializer = self.compile_statement(node.initializer)
+        condition = self.compile_expression(
+            True if node.condition is None else node.condition
+        )
+        increment = self.compile_expression(node.increment)
+        execution = self.compile_statement(node.execution)
+        needs_scope = node.needs_scope
+        slot_count = node.slot_count
+        def for_statement(scope):
+            if needs_scope:
+                scope = Scope(scope, slots=new_slots(slot_count))
+            if initializer is not None:
+                initializer(scope)
+            while True:
+                truth_val = condition(scope)
+                if truth_val is None or truth_val is False:
+                    return None
+                returned = execution(scope)
+                if returned is not None:
+                    return returned
+                increment(scope)
+        return for_statement
+    def compile_expression(self, node):
+        if isinstance(node, IdentifierNode):
+            return self.compile_identifier(node)
+        if isinstance(node, BinaryNode):
+            return self.compile_binary(node)
+        if isinstance(node, UnaryNode):
+            return self.compile_unary(node)
+        if isinstance(node, AssignNode):
+            return self.compile_assign(node)
+        if isinstance(node, FunctionCallNode):
+            return self.compile_call(node)
+        if is_executable(node):
+            raise Exception(f"Cannot compile expression {node}")
+        def literal(scope):
+            return node
+        return literal
+    def compile_identifier(self, node):
+        var_name = node.var_name
+        scope_distance = node.scope_distance
+        slot = node.slot
+        token_idx = node.token_idx
+        if scope_distance == -2:
+            def upvalue_identifier(scope):
+                return scope.upvalues[slot].var_val
+            return upvalue_identifier
+        if node.is_captured:
+            def captured_identifier(scope):
+                return scope.ancestor(scope_distance).slots[slot].var_val
+            return captured_identifier
+        if scope_distance == 0:
+            def local_identifier(scope):
+                return scope.slots[slot]
+            return local_identifier
+        if scope_distance == 1:
+            def enclosing_identifier(scope):
+                return scope.parent.slots[slot]
+            return enclosing_identifier
+        if scope_distance == -1:
+            def global_identifier(scope):
+                try:
+                    return scope.get_global(var_name)
+                except Exception as e:
+                    raise runtime_error(e, token_idx)
+            return global_identifier
+        if scope_distance is not None:
+            def outer_identifier(scope):
+                return scope.ancestor(scope_distance).slots[slot]
+            return outer_identifier
+        def identifier(scope):
+            if scope.variable_exists(var_name):
+                return scope.get_variable(var_name).execute()
+            if scope.function_exists(var_name):
+                return scope.get_function(var_name)
+            raise runtime_error(
+                Exception(f"Undefined variable '{var_name}'."), token_idx
+            )
+        return identifier
+    def compile_assign(self, node):
+        var_name = node.var_name
+        value = self.compile_expression(node.value)
+        scope_distance = node.scope_distance
+        slot = node.slot
+        token_idx = node.token_idx
+        if scope_distance == -1:
+            def global_assign(scope):
+                set_value = value(scope)
+                try:
+                    scope.set_global(var_name, set_value)
+                except Exception as e:
+                    raise runtime_error(e, token_idx)
+                return set_value
+            return global_assign
+        if scope_distance == -2:
+            def upvalue_assign(scope):
+                set_value = value(scope)
+                scope.upvalues[slot].var_val = set_value
+                return set_value
+            return upvalue_assign
+        if node.is_captured:
+            def captured_assign(scope):
+                set_value = value(scope)
+                scope.ancestor(scope_distance).slots[slot].var_val = set_value
+                return set_value
+            return captured_assign
+        if scope_distance is not None:
+            def local_assign(scope):
+                set_value = value(scope)
+                scope.ancestor(scope_distance).slots[slot] = set_value
+                return set_value
+            return local_assign
+        def assign(scope):
+            set_value = value(scope)
+            if not scope.variable_exists(var_name):
+                raise runtime_error(
+                    Exception(f"Undefined variable '{var_name}'."), token_idx
+                )
+            scope.get_variable(var_name).var_val = set_value
+            return set_value
+        return assign
+    def compile_unary(self, node):
+        operand = self.compile_expression(node.operand)
+        if node.symbol == "!":
+            def negate(scope):
+                unary_val = operand(scope)
+                return unary_val is None or unary_val is False
+            return negate
+        token_idx = node.token_idx
+        def minus(scope):
+            unary_val = operand(scope)
+            if type(unary_val) not in number_types:
+                raise runtime_error(Exception("Operand must be a number."), token_idx)
+            return -unary_val
+        return minus
+    def compile_binary(self, node):
+        symbol = node.symbol
+        token_idx = node.token_idx
+        left = self.compile_expression(node.left)
+        right = self.compile_expression(node.right)
+        if symbol == "or":
+            def or_expression(scope):
+                left_val = left(scope)
+                if left_val is not None and left_val is not False:
+                    return left_val
+                return right(scope)
+            return or_expression
+        if symbol == "and":
+            def and_expression(scope):
+                left_val = left(scope)
+                if left_val is None or left_val is False:
+                    return left_val
+                return right(scope)
+            return and_expression
+        if symbol in closure_numeric_operators:
+            operation = closure_numeric_operators[symbol]
+            def numeric_expression(scope):
+                left_val = left(scope)
+                right_val = right(scope)
+                if type(left_val) in number_types and type(right_val) in number_types:
+                    return operation(left_val, right_val)
+                raise runtime_error(Exception("Operand must be a number."), token_idx)
+            return numeric_expression
+        if symbol == "+":
+            def add_expression(scope):
+                left_val = left(scope)
+                right_val = right(scope)
+                if type(left_val) in number_types and type(right_val) in number_types:
+                    return left_val + right_val
+                if type(left_val) is str and type(right_val) is str:
+                    return left_val + right_val
+                raise runtime_error(
+                    Exception("Operand must be both number or strings."), token_idx
+                )
+            return add_expression
+        def binary_expression(scope):
+            left_val = left(scope)
+            right_val = right(scope)
+            try:
+                return apply_binary(symbol, left_val, right_val)
+            except Exception as e:
+                raise runtime_error(e, token_idx)
+        return binary_expression
+    def compile_call(self, node):
+        function = self.compile_expression(node.function)
+        args = [self.compile_expression(arg) for arg in node.args]
+        token_idx = node.token_idx
+        def call(scope):
+            callee = function(scope)
+            if not isinstance(callee, (FunctionNode, Clock)):
+                raise runtime_error(
+                    Exception("Can only call functions and classes."), token_idx
+                )
+            arg_vals = [arg(scope) for arg in args]
+            try:
+                return callee.call_function(arg_vals)
+            except Exception as e:
+                raise runtime_error(e, token_idx)
+        return call
+class StackEvaluator:
+    # walks the resolved node tree without recursing in python: pending work is
+    # kept on an explicit task stack and intermediate values on a value stack,
+    # so the depth of lox calls is only bounded by max_call_frames.
+    # a task is a (handler, argument) pair, handlers push more tasks or values
+    def __init__(self):
+        self.tasks = []
+        self.values = []
+        self.scope = None
+        self.depth = 0
+        # pushed when a function is entered, marks where a return unwinds to
+        self.return_marker = self.leave_function
+        self.command_handlers = {
+            "print": self.finish_print,
+            "if": self.finish_if,
+            "var": self.finish_var,
+            "return": self.finish_return,
+            "expression": self.pop_value,
+        }
+        # expressions without calls cannot grow the lox stack, so they are
+        # evaluated directly by their nodes
+        self.call_free = {}
+    def execute_statements(self, statements, scope):
+        self.scope = scope
+        self.push_statements(statements)
+        tasks = self.tasks
+        while tasks:
+            handler, argument = tasks.pop()
+            try:
+                handler(argument)
+            except Exception as e:
+                # the finishing step of an operator or call gets its node
+                raise runtime_error(e, getattr(argument, "token_idx", None))
+    def push_statements(self, statements):
+        for statement in reversed(statements):
+            self.tasks.append((self.execute_statement, statement))
+    def restore_scope(self, scope):
+        self.scope = scope
+    def pop_value(self, _):
+        self.values.pop()
+    def execute_statement(self, node):
+        tasks = self.tasks
+        if isinstance(node, BlockNode):
+            if node.needs_scope:
+                tasks.append((self.restore_scope, self.scope))
+                self.scope = Scope(self.scope, slots=new_slots(node.slot_count))
+            self.push_statements(node.statements)
+        elif isinstance(node, Executable):
+            if node.command == "fun":
+                node.define_function(self.scope)
+                return
+            if (
+                node.command == "return"
+                and tail_calls
+                and isinstance(node.value, FunctionCallNode)
+            ):
+                tasks.append((self.finish_tail_call, node.value))
+                self.push_call_operands(node.value)
+                return
+            tasks.append((self.command_handlers[node.command], node))
+            value = node.value_two if node.command == "var" else node.value
+            tasks.append((self.evaluate, value))
+        elif isinstance(node, ElseIfBlockNode):
+            tasks.append((self.finish_else_if, (node, 0)))
+            tasks.append((self.evaluate, node.if_nodes[0].truth_val))
+        elif isinstance(node, WhileNode):
+            tasks.append((self.finish_while, node))
+            tasks.append((self.evaluate, node.condition))
+        elif isinstance(node, ForNode):
+            if node.needs_scope:
+                tasks.append((self.restore_scope, self.scope))
+                self.scope = Scope(self.scope, slots=new_slots(node.slot_count))
+            tasks.append((self.check_for, node))
+            if node.initializer is not None:
+                tasks.append((self.execute_statement, node.initializer))
+        else:
+            tasks.append((self.pop_value, None))
+            tasks.append((self.evaluate, node))
+    def finish_print(self, node):
+        print(convert_primitive_to_str(self.values.pop()))
+    def finish_if(self, node):
+        if is_truthy(self.values.pop()):
+            self.tasks.append((self.execute_statement, node.value_two))
+    def finish_var(self, node):
+        node.define_variable(self.scope, self.values.pop())
+    def finish_else_if(self, argument):
+        node, index = argument
+        if is_truthy(self.values.pop()):
+            self.tasks.append((self.execute_statement, node.if_nodes[index].block))
+        elif index + 1 < len(node.if_nodes):
+            self.tasks.append((self.finish_else_if, (node, index + 1)))
+            self.tasks.append((self.evaluate, node.if_nodes[index + 1].truth_val))
+        else:
+            self.tasks.append((self.execute_statement, node.else_statement))
+    def finish_while(self, node):
+        if is_truthy(self.values.pop()):
+            self.tasks.append((self.execute_statement, node))
+            self.tasks.append((self.execute_statement, node.execution))
+    def check_for(self, node):
+        if node.condition is None:
+            self.values.append(True)
+        else:
+            self.tasks.append((self.finish_for, node))
+            self.tasks.append((self.evaluate, node.condition))
+            return
+        self.finish_for(node)
+    def finish_for(self, node):
+        if is_truthy(self.values.pop()):
+            tasks = self.tasks
+            tasks.append((self.check_for, node))
+            if node.increment is not None:
+                tasks.append((self.pop_value, None))
+                tasks.append((self.evaluate, node.increment))
+            tasks.append((self.execute_statement, node.execution))
+    def finish_return(self, node):
+        tasks = self.tasks
+        # drop the rest of the function body, up to where the call started
+        while tasks[-1][0] is not self.return_marker:
+            tasks.pop()
+        self.exit_frame(tasks.pop()[1])
+    def leave_function(self, frame):
+        # the body ran to its end without a return statement
+        self.values.append(None)
+        self.exit_frame(frame)
+    def exit_frame(self, frame):
+        caller_scope, func_scope = frame
+        release_function_scope(func_scope)
+        self.scope = caller_scope
+        self.depth -= 1
+    def evaluate(self, node):
+        call_free = self.call_free.get(node)
+        if call_free is None:
+            call_free = self.call_free[node] = not self.has_call(node)
+        if call_free:
+            self.values.append(get_literal_val(node, self.scope))
+            return
+        tasks = self.tasks
+        if isinstance(node, BinaryNode):
+            if node.symbol in ("and", "or"):
+                tasks.append((self.finish_logical, node))
+            else:
+                tasks.append((self.finish_binary, node))
+                tasks.append((self.evaluate, node.right))
+            tasks.append((self.evaluate, node.left))
+        elif isinstance(node, FunctionCallNode):
+            tasks.append((self.finish_call, node))
+            self.push_call_operands(node)
+        elif isinstance(node, UnaryNode):
+            tasks.append((self.finish_unary, node))
+            tasks.append((self.evaluate, node.operand))
+        elif isinstance(node, AssignNode):
+            tasks.append((self.finish_assign, node))
+            tasks.append((self.evaluate, node.value))
+        else:
+            raise Exception(f"Cannot evaluate {node}")
+    def has_call(self, node):
+        if isinstance(node, FunctionCallNode):
+            return True
+        if isinstance(node, BinaryNode):
+            return self.has_call(node.left) or self.has_call(node.right)
+        if isinstance(node, UnaryNode):
+            return self.has_call(node.operand)
+        if isinstance(node, AssignNode):
+            return self.has_call(node.value)
+        return False
+    def finish_logical(self, node):
+        left_val = self.values[-1]
+        if is_truthy(left_val) == (node.symbol == "and"):
+            self.values.pop()
+            self.tasks.append((self.evaluate, node.right))
+    def finish_binary(self, node):
+        right_val = self.values.pop()
+        self.values[-1] = apply_binary(node.symbol, self.values[-1], right_val)
+    def finish_unary(self, node):
+        self.values[-1] = apply_unary(node.symbol, self.values[-1])
+    def finish_assign(self, node):
+        node.assign(self.scope, self.values[-1])
+    def push_call_operands(self, node):
+        for arg in reversed(node.args):
+            self.tasks.append((self.evaluate, arg))
+        self.tasks.append((self.evaluate, node.function))
+    def pop_call_operands(self, node):
+        values = self.values
+        callee_index = len(values) - len(node.args) - 1
+        callee = values[callee_index]
+        args = values[callee_index + 1 :]
+        del values[callee_index:]
+        return callee, args
+    def finish_tail_call(self, node):
+        callee, args = self.pop_call_operands(node)
+        tasks = self.tasks
+        # leave the current function first, so the callee takes its place
+        while tasks[-1][0] is not self.return_marker:
+            tasks.pop()
+        self.exit_frame(tasks.pop()[1])
+        self.enter_function(callee, args)
+    def finish_call(self, node):
+        self.enter_function(*self.pop_call_operands(node))
+    def enter_function(self, callee, args):
+        values = self.values
+        if isinstance(callee, Clock):
+            values.append(callee.call_function(args))
+            return
+        if not isinstance(callee, FunctionNode):
+            raise Exception("Can only call functions and classes.")
+        if len(args) != len(callee.arg_names):
+            raise arity_error(len(callee.arg_names), len(args))
+        if self.depth >= max_call_frames:
+            raise Exception("Stack overflow.")
+        self.depth += 1
+        func_scope = new_function_scope(callee, args, callee.execution)
+        self.tasks.append((self.return_marker, (self.scope, func_scope)))
+        self.scope = func_scope
+        self.push_statements(callee.execution.statements)
+opcode_names = (
+    "OP_CONSTANT",
+    "OP_NIL",
+    "OP_TRUE",
+    "OP_FALSE",
+    "OP_POP",
+    "OP_GET_LOCAL",
+    "OP_SET_LOCAL",
+    "OP_GET_GLOBAL",
+    "OP_DEFINE_GLOBAL",
+    "OP_SET_GLOBAL",
+    "OP_GET_UPVALUE",
+    "OP_SET_UPVALUE",
+    "OP_EQUAL",
+    "OP_NOT_EQUAL",
+    "OP_GREATER",
+    "OP_GREATER_EQUAL",
+    "OP_LESS",
+    "OP_LESS_EQUAL",
+    "OP_ADD",
+    "OP_SUBTRACT",
+    "OP_MULTIPLY",
+    "OP_DIVIDE",
+    "OP_NOT",
+    "OP_NEGATE",
+    "OP_PRINT",
+    "OP_JUMP",
+    "OP_JUMP_IF_FALSE",
+    "OP_POP_JUMP_IF_FALSE",
+    "OP_CALL",
+    "OP_TAIL_CALL",
+    "OP_CLOSURE",
+    "OP_CLOSE_UPVALUE",
+    "OP_RETURN",
+)
+(
+    OP_CONSTANT,
+    OP_NIL,
+    OP_TRUE,
+    OP_FALSE,
+    OP_POP,
+    OP_GET_LOCAL,
+    OP_SET_LOCAL,
+    OP_GET_GLOBAL,
+    OP_DEFINE_GLOBAL,
+    OP_SET_GLOBAL,
+    OP_GET_UPVALUE,
+    OP_SET_UPVALUE,
+    OP_EQUAL,
+    OP_NOT_EQUAL,
+    OP_GREATER,
+    OP_GREATER_EQUAL,
+    OP_LESS,
+    OP_LESS_EQUAL,
+    OP_ADD,
+    OP_SUBTRACT,
+    OP_MULTIPLY,
+    OP_DIVIDE,
+    OP_NOT,
+    OP_NEGATE,
+    OP_PRINT,
+    OP_JUMP,
+    OP_JUMP_IF_FALSE,
+    OP_POP_JUMP_IF_FALSE,
+    OP_CALL,
+    OP_TAIL_CALL,
+    OP_CLOSURE,
+    OP_CLOSE_UPVALUE,
+    OP_RETURN,
+) = range(len(opcode_names))
+# opcodes that are followed by a single operand in the code list
+single_operand_opcodes = {
+    OP_CONSTANT,
+    OP_GET_LOCAL,
+    OP_SET_LOCAL,
+    OP_GET_GLOBAL,
+    OP_DEFINE_GLOBAL,
+    OP_SET_GLOBAL,
+    OP_GET_UPVALUE,
+    OP_SET_UPVALUE,
+    OP_JUMP,
+    OP_JUMP_IF_FALSE,
+    OP_POP_JUMP_IF_FALSE,
+    OP_CALL,
+    OP_TAIL_CALL,
+}
+bytecode_binary_opcodes = {
+    "==": OP_EQUAL,
+    "!=": OP_NOT_EQUAL,
+    ">": OP_GREATER,
+    ">=": OP_GREATER_EQUAL,
+    "<": OP_LESS,
+    "<=": OP_LESS_EQUAL,
+    "+": OP_ADD,
+    "-": OP_SUBTRACT,
+    "*": OP_MULTIPLY,
+    "/": OP_DIVIDE,
+}
+class VMFunction:
+    def __init__(self, name, arity):
+        self.name = name
+        self.arity = arity
+        # flat list of opcodes, each followed by its operands
+        self.code = []
+        # for every entry of code, the token runtime errors of its instruction
+        # point at, or None
+        self.token_idxs = []
+        self.constants = []
+        self.constant_indexes = {}
+        self.upvalue_count = 0
+    def add_constant(self, value):
+        if isinstance(value, VMFunction):
+            self.constants.append(value)
+            return len(self.constants) - 1
+        # keyed on the type too, so 1 and true do not share a slot
+        key = (type(value), value)
+        if key not in self.constant_indexes:
+            self.constant_indexes[key] = len(self.constants)
+            self.constants.append(value)
+        return self.constant_indexes[key]
+class VMClosure:
+    def __init__(self, function, upvalues):
+        self.function = function
+        self.upvalues = upvalues
+class VMUpvalue:
+    def __init__(self, index):
+        # index into the vm stack while open, value once closed
+        self.index = index
+        self.closed = False
+        self.value = None
+class BytecodeCompiler:
+    def __init__(self, function, enclosing=None, tokens=None):
+        self.function = function
+        self.enclosing = enclosing
+        # the TokenStore the program was parsed from, for error lines
+        self.tokens = tokens
+        # slot 0 holds the function being called
+        self.locals = [["", 0, False]]
+        self.upvalues = []
+        self.scope_depth = 0
+    def compile_program(self, statements):
+        for statement in statements:
+            self.compile_statement(statement)
+        self.emit(OP_NIL)
+        self.emit(OP_RETURN)
+        return self.function
+    def emit(self, *code):
+        self.emit_at(None, *code)
+    def emit_at(self, token_idx, *code):
+        self.function.code.extend(code)
+        self.function.token_idxs.extend([token_idx] * len(code))
+    def emit_jump(self, opcode):
+        self.emit(opcode, -1)
+        return len(self.function.code) - 1
+    def patch_jump(self, operand_idx):
+        self.function.code[operand_idx] = len(self.function.code)
+    def emit_constant(self, value):
+        self.emit(OP_CONSTANT, self.function.add_constant(value))
+    def begin_scope(self):
+        self.scope_depth += 1
+    def end_scope(self):
+        self.scope_depth -= 1
+        while self.locals and self.locals[-1][1] > self.scope_depth:
+            if self.locals[-1][2]:
+                self.emit(OP_CLOSE_UPVALUE)
+            else:
+                self.emit(OP_POP)
+            self.locals.pop()
+    def error_line(self, token_idx):
+        if self.tokens is None or token_idx is None:
+            return 1
+        return self.tokens.line(token_idx)
+    def declare_local(self, var_name, token_idx=None):
+        for name, depth, _ in reversed(self.locals):
+            if depth != -1 and depth < self.scope_depth:
+                break
+            if name == var_name:
+                raise Exception(
+                    f"[line {self.error_line(token_idx)}] Error at '{var_name}': "
+                    "Already a variable with this name in this scope."
+                )
+        # depth -1 marks the local as declared but not yet initialized
+        self.locals.append([var_name, -1, False])
+    def mark_initialized(self):
+        self.locals[-1][1] = self.scope_depth
+    def define_variable(self, var_name):
+        if self.scope_depth > 0:
+            self.mark_initialized()
+            return
+        self.emit(OP_DEFINE_GLOBAL, self.function.add_constant(var_name))
+    def resolve_local(self, var_name, is_read=True, token_idx=None):
+        for slot in range(len(self.locals) - 1, -1, -1):
+            name, depth, _ = self.locals[slot]
+            if name == var_name:
+                if depth == -1 and is_read:
+                    raise Exception(
+                        f"[line {self.error_line(token_idx)}] Error at '{var_name}': "
+                        "Can't read local variable in its own initializer."
+                    )
+                return slot
+        return -1
+    def resolve_upvalue(self, var_name):
+        if self.enclosing is None:
+            return -1
+        slot = self.enclosing.resolve_local(var_name)
+        if slot != -1:
+            self.enclosing.locals[slot][2] = True
+            return self.add_upvalue(True, slot)
+        upvalue = self.enclosing.resolve_upvalue(var_name)
+        if upvalue != -1:
+            return self.add_upvalue(False, upvalue)
+        return -1
+    def add_upvalue(self, is_local, index):
+        if (is_local, index) in self.upvalues:
+            return self.upvalues.index((is_local, index))
+        self.upvalues.append((is_local, index))
+        self.function.upvalue_count = len(self.upvalues)
+        return len(self.upvalues) - 1
+    def compile_statement(self, node):
+        if isinstance(node, BlockNode):
+            self.begin_scope()
+            for statement in node.statements:
+                self.compile_statement(statement)
+            self.end_scope()
+        elif isinstance(node, Executable):
+            self.compile_executable(node)
+        elif isinstance(node, ElseIfBlockNode):
+            end_jumps = []
+            for if_node in node.if_nodes:
+                self.compile_expression(if_node.truth_val)
+                else_jump = self.emit_jump(OP_POP_JUMP_IF_FALSE)
+                self.compile_statement(if_node.block)
+                end_jumps.append(self.emit_jump(OP_JUMP))
+                self.patch_jump(else_jump)
+            self.compile_statement(node.else_statement)
+            for end_jump in end_jumps:
+                self.patch_jump(end_jump)
+        elif isinstance(node, WhileNode):
+            loop_start = len(self.function.code)
+            self.compile_expression(node.condition)
+            exit_jump = self.emit_jump(OP_POP_JUMP_IF_FALSE)
+            self.compile_statement(node.execution)
+            self.emit(OP_JUMP, loop_start)
+            self.patch_jump(exit_jump)
+        elif isinstance(node, ForNode):
+            self.begin_scope()
+            if node.initializer is not None:
+                self.compile_statement(node.initializer)
+            loop_start = len(self.function.code)
+            exit_jump = None
+            if node.condition is not None:
+                self.compile_expression(node.condition)
+                exit_jump = self.emit_jump(OP_POP_JUMP_IF_FALSE)
+            self.compile_statement(node.execution)
+            if node.increment is not None:
+                self.compile_expression(node.increment)
+                self.emit(OP_POP)
+            self.emit(OP_JUMP, loop_start)
+            if exit_jump is not None:
+                self.patch_jump(exit_jump)
+            self.end_scope()
+        else:
+            self.compile_expression(node)
+            self.emit(OP_POP)
+    def compile_executable(self, node):
+        if node.command == "print":
+            self.compile_expression(node.value)
+            self.emit(OP_PRINT)
+        elif node.command == "if":
+            self.compile_expression(node.value)
+            end_jump = self.emit_jump(OP_POP_JUMP_IF_FALSE)
+            self.compile_statement(node.value_two)
+            self.patch_jump(end_jump)
+        elif node.command == "var":
+            if self.scope_depth > 0:
+                self.declare_local(node.value, node.token_idx)
+            self.compile_expression(node.value_two)
+            self.define_variable(node.value)
+        elif node.command == "fun":
+            if self.scope_depth > 0:
+                self.declare_local(node.value, node.token_idx)
+                # a local function may refer to itself
+                self.mark_initialized()
+            self.compile_function(node.value_two)
+            self.define_variable(node.value)
+        elif node.command == "return":
+            if self.enclosing is None:
+                raise Exception(
+                    f"[line {self.error_line(node.token_idx)}] Error at 'return': "
+                    "Can't return from top-level code."
+                )
+            if tail_calls and isinstance(node.value, FunctionCallNode):
+                # a closure it calls takes over the frame, so the return after
+                # it only runs for other callees
+                self.compile_call(node.value, OP_TAIL_CALL)
+            else:
+                self.compile_expression(node.value)
+            self.emit(OP_RETURN)
+        elif node.command == "expression":
+            self.compile_expression(node.value)
+            self.emit(OP_POP)
+        else:
+            raise Exception(f"Cannot compile command {node.command}")
+    def compile_function(self, function_node):
+        function = VMFunction(function_node.func_name, len(function_node.arg_names))
+        compiler = BytecodeCompiler(function, self, self.tokens)
+        compiler.begin_scope()
+        # parameters have no token of their own, errors point at the fun
+        fun_idx = None
+        if function_node.token_range is not None:
+            fun_idx = function_node.token_range[0]
+        for arg_name in function_node.arg_names:
+            compiler.declare_local(arg_name, fun_idx)
+            compiler.mark_initialized()
+        for statement in function_node.execution.statements:
+            compiler.compile_statement(statement)
+        compiler.emit(OP_NIL)
+        compiler.emit(OP_RETURN)
+        self.emit(OP_CLOSURE, self.function.add_constant(function))
+        for is_local, index in compiler.upvalues:
+            self.emit(1 if is_local else 0, index)
+    def compile_expression(self, node):
+        if isinstance(node, (IdentifierNode, AssignNode)):
+            self.compile_variable(node)
+        elif isinstance(node, BinaryNode):
+            self.compile_binary(node)
+        elif isinstance(node, UnaryNode):
+            self.compile_expression(node.operand)
+            self.emit_at(node.token_idx, OP_NOT if node.symbol == "!" else OP_NEGATE)
+        elif isinstance(node, FunctionCallNode):
+            self.compile_call(node, OP_CALL)
+        elif is_executable(node):
+            raise Exception(f"Cannot compile expression {node}")
+        elif node is None:
+            self.emit(OP_NIL)
+        elif node is True:
+            self.emit(OP_TRUE)
+        elif node is False:
+            self.emit(OP_FALSE)
+        else:
+            self.emit_constant(node)
+    def compile_call(self, node, opcode):
+        self.compile_expression(node.function)
+        for arg in node.args:
+            self.compile_expression(arg)
+        self.emit_at(node.token_idx, opcode, len(node.args))
+    def compile_variable(self, node):
+        var_name = node.var_name
+        is_assignment = isinstance(node, AssignNode)
+        slot = self.resolve_local(var_name, not is_assignment, node.token_idx)
+        if slot != -1 and is_assignment and self.locals[slot][1] == -1:
+            # assigned in its own initializer: the slot still holds operands
+            # and the initializer's value replaces this one anyway
+            self.compile_expression(node.value)
+            return
+        if slot != -1:
+            get_op, set_op = OP_GET_LOCAL, OP_SET_LOCAL
+        else:
+            slot = self.resolve_upvalue(var_name)
+            if slot != -1:
+                get_op, set_op = OP_GET_UPVALUE, OP_SET_UPVALUE
+            else:
+                slot = self.function.add_constant(var_name)
+                get_op, set_op = OP_GET_GLOBAL, OP_SET_GLOBAL
+        if is_assignment:
+            self.compile_expression(node.value)
+            self.emit_at(node.token_idx, set_op, slot)
+        else:
+            self.emit_at(node.token_idx, get_op, slot)
+    def compile_binary(self, node):
+        self.compile_expression(node.left)
+        if node.symbol in ("and", "or"):
+            if node.symbol == "and":
+                end_jump = self.emit_jump(OP_JUMP_IF_FALSE)
+            else:
+                else_jump = self.emit_jump(OP_JUMP_IF_FALSE)
+                end_jump = self.emit_jump(OP_JUMP)
+                self.patch_jump(else_jump)
+            self.emit(OP_POP)
+            self.compile_expression(node.right)
+            self.patch_jump(end_jump)
+            return
+        self.compile_expression(node.right)
+        self.emit_at(node.token_idx, bytecode_binary_opcodes[node.symbol])
+class VirtualMachine:
+    def __init__(self):
+        self.stack = []
+        self.frames = []
+        self.globals = {"clock": Clock()}
+        # open upvalues keyed by the stack index they point at
+        self.open_upvalues = {}
+    def interpret(self, function):
+        closure = VMClosure(function, [])
+        self.stack.append(closure)
+        self.run(closure)
+    def capture_upvalue(self, index):
+        upvalue = self.open_upvalues.get(index)
+        if upvalue is None:
+            upvalue = VMUpvalue(index)
+            self.open_upvalues[index] = upvalue
+        return upvalue
+    def close_upvalues(self, last_index):
+        for index in [index for index in self.open_upvalues if index >= last_index]:
+            upvalue = self.open_upvalues.pop(index)
+            upvalue.value = self.stack[index]
+            upvalue.closed = True
+    def error(self, message, closure, ip):
+        # ip has moved past the opcode, so it is still inside the instruction
+        return runtime_error(Exception(message), closure.function.token_idxs[ip - 1])
+    def run(self, closure):
+        stack = self.stack
+        frames = self.frames
+        global_vars = self.globals
+        code = closure.function.code
+        constants = closure.function.constants
+        ip = 0
+        base = len(stack) - 1
+        while True:
+            opcode = code[ip]
+            ip += 1
+            if opcode == OP_GET_LOCAL:
+                stack.append(stack[base + code[ip]])
+                ip += 1
+            elif opcode == OP_CONSTANT:
+                stack.append(constants[code[ip]])
+                ip += 1
+            elif opcode == OP_POP_JUMP_IF_FALSE:
+                truth_val = stack.pop()
+                if truth_val is None or truth_val is False:
+                    ip = code[ip]
+                else:
+                    ip += 1
+            elif opcode == OP_POP:
+                stack.pop()
+            elif opcode == OP_SET_LOCAL:
+                stack[base + code[ip]] = stack[-1]
+                ip += 1
+            elif opcode == OP_GET_GLOBAL:
+                var_name = constants[code[ip]]
+                ip += 1
+                if var_name not in global_vars:
+                    raise self.error(f"Undefined variable '{var_name}'.", closure, ip)
+                stack.append(global_vars[var_name])
+            elif opcode == OP_JUMP:
+                ip = code[ip]
+            elif opcode == OP_ADD:
+                right_val = stack.pop()
+                left_val = stack[-1]
+                if type(left_val) in number_types and type(right_val) in number_types:
+                    stack[-1] = left_val + right_val
+                elif type(left_val) is str and type(right_val) is str:
+                    stack[-1] = left_val + right_val
+                else:
+                    raise self.error(
+                        "Operand must be both number or strings.", closure, ip
+                    )
+            elif opcode == OP_SUBTRACT:
+                right_val = stack.pop()
+                left_val = stack[-1]
+                if (
+                    type(left_val) not in number_types
+                    or type(right_val) not in number_types
+                ):
+                    raise self.error("Operand must be a number.", closure, ip)
+                stack[-1] = left_val - right_val
+            elif opcode == OP_LESS:
+                right_val = stack.pop()
+                left_val = stack[-1]
+                if (
+                    type(left_val) not in number_types
+                    or type(right_val) not in number_types
+                ):
+                    raise self.error("Operand must be a number.", closure, ip)
+                stack[-1] = left_val < right_val
+            elif opcode == OP_CALL:
+                arg_count = code[ip]
+                ip += 1
+                callee = stack[-1 - arg_count]
+                if isinstance(callee, VMClosure):
+                    function = callee.function
+                    if function.arity != arg_count:
+                        raise runtime_error(
+                            arity_error(function.arity, arg_count),
+                            closure.function.token_idxs[ip - 1],
+                        )
+                    if len(frames) >= max_call_frames:
+                        raise self.error("Stack overflow.", closure, ip)
+                    frames.append((closure, code, constants, ip, base))
+                    closure = callee
+                    code = function.code
+                    constants = function.constants
+                    ip = 0
+                    base = len(stack) - arg_count - 1
+                elif isinstance(callee, Clock):
+                    args = stack[len(stack) - arg_count :]
+                    del stack[len(stack) - arg_count - 1 :]
+                    stack.append(callee.call_function(args))
+                else:
+                    raise self.error(
+                        "Can only call functions and classes.", closure, ip
+                    )
+            elif opcode == OP_RETURN:
+                return_val = stack.pop()
+                if self.open_upvalues:
+                    self.close_upvalues(base)
+                del stack[base:]
+                if not frames:
+                    return None
+                stack.append(return_val)
+                closure, code, constants, ip, base = frames.pop()
+            elif opcode == OP_TAIL_CALL:
+                arg_count = code[ip]
+                ip += 1
+                callee = stack[-1 - arg_count]
+                if isinstance(callee, VMClosure):
+                    function = callee.function
+                    if function.arity != arg_count:
+                        raise runtime_error(
+                            arity_error(function.arity, arg_count),
+                            closure.function.token_idxs[ip - 1],
+                        )
+                    # the callee and its arguments replace the returning frame
+                    if self.open_upvalues:
+                        self.close_upvalues(base)
+                    stack[base:] = stack[len(stack) - arg_count - 1 :]
+                    closure = callee
+                    code = function.code
+                    constants = function.constants
+                    ip = 0
+                elif isinstance(callee, Clock):
+                    args = stack[len(stack) - arg_count :]
+                    del stack[len(stack) - arg_count - 1 :]
+                    stack.append(callee.call_function(args))
+                else:
+                    raise self.error(
+                        "Can only call functions and classes.", closure, ip
+                    )
+            elif opcode == OP_GET_UPVALUE:
+                upvalue = closure.upvalues[code[ip]]
+                ip += 1
+                stack.append(upvalue.value if upvalue.closed else stack[upvalue.index])
+            elif opcode == OP_SET_UPVALUE:
+                upvalue = closure.upvalues[code[ip]]
+                ip += 1
+                if upvalue.closed:
+                    upvalue.value = stack[-1]
+                else:
+                    stack[upvalue.index] = stack[-1]
+            elif opcode == OP_NIL:
+                stack.append(None)
+            elif opcode == OP_TRUE:
+                stack.append(True)
+            elif opcode == OP_FALSE:
+                stack.append(False)
+            elif opcode == OP_DEFINE_GLOBAL:
+                global_vars[constants[code[ip]]] = stack.pop()
+                ip += 1
+            elif opcode == OP_SET_GLOBAL:
+                var_name = constants[code[ip]]
+                ip += 1
+                if var_name not in global_vars:
+                    raise self.error(f"Undefined variable '{var_name}'.", closure, ip)
+                global_vars[var_name] = stack[-1]
+            elif opcode == OP_EQUAL:
+                right_val = stack.pop()
+                stack[-1] = stack[-1] == right_val
+            elif opcode == OP_NOT_EQUAL:
+                right_val = stack.pop()
+                stack[-1] = stack[-1] != right_val
+            elif opcode in (OP_GREATER, OP_GREATER_EQUAL, OP_LESS_EQUAL, OP_MULTIPLY):
+                right_val = stack.pop()
+                left_val = stack[-1]
+                if (
+                    type(left_val) not in number_types
+                    or type(right_val) not in number_types
+                ):
+                    raise self.error("Operand must be a number.", closure, ip)
+                if opcode == OP_GREATER:
+                    stack[-1] = left_val > right_val
+                elif opcode == OP_GREATER_EQUAL:
+                    stack[-1] = left_val >= right_val
+                elif opcode == OP_LESS_EQUAL:
+                    stack[-1] = left_val <= right_val
+                else:
+                    stack[-1] = left_val * right_val
+            elif opcode == OP_DIVIDE:
+                right_val = stack.pop()
+                try:
+                    stack[-1] = apply_binary("/", stack[-1], right_val)
+                except Exception as e:
+                    raise runtime_error(e, closure.function.token_idxs[ip - 1])
+            elif opcode == OP_NOT:
+                truth_val = stack[-1]
+                stack[-1] = truth_val is None or truth_val is False
+            elif opcode == OP_NEGATE:
+                if type(stack[-1]) not in number_types:
+                    raise self.error("Operand must be a number.", closure, ip)
+                stack[-1] = -stack[-1]
+            elif opcode == OP_PRINT:
+                print(convert_primitive_to_str(stack.pop()))
+            elif opcode == OP_JUMP_IF_FALSE:
+                truth_val = stack[-1]
+                if truth_val is None or truth_val is False:
+                    ip = code[ip]
+                else:
+                    ip += 1
+            elif opcode == OP_CLOSURE:
+                function = constants[code[ip]]
+                ip += 1
+                upvalues = []
+                for _ in range(function.upvalue_count):
+                    is_local = code[ip]
+                    index = code[ip + 1]
+                    ip += 2
+                    if is_local:
+                        upvalues.append(self.capture_upvalue(base + index))
+                    else:
+                        upvalues.append(closure.upvalues[index])
+                stack.append(VMClosure(function, upvalues))
+            elif opcode == OP_CLOSE_UPVALUE:
+                self.close_upvalues(len(stack) - 1)
+                stack.pop()
+            else:
+                raise Exception(f"Unknown opcode {opcode}")
+def disassemble_function(function, out):
+    out.write(f"== {function.name} ==\n")
+    code = function.code
+    ip = 0
+    while ip < len(code):
+        opcode = code[ip]
+        name = opcode_names[opcode]
+        if opcode == OP_CLOSURE:
+            constant = function.constants[code[ip + 1]]
+            out.write(f"{ip:04d} {name:<20} {code[ip + 1]:4d} <fn {constant.name}>\n")
+            ip += 2
+            for _ in range(constant.upvalue_count):
+                kind = "local" if code[ip] else "upvalue"
+                out.write(f"{ip:04d}    |{'':>17} {kind} {code[ip + 1]}\n")
+                ip += 2
+        elif opcode in (OP_JUMP, OP_JUMP_IF_FALSE, OP_POP_JUMP_IF_FALSE):
+            out.write(f"{ip:04d} {name:<20} -> {code[ip + 1]:04d}\n")
+            ip += 2
+        elif opcode in (OP_CONSTANT, OP_GET_GLOBAL, OP_DEFINE_GLOBAL, OP_SET_GLOBAL):
+            constant = function.constants[code[ip + 1]]
+            out.write(f"{ip:04d} {name:<20} {code[ip + 1]:4d} '{constant}'\n")
+            ip += 2
+        elif opcode in single_operand_opcodes:
+            out.write(f"{ip:04d} {name:<20} {code[ip + 1]:4d}\n")
+            ip += 2
+        else:
+            out.write(f"{ip:04d} {name}\n")
+            ip += 1
+    for constant in function.constants:
+        if isinstance(constant, VMFunction):
+            out.write("\n")
+            disassemble_function(constant, out)
+def compile_bytecode(tokens):
+    statements = Parser(tokens).compile_program()
+    compiler = BytecodeCompiler(VMFunction("<script>", 0), tokens=tokens)
+    return compiler.compile_program(statements)
+def disasm(file_contents):
+    tokens = tokenize_with_list(file_contents)
+    if tokens is None:
+        return 65
+    try:
+        function = compile_bytecode(tokens)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 65
+    disassemble_function(function, sys.stdout)
+    return 0
+class PythonBinding:
+    def __init__(self, py_name, function_depth, is_global):
+        self.py_name = py_name
+        self.function_depth = function_depth
+        self.is_global = is_global
+        # captured locals are boxed in a one element list, so every closure
+        # shares the variable the declaration created
+        self.captured = False
+class PythonFunctionContext:
+    def __init__(self, depth):
+        self.depth = depth
+        # bindings of enclosing functions this function or a nested one uses
+        self.free_bindings = {}
+        self.assigned_globals = set()
+class PythonTranspiler(ScopeWalker):
+    # turns the compiled node tree into python source, so CPython's own
+    # bytecode loop runs the program. lox semantics python does not share
+    # (truthiness, the + type rules, number checks) go through small helpers
+    # unless the operand types are known at compile time.
+    def __init__(self, tokens=None):
+        # the TokenStore the program was parsed from, for error lines
+        super().__init__()
+        self.tokens = tokens
+        self.bindings = {}
+        self.function_contexts = {}
+        self.function_stack = [PythonFunctionContext(0)]
+        self.name_counts = {}
+        self.declared_globals = set()
+        self.lines = []
+        # the token of every call and global read, by the (line, end column)
+        # python reports for the instruction that fails running it. the helpers
+        # for the other operations that can fail are given their token
+        self.positions = {}
+        # the parameter counts of the functions defined under each def name,
+        # to word python's errors about calls with too few arguments
+        self.arities = {}
+        self.indent = 0
+        self.temp_count = 0
+    def transpile_program(self, statements):
+        self.walk_statements(statements)
+        for statement in statements:
+            self.emit_statement(statement)
+        return "\n".join(self.lines) + "\n"
+    def new_local_name(self, var_name):
+        # globals are g_<name> and locals l<count>_<name>. the count ends at the
+        # first underscore, so no two variables get the same python name
+        count = self.name_counts.get(var_name, 0) + 1
+        self.name_counts[var_name] = count
+        return f"l{count}_{var_name}"
+    def enter_scope(self, node):
+        if isinstance(node, FunctionNode):
+            context = PythonFunctionContext(self.function_stack[-1].depth + 1)
+            self.function_contexts[id(node)] = context
+            self.function_stack.append(context)
+        super().enter_scope(node)
+    def leave_scope(self, node):
+        super().leave_scope(node)
+        if isinstance(node, FunctionNode):
+            self.function_stack.pop()
+    def declare(self, node, var_name):
+        function_depth = self.function_stack[-1].depth
+        if not self.scopes:
+            binding = PythonBinding(f"g_{var_name}", 0, True)
+        else:
+            py_name = self.new_local_name(var_name)
+            binding = PythonBinding(py_name, function_depth, False)
+            self.scopes[-1][var_name] = binding
+        if isinstance(node, FunctionNode):
+            # parameters are keyed by their function and name
+            self.bindings[(id(node), var_name)] = binding
+        else:
+            self.bindings[id(node)] = binding
+    def read(self, node):
+        self.resolve_name(node, False)
+    def assign(self, node):
+        self.resolve_name(node, True)
+    def resolve_name(self, node, is_assignment):
+        for scope in reversed(self.scopes):
+            if node.var_name in scope:
+                binding = scope[node.var_name]
+                break
+        else:
+            binding = PythonBinding(f"g_{node.var_name}", 0, True)
+        self.bindings[id(node)] = binding
+        if binding.is_global:
+            if is_assignment:
+                self.function_stack[-1].assigned_globals.add(binding.py_name)
+            return
+        if binding.function_depth < self.function_stack[-1].depth:
+            binding.captured = True
+            for context in self.function_stack:
+                if context.depth > binding.function_depth:
+                    context.free_bindings[binding.py_name] = binding
+    def error_line(self, token_idx):
+        if self.tokens is None or token_idx is None:
+            return 1
+        return self.tokens.line(token_idx)
+    def emit(self, line):
+        line = "    " * self.indent + line
+        if "\0" in line:
+            # marks left by mark, their column is in UTF-8 bytes like python's
+            parts = line.split("\0")
+            line = parts[0]
+            column = len(line.encode())
+            for token_idx, text in zip(parts[1::2], parts[2::2]):
+                self.positions[(len(self.lines) + 1, column)] = int(token_idx)
+                line += text
+                column += len(text.encode())
+        self.lines.append(line)
+    def mark(self, code, token_idx):
+        # code followed by a mark emit turns into an entry of positions
+        if token_idx is None:
+            return code
+        return f"{code}\0{token_idx}\0"
+    def emit_body(self, statements):
+        self.indent += 1
+        start = len(self.lines)
+        for statement in statements:
+            self.emit_statement(statement)
+        if len(self.lines) == start:
+            self.emit("pass")
+        self.indent -= 1
+    def emit_statement(self, node):
+        if isinstance(node, BlockNode):
+            for statement in node.statements:
+                self.emit_statement(statement)
+        elif isinstance(node, Executable):
+            self.emit_executable(node)
+        elif isinstance(node, ElseIfBlockNode):
+            keyword = "if"
+            for if_node in node.if_nodes:
+                self.emit(f"{keyword} {self.truth_expression(if_node.truth_val)}:")
+                self.emit_body([if_node.block])
+                keyword = "elif"
+            self.emit("else:")
+            self.emit_body([node.else_statement])
+        elif isinstance(node, WhileNode):
+            self.emit(f"while {self.truth_expression(node.condition)}:")
+            self.emit_body([node.execution])
+        elif isinstance(node, ForNode):
+            if node.initializer is not None:
+                self.emit_statement(node.initializer)
+            condition = "True"
+            if node.condition is not None:
+                condition = self.truth_expression(node.condition)
+            self.emit(f"while {condition}:")
+            increment = [] if node.increment is None else [node.increment]
+            self.emit_body([node.execution] + increment)
+        elif isinstance(node, AssignNode):
+            self.emit(self.assignment(node, as_statement=True))
+        else:
+            self.emit(self.expression(node))
+    def emit_executable(self, node):
+        if node.command == "print":
+            self.emit(f"_print({self.expression(node.value)})")
+        elif node.command == "if":
+            self.emit(f"if {self.truth_expression(node.value)}:")
+            self.emit_body([node.value_two])
+        elif node.command == "var":
+            binding = self.bindings[id(node)]
+            if binding.captured:
+                # the box has to exist before the initializer may assign it
+                self.emit(f"{binding.py_name} = [None]")
+                self.emit(f"{binding.py_name}[0] = {self.expression(node.value_two)}")
+                return
+            value = self.expression(node.value_two)
+            if binding.is_global:
+                self.declared_globals.add(binding.py_name)
+            self.emit(f"{binding.py_name} = {value}")
+        elif node.command == "fun":
+            self.emit_function(self.bindings[id(node)], node.value_two)
+        elif node.command == "return":
+            if len(self.function_stack) == 1:
+                raise Exception(
+                    f"[line {self.error_line(node.token_idx)}] Error at 'return': "
+                    "Can't return from top-level code."
+                )
+            if tail_calls and isinstance(node.value, FunctionCallNode):
+                # the caller's _run_tail_calls makes the call in this frame's place
+                function = self.expression(node.value.function)
+                args = ", ".join(self.expression(arg) for arg in node.value.args)
+                token_idx = node.value.token_idx
+                self.emit(f"return _tail_call({function}, [{args}], {token_idx})")
+            else:
+                self.emit(f"return {self.expression(node.value)}")
+        elif node.command == "expression":
+            self.emit(self.expression(node.value))
+    def emit_function(self, binding, function_node):
+        context = self.function_contexts[id(function_node)]
+        if binding.is_global:
+            self.declared_globals.add(binding.py_name)
+        def_name = binding.py_name
+        if binding.captured:
+            # the box has to exist before the def, so the function can see itself
+            self.emit(f"{binding.py_name} = [None]")
+            def_name = f"fn_{binding.py_name}"
+        arg_names = [
+            self.bindings[(id(function_node), arg_name)].py_name
+            for arg_name in function_node.arg_names
+        ]
+        params = list(arg_names)
+        if context.free_bindings:
+            params.append("*")
+            params.extend(f"{py_name}={py_name}" for py_name in context.free_bindings)
+        self.arities.setdefault(def_name, set()).add(len(arg_names))
+        self.emit(f"def {def_name}({', '.join(params)}):")
+        self.function_stack.append(context)
+        self.indent += 1
+        if context.assigned_globals:
+            self.emit(f"global {', '.join(sorted(context.assigned_globals))}")
+        for arg_name, py_name in zip(function_node.arg_names, arg_names):
+            if self.bindings[(id(function_node), arg_name)].captured:
+                self.emit(f"{py_name} = [{py_name}]")
+        self.indent -= 1
+        self.emit_body(function_node.execution.statements)
+        self.function_stack.pop()
+        self.emit(f"{def_name}.__name__ = {function_node.func_name!r}")
+        if binding.captured:
+            self.emit(f"{binding.py_name}[0] = {def_name}")
+    def boxed(self, binding, value):
+        return f"[{value}]" if binding.captured else value
+    def variable(self, binding):
+        return f"{binding.py_name}[0]" if binding.captured else binding.py_name
+    def assignment(self, node, as_statement=False):
+        binding = self.bindings[id(node)]
+        value = self.expression(node.value)
+        if binding.is_global and binding.py_name not in self.declared_globals:
+            # assigning a global that may not be defined yet is a runtime error
+            return f"_set_global({binding.py_name!r}, {value}, {node.token_idx})"
+        if as_statement:
+            return f"{self.variable(binding)} = {value}"
+        if binding.captured:
+            return f"_set_item({binding.py_name}, {value})"
+        return f"({binding.py_name} := {value})"
+    def new_temp(self):
+        self.temp_count += 1
+        return f"_t{self.temp_count}"
+    def truth_expression(self, node):
+        if self.static_type(node) is bool:
+            return self.expression(node)
+        temp = self.new_temp()
+        value = self.expression(node)
+        return f"(({temp} := {value}) is not None and {temp} is not False)"
+    def static_type(self, node):
+        # the python type an expression is known to produce, or None
+        if isinstance(node, bool):
+            return bool
+        if isinstance(node, (int, float, str)):
+            return float if isinstance(node, (int, float)) else str
+        if isinstance(node, UnaryNode):
+            return bool if node.symbol == "!" else float
+        if isinstance(node, BinaryNode):
+            if node.symbol in ("-", "*", "/"):
+                return float
+            if node.symbol in ("==", "!=", "<", "<=", ">", ">="):
+                return bool
+            left_type = self.static_type(node.left)
+            if left_type is not None and left_type == self.static_type(node.right):
+                return left_type
+        return None
+    def expression(self, node):
+        if isinstance(node, IdentifierNode):
+            binding = self.bindings[id(node)]
+            if binding.is_global:
+                return self.mark(binding.py_name, node.token_idx)
+            return self.variable(binding)
+        if isinstance(node, AssignNode):
+            return self.assignment(node)
+        if isinstance(node, BinaryNode):
+            return self.binary_expression(node)
+        if isinstance(node, UnaryNode):
+            operand = self.expression(node.operand)
+            if node.symbol == "!":
+                if self.static_type(node.operand) is bool:
+                    return f"(not {operand})"
+                return f"(not {self.truth_expression(node.operand)})"
+            if self.static_type(node.operand) is float:
+                return f"(-{operand})"
+            return f"_negate({operand}, {node.token_idx})"
+        if isinstance(node, FunctionCallNode):
+            function = self.expression(node.function)
+            args = ", ".join(self.expression(arg) for arg in node.args)
+            call = self.mark(f"{function}({args})", node.token_idx)
+            if tail_calls:
+                return f"_run_tail_calls({call})"
+            return call
+        return repr(node)
+    def binary_expression(self, node):
+        symbol = node.symbol
+        left = self.expression(node.left)
+        right = self.expression(node.right)
+        left_type = self.static_type(node.left)
+        right_type = self.static_type(node.right)
+        if symbol in ("and", "or"):
+            if left_type is bool and right_type is bool:
+                return f"({left} {symbol} {right})"
+            temp = self.new_temp()
+            truth = f"({temp} := {left}) is not None and {temp} is not False"
+            if symbol == "and":
+                return f"({right} if {truth} else {temp})"
+            return f"({temp} if {truth} else {right})"
+        if symbol in ("==", "!="):
+            return f"({left} {symbol} {right})"
+        if left_type is float and right_type is float and symbol != "/":
+            return f"({left} {symbol} {right})"
+        if symbol == "+" and left_type is str and right_type is str:
+            return f"({left} + {right})"
+        helper = python_binary_helpers[symbol]
+        return f"{helper}({left}, {right}, {node.token_idx})"
+python_binary_helpers = {
+    "+": "_add",
+    "-": "_subtract",
+    "*": "_multiply",
+    "/": "_divide",
+    ">": "_greater",
+    ">=": "_greater_equal",
+    "<": "_less",
+    "<=": "_less_equal",
+}
+# the helpers are given the token of the operator, for the line of their errors
+def numeric_helper(operation):
+    def helper(left_val, right_val, token_idx):
+        if type(left_val) in number_types and type(right_val) in number_types:
+            return operation(left_val, right_val)
+        raise runtime_error(Exception("Operand must be a number."), token_idx)
+    return helper
+def python_add(left_val, right_val, token_idx):
+    if type(left_val) in number_types and type(right_val) in number_types:
+        return left_val + right_val
+    if type(left_val) is str and type(right_val) is str:
+        return left_val + right_val
+    raise runtime_error(
+        Exception("Operand must be both number or strings."), token_idx
+    )
+def python_divide(left_val, right_val, token_idx):
+    # the other engines' division, whole quotients are ints and dividing by
+    # zero fails with the same message
+    try:
+        return apply_binary("/", left_val, right_val)
+    except Exception as e:
+        raise runtime_error(e, token_idx)
+def python_negate(unary_val, token_idx):
+    if type(unary_val) not in number_types:
+        raise runtime_error(Exception("Operand must be a number."), token_idx)
+    return -unary_val
+def python_set_item(box, value):
+    box[0] = value
+    return value
+def python_run_tail_calls(return_val):
+    while type(return_val) is TailCall:
+        return_val = return_val.function(*return_val.args)
+    return return_val
+def python_namespace():
+    namespace = {}
+    write = sys.stdout.write
+    def python_print(val):
+        write(f"{convert_primitive_to_str(val)}\n")
+    def python_set_global(py_name, value, token_idx):
+        if py_name not in namespace:
+            raise runtime_error(
+                Exception(f"Undefined variable '{py_name[2:]}'."), token_idx
+            )
+        namespace[py_name] = value
+        return value
+    namespace.update(
+        {
+            "_print": python_print,
+            "_set_global": python_set_global,
+            "_set_item": python_set_item,
+            "_add": python_add,
+            "_subtract": numeric_helper(operator.sub),
+            "_multiply": numeric_helper(operator.mul),
+            "_divide": python_divide,
+            "_greater": numeric_helper(operator.gt),
+            "_greater_equal": numeric_helper(operator.ge),
+            "_less": numeric_helper(operator.lt),
+            "_less_equal": numeric_helper(operator.le),
+            "_negate": python_negate,
+            "_tail_call": TailCall,
+            "_run_tail_calls": python_run_tail_calls,
+            "g_clock": Clock(),
+        }
+    )
+    return namespace
+python_arity_pattern = re.compile(
+    r"([\w.<>]+)\(\) (?:takes (\d+) positional arguments? but (\d+)"
+    r"|missing (\d+) required positional arguments?)"
+)
+def python_error(error, arities):
+    # the lox error for one python raised running transpiled code
+    name = getattr(error, "name", None)
+    if isinstance(error, NameError) and name is not None and name.startswith("g_"):
+        return Exception(f"Undefined variable '{name[2:]}'.")
+    if not isinstance(error, TypeError):
+        return error
+    if "not callable" in str(error):
+        return Exception("Can only call functions and classes.")
+    match = python_arity_pattern.match(str(error))
+    if match is None:
+        return error
+    def_name, expected, got, missing = match.groups()
+    if expected is not None:
+        return arity_error(expected, got)
+    # the count is only known when one function was defined under the name
+    counts = arities.get(def_name.rpartition(".")[2], ())
+    if len(counts) != 1:
+        return error
+    expected = next(iter(counts))
+    return arity_error(expected, expected - int(missing))
+def run_python(code, transpiler):
+    # runs transpiled code. the helpers tag their errors, any other error gets
+    # the token of the innermost call or global read it was raised at, or of
+    # the tail call it was raised making when that is further in
+    positions = transpiler.positions
+    try:
+        exec(code, python_namespace())
+    except Exception as e:
+        token_idx = None
+        entry = e.__traceback__
+        while entry is not None:
+            frame = entry.tb_frame
+            if frame.f_code.co_filename == "<lox>":
+                # the position of the instruction, every one takes two bytes
+                instructions = frame.f_code.co_positions()
+                position = next(islice(instructions, entry.tb_lasti // 2, None))
+                position_token = positions.get((position[1], position[3]))
+                if position_token is not None:
+                    token_idx = position_token
+            elif frame.f_code is python_run_tail_calls.__code__:
+                token_idx = frame.f_locals["return_val"].token_idx
+            entry = entry.tb_next
+        raise runtime_error(python_error(e, transpiler.arities), token_idx)
+def transpile_to_python(tokens):
+    statements = Parser(tokens).compile_program()
+    Resolver(tokens).resolve_program(statements)
+    return PythonTranspiler(tokens).transpile_program(statements)
+def transpile(file_contents):
+    tokens = tokenize_with_list(file_contents)
+    if tokens is None:
+        return 65
+    try:
+        source = transpile_to_python(tokens)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 65
+    sys.stdout.write(source)
+    return 0
 def parse(file_contents):
-
     tokens = tokenize_with_list(file_contents)
-
     if tokens is None:
-
         return 65
-
     parser = Parser(tokens)
-
     try:
-
         parser.parse_all()
-
     except Exception as e:
-
-        # print(str(e))
-
+        print(e, file=sys.stderr)
         return 65
-
-    for eval in parser.stack:
-
-        print(eval)
-
+    write = sys.stdout.write
+    for node in parser.stack:
+        write_syntax(node, write)
+        write("\n")
     return 0
-
+def runtime_error_text(error, tokens):
+    # the message of a runtime error and the line it happened on, as jlox
+    # prints them
+    if isinstance(error, RecursionError):
+        message = "Stack overflow."
+    else:
+        message = str(error)
+    token_idx = getattr(error, "token_idx", None)
+    if tokens is None or token_idx is None:
+        return message
+    return f"{message}\n[line {tokens.line(token_idx)}]"
 def evaluate(file_contents):
-
     tokens = tokenize_with_list(file_contents)
-
     if tokens is None:
-
         return 65
-
     interpreter = Interpreter(tokens)
-
     try:
-
         interpreter.evaluate_all()
-
     except Exception as e:
-
+        print(runtime_error_text(e, tokens), file=sys.stderr)
         return 70
-
     for value in interpreter.stack:
-
         print(convert_primitive_to_str(value))
-
     return 0
-
-def run(file_contents):
-
+def run(file_contents, engine="tree"):
     tokens = tokenize_with_list(file_contents)
-
     if tokens is None:
-
         return 65
-
     parser = Parser(tokens)
-
     if debug:
-
         print("PARSING")
-
     try:
-
-        parser.parse_all()
-
+        statements = parser.compile_program()
+        Resolver(tokens).resolve_program(statements)
+        inliner = Inliner()
+        statements = inliner.inline_program(statements)
+        statements = Optimizer().optimize_program(statements)
+        subexpressions = SubexpressionOptimizer()
+        statements = subexpressions.optimize_program(statements)
+        if inliner.inlined_count or subexpressions.temp_count:
+            # the inlined bodies and the temporaries declared need slots
+            Resolver(tokens).resolve_program(statements)
     except Exception as e:
-
         if debug:
-
             print("PARSER")
-
             traceback.print_exc()
-
-            print(e)
-
+        print(e, file=sys.stderr)
+        return 65
+    return run_statements(statements, engine, tokens)
+def run_statements(statements, engine="tree", tokens=None):
+    # tokens is the TokenStore the statements were parsed from, for error lines
+    try:
+        program = BlockNode(statements)
+        if engine == "closure":
+            execution = ClosureCompiler().compile_statements(program.statements)
+        elif engine == "vm":
+            compiler = BytecodeCompiler(VMFunction("<script>", 0), tokens=tokens)
+            function = compiler.compile_program(program.statements)
+            execution = lambda scope: VirtualMachine().interpret(function)
+        elif engine == "python":
+            transpiler = PythonTranspiler(tokens)
+            source = transpiler.transpile_program(program.statements)
+            with warnings.catch_warnings():
+                # calls of literals are only an error once they run
+                warnings.simplefilter("ignore", SyntaxWarning)
+                code = compile(source, "<lox>", "exec")
+            execution = lambda scope: run_python(code, transpiler)
+        elif engine == "stack":
+            execution = lambda scope: StackEvaluator().execute_statements(
+                program.statements, scope
+            )
+        else:
+            execution = program.execute_statements
+    except Exception as e:
+        if debug:
+            print("PARSER")
+            traceback.print_exc()
+        print(e, file=sys.stderr)
         return 65
-
-    if debug:
-
-        print(parser.stack)
-
-    interpreter = Interpreter(tokens)
-
     if debug:
-
+        print(program.statements)
         print("INTERPRETING")
-
     try:
-
-        interpreter.execute_all()
-
+        execution(Scope())
     except Exception as e:
-
         if debug:
-
             print("INTERPRETER ERROR")
-
             traceback.print_exc()
-
-            print(e)
-
+        print(runtime_error_text(e, tokens), file=sys.stderr)
         return 70
-
     """
-
     has_runtime_error = False
-
     if debug:
-
         print("INTERPRETING")
-
     try:
-
         interpreter.evaluate_all()
-
     except Exception as e:
-
         if debug:
-
             print("INTERPRETER")
-
             print(e)
-
         has_runtime_error = True
-
     if debug:
-
         print("INTERPRETER STACK")
-
         print(interpreter.stack)
-
     for value in interpreter.stack:
-
         if is_executable(value):
-
             value.execute()
-
     if has_runtime_error:
-
         return 70
-
     """
-
     return 0
-
-def tokenize(file_contents):
-
-    # Uncomment this block to pass the first stage
-
-    if file_contents:
-
-        has_errors = False
-
-        is_commenting = False
-
-        idx = 0
-
-        line = 1
-
-        while idx < len(file_contents):
-
-            ch = file_contents[idx]
-
-            if file_contents[idx] == "\n":
-
-                line += 1
-
-                idx += 1
-
-                is_commenting = False
-
-            elif is_commenting:
-
-                idx += 1
-
-            elif file_contents[idx].isnumeric():
-
-                num_literal = get_number_literal(file_contents, idx)
-
-                print("NUMBER", num_literal, float(num_literal))
-
-                idx += len(num_literal)
-
-            elif file_contents[idx] == '"':
-
-                string_literal = get_string_literal(file_contents, idx)
-
-                if string_literal[0] == '"' and string_literal[-1] == '"':
-
-                    print("STRING", string_literal, string_literal[1:-1])
-
+# characters compared at a time when diffing two versions of a source
+diff_block_size = 1 << 16
+def common_prefix_length(a, b):
+    size = min(len(a), len(b))
+    start = 0
+    while start < size:
+        end = min(start + diff_block_size, size)
+        if a[start:end] != b[start:end]:
+            # the first difference is in [start, end), narrow it down
+            while end - start > 1:
+                middle = (start + end) // 2
+                if a[start:middle] == b[start:middle]:
+                    start = middle
                 else:
-
-                    print(f"[line {line}] Error: Unterminated string.", file=sys.stderr)
-
-                    has_errors = True
-
-                idx += len(string_literal)
-
-            elif file_contents[idx] in (" ", "\t"):
-
-                idx += 1
-
-            elif contains_next_token(file_contents, idx, "<|TAB|>"):
-
-                idx += len("<|TAB|>")
-
-            elif contains_next_token(file_contents, idx, "<|SPACE|>"):
-
-                idx += len("<|SPACE|>")
-
-            elif contains_next_token(file_contents, idx, "//"):
-
-                is_commenting = True
-
-                idx += 1
-
-            elif (
-
-                idx + 1 < len(file_contents)
-
-                and file_contents[idx : idx + 2] in token_map
-
-            ):
-
-                print(
-
-                    token_map[file_contents[idx : idx + 2]],
-
-                    file_contents[idx : idx + 2],
-
-                    "null",
-
-                )
-
-                idx += 2
-
-            elif ch in token_map:
-
-                print(token_map[ch], ch, "null")
-
-                idx += 1
-
-            elif ch.isalpha() or ch == "_":
-
-                word = get_identifier(file_contents, idx)
-
-                if word in token_map:
-
-                    print(token_map[word], word, "null")
-
+                    end = middle
+            return start
+        start = end
+    return size
+def common_suffix_length(a, b, limit):
+    # like common_prefix_length from the ends, counting up to limit characters
+    start = 0
+    while start < limit:
+        end = min(start + diff_block_size, limit)
+        if a[len(a) - end : len(a) - start] != b[len(b) - end : len(b) - start]:
+            while end - start > 1:
+                middle = (start + end) // 2
+                if a[len(a) - middle : len(a) - start] == b[
+                    len(b) - middle : len(b) - start
+                ]:
+                    start = middle
                 else:
-
-                    print("IDENTIFIER", word, "null")
-
-                idx += len(word)
-
-            else:
-
-                print(
-
-                    f"[line {line}] Error: Unexpected character: {ch}", file=sys.stderr
-
+                    end = middle
+            return start
+        start = end
+    return limit
+def shift_token_indices(node, moved):
+    # moves the token indices a kept statement was parsed with by moved tokens.
+    # code it was tiered up to has the old ones built in, so it is dropped and
+    # the statement counts its runs again
+    if getattr(node, "token_idx", None) is not None:
+        node.token_idx += moved
+    if getattr(node, "token_range", None) is not None:
+        start, end = node.token_range
+        node.token_range = (start + moved, end + moved)
+    if getattr(node, "compiled", None) is not None:
+        node.compiled = None
+        if isinstance(node, BlockNode):
+            node.call_count = 0
+        else:
+            node.back_edges = 0
+    if isinstance(node, BlockNode):
+        for statement in node.statements:
+            shift_token_indices(statement, moved)
+    elif isinstance(node, Executable):
+        shift_token_indices(node.value, moved)
+        shift_token_indices(node.value_two, moved)
+    elif isinstance(node, ElseIfBlockNode):
+        for if_node in node.if_nodes:
+            shift_token_indices(if_node.truth_val, moved)
+            shift_token_indices(if_node.block, moved)
+        shift_token_indices(node.else_statement, moved)
+    elif isinstance(node, WhileNode):
+        shift_token_indices(node.condition, moved)
+        shift_token_indices(node.execution, moved)
+    elif isinstance(node, ForNode):
+        shift_token_indices(node.initializer, moved)
+        shift_token_indices(node.condition, moved)
+        shift_token_indices(node.increment, moved)
+        shift_token_indices(node.execution, moved)
+    elif isinstance(node, FunctionNode):
+        shift_token_indices(node.execution, moved)
+    elif isinstance(node, AssignNode):
+        shift_token_indices(node.value, moved)
+    elif isinstance(node, BinaryNode):
+        shift_token_indices(node.left, moved)
+        shift_token_indices(node.right, moved)
+    elif isinstance(node, UnaryNode):
+        shift_token_indices(node.operand, moved)
+    elif isinstance(node, FunctionCallNode):
+        shift_token_indices(node.function, moved)
+        for arg in node.args:
+            shift_token_indices(arg, moved)
+class IncrementalProgram:
+    # the tokens and resolved top-level statements of a source that keeps
+    # changing. update finds the changed text, re-lexes from the start of its
+    # line until the new tokens line up with old ones again, then re-parses
+    # only the declarations around the new tokens. the statements that are
+    # kept get their token indices moved along with their tokens
+    def __init__(self):
+        self.source = ""
+        self.tokens = None
+        self.statements = None
+        # token index each top-level declaration starts at, it runs up to the
+        # start of the next one
+        self.declaration_starts = array("I")
+    def update(self, source):
+        # returns the statements of source, or None after reporting a lexical
+        # error. parse and resolve errors are raised. after any error the next
+        # update starts from scratch
+        if not self.statements:
+            return self.rebuild(source)
+        if source == self.source:
+            return self.statements
+        old = self.source
+        old_statements = self.statements
+        self.statements = None
+        prefix = common_prefix_length(old, source)
+        suffix = common_suffix_length(old, source, min(len(old), len(source)) - prefix)
+        shift = len(source) - len(old)
+        changed_end = len(source) - suffix
+        tokens = self.tokens
+        offsets = tokens.offsets
+        # lexing can pick up at any line start that is not inside a string
+        lex_start = old.rfind("\n", 0, prefix) + 1
+        start = bisect_left(offsets, lex_start)
+        if start and offsets[start - 1] + len(tokens.lexeme(start - 1)) > lex_start:
+            start -= 1
+            lex_start = offsets[start]
+        # scanning is back in step once a new token past the change starts
+        # where an old one did, the text from there on is the same
+        end = len(tokens)
+        relexed = TokenStore()
+        for kind, lexeme, literal, offset in scan_tokens(source[lex_start:]):
+            offset += lex_start
+            if kind == "ERROR":
+                line = source.count("\n", 0, lex_start) + literal
+                print(f"[line {line}] Error: {lexeme}", file=sys.stderr)
+                return None
+            if offset >= changed_end:
+                old_idx = bisect_left(offsets, offset - shift, start)
+                if old_idx < len(offsets) and offsets[old_idx] == offset - shift:
+                    end = old_idx
+                    break
+            relexed.append(token_codes[kind], lexeme, literal, offset)
+        tokens.splice(start, end, relexed, shift)
+        tokens.source = self.source = source
+        moved = len(relexed) - (end - start)
+        starts = self.declaration_starts
+        # the declaration before the new tokens is parsed again too, it may run
+        # on into them, like an if taking up a new else
+        first = max(bisect_right(starts, start - 1) - 1, 0)
+        last = bisect_left(starts, end)
+        # every declaration has balanced brackets, so only the ones of the
+        # declarations being replaced need pairing up again
+        region_end = starts[last] + moved if last < len(starts) else len(tokens)
+        unmatched = tokens.match_brackets(starts[first], region_end)
+        if unmatched is not None:
+            line = tokens.line(unmatched)
+            bracket = tokens.lexeme(unmatched)
+            print(
+                f"[line {line}] Error at '{bracket}': Unmatched '{bracket}'.",
+                file=sys.stderr,
+            )
+            return None
+        return self.parse_declarations(old_statements, first, last, moved)
+    def rebuild(self, source):
+        self.source = source
+        self.statements = None
+        self.declaration_starts = array("I")
+        self.tokens = tokenize_with_list(source)
+        if self.tokens is None:
+            return None
+        return self.parse_declarations([], 0, 0, 0)
+    def parse_declarations(self, old_statements, first, last, moved):
+        # parses the declarations from the one numbered first up to a kept one,
+        # from last on and moved by moved tokens, or the end, and resolves them
+        starts = self.declaration_starts
+        parser = Parser(self.tokens, starts[first] if starts else 0)
+        cursor = parser.cursor
+        statements = []
+        new_starts = array("I")
+        kept = last
+        while not cursor.at_end():
+            while kept < len(starts) and starts[kept] + moved < cursor.idx:
+                kept += 1
+            if kept < len(starts) and starts[kept] + moved == cursor.idx:
+                break
+            new_starts.append(cursor.idx)
+            statements.append(parser.compile_declaration())
+        else:
+            kept = len(starts)
+        Resolver(self.tokens).resolve_program(statements)
+        if moved:
+            for statement in old_statements[kept:]:
+                shift_token_indices(statement, moved)
+        self.declaration_starts = (
+            starts[:first]
+            + new_starts
+            + array("I", map(moved.__add__, starts[kept:]))
+        )
+        self.statements = old_statements[:first] + statements + old_statements[kept:]
+        return self.statements
+# seconds between looks at the watched file
+watch_interval = 0.2
+def watch(filename, engine="tree"):
+    # runs the file again every time it changes, re-lexing and re-parsing only
+    # around the edit. stops on Ctrl-C
+    program = IncrementalProgram()
+    modified = None
+    try:
+        while True:
+            stat = os.stat(filename)
+            if stat.st_mtime_ns != modified:
+                modified = stat.st_mtime_ns
+                try:
+                    statements = program.update(read_source(filename))
+                except Exception as e:
+                    if debug:
+                        print("PARSER")
+                        traceback.print_exc()
+                    print(e, file=sys.stderr)
+                    statements = None
+                if statements is None:
+                    status = 65
+                else:
+                    status = run_statements(statements, engine, program.tokens)
+                sys.stdout.flush()
+                print(f"[exit {status}]", file=sys.stderr)
+            sleep(watch_interval)
+    except KeyboardInterrupt:
+        return 0
+# size of the buffer the tokenize command writes its output through
+tokenize_buffer_size = 1 << 20
+# tokens the tokenize command hands to its writer at a time
+tokenize_batch_size = 4096
+class TokenWriter:
+    # writes tokens to a binary stream as the "KIND lexeme literal" lines of
+    # the tokenize command
+    def __init__(self, out):
+        self.out = out
+    def write_tokens(self, tokens):
+        lines = [f"{kind} {lexeme} {literal}\n" for kind, lexeme, literal, _ in tokens]
+        self.out.write("".join(lines).encode())
+    def write_end(self):
+        self.out.write(b"EOF  null\n")
+class JsonLinesTokenWriter(TokenWriter):
+    # one JSON object per token: kind, lexeme, literal (null unless it is a
+    # number or a string) and the offset of the token in the source
+    def __init__(self, out):
+        super().__init__(out)
+        # the encoded kind, lexeme and literal of every distinct lexeme
+        self.encoded = {}
+    def write_tokens(self, tokens):
+        lines = []
+        for kind, lexeme, literal, offset in tokens:
+            encoded = self.encoded.get(lexeme)
+            if encoded is None:
+                encoded = self.encoded[lexeme] = json.dumps(
+                    {
+                        "kind": kind,
+                        "lexeme": lexeme,
+                        "literal": None if literal == "null" else literal,
+                    }
+                )[:-1].encode()
+            lines.append(b'%s, "offset": %d}\n' % (encoded, offset))
+        self.out.write(b"".join(lines))
+    def write_end(self):
+        self.out.write(b'{"kind": "EOF", "lexeme": "", "literal": null}\n')
+# the binary token format: the magic bytes, the kind table as a count and
+# (length, name) pairs, then records. a lexeme record defines the next lexeme
+# id as a kind code and a length prefixed UTF-8 lexeme, a token record gives a
+# lexeme id and the token's source offset, and an end record closes the stream.
+# literals follow from the kind and lexeme. integers are little endian and
+# offsets 64 bit, for sources past 4 GiB
+binary_tokens_magic = b"LOXTOKENS2\n"
+binary_lexeme_record = struct.Struct("<BBI")
+binary_token_record = struct.Struct("<BIQ")
+(BINARY_LEXEME, BINARY_TOKEN, BINARY_END) = range(3)
+class BinaryTokenWriter(TokenWriter):
+    def __init__(self, out):
+        super().__init__(out)
+        self.lexeme_ids = {}
+        out.write(binary_tokens_magic)
+        out.write(bytes([len(token_kinds)]))
+        for kind in token_kinds:
+            out.write(bytes([len(kind)]) + kind.encode())
+    def write_tokens(self, tokens):
+        records = []
+        pack_token = binary_token_record.pack
+        for kind, lexeme, _, offset in tokens:
+            lexeme_id = self.lexeme_ids.get(lexeme)
+            if lexeme_id is None:
+                lexeme_id = self.lexeme_ids[lexeme] = len(self.lexeme_ids)
+                data = lexeme.encode()
+                records.append(
+                    binary_lexeme_record.pack(
+                        BINARY_LEXEME, token_codes[kind], len(data)
+                    )
                 )
-
+                records.append(data)
+            records.append(pack_token(BINARY_TOKEN, lexeme_id, offset))
+        self.out.write(b"".join(records))
+    def write_end(self):
+        self.out.write(bytes([BINARY_END]))
+token_writers = {
+    "text": TokenWriter,
+    "jsonl": JsonLinesTokenWriter,
+    "binary": BinaryTokenWriter,
+}
+def tokenize(chunks, output_format="text"):
+    # streams the tokens of the source pieces, so any size of input is
+    # tokenized in bounded memory and output starts right away
+    sys.stdout.flush()
+    with open(
+        sys.stdout.fileno(), "wb", buffering=tokenize_buffer_size, closefd=False
+    ) as out:
+        writer = token_writers[output_format](out)
+        has_errors = False
+        batch = []
+        for token in scan_token_chunks(chunks):
+            if token[0] == "ERROR":
+                # keep stdout and stderr in source order
+                writer.write_tokens(batch)
+                batch.clear()
+                out.flush()
+                print(f"[line {token[2]}] Error: {token[1]}", file=sys.stderr)
                 has_errors = True
-
-                idx += 1
-
-        print("EOF  null")
-
-        if has_errors:
-
-            return 65
-
-        else:
-
-            return 0
-
+            else:
+                batch.append(token)
+                if len(batch) >= tokenize_batch_size:
+                    writer.write_tokens(batch)
+                    batch.clear()
+        writer.write_tokens(batch)
+        writer.write_end()
+    if has_errors:
+        return 65
     else:
-
-        print(
-
-            "EOF  null"
-
-        )  # Placeholder, remove this line when implementing the scanner
-
         return 0
-
+run_engines = ("tree", "closure", "vm", "python", "stack")
+def parse_options(args):
+    # splits --name=value flags from the positional arguments
+    options = {}
+    positional = []
+    for arg in args:
+        if arg.startswith("--"):
+            name, _, value = arg[2:].partition("=")
+            options[name] = value
+        else:
+            positional.append(arg)
+    return options, positional
 def main():
-
     if len(sys.argv) < 3:
-
         print("Usage: ./your_program.sh tokenize <filename>", file=sys.stderr)
-
         exit(1)
-
+    global debug_tiering, max_call_frames, tail_calls
     command = sys.argv[1]
-
-    filename = sys.argv[2]
-
-    with open(filename) as file:
-
-        file_contents = file.read()
-
+    options, filenames = parse_options(sys.argv[2:])
+    debug_tiering = "debug-tiering" in options
+    tail_calls = "tail-calls" in options
+    if "max-frames" in options:
+        if not options["max-frames"].isdigit():
+            print("--max-frames expects a number", file=sys.stderr)
+            exit(1)
+        max_call_frames = int(options["max-frames"])
+    if len(filenames) != 1:
+        print("Usage: ./your_program.sh tokenize <filename>", file=sys.stderr)
+        exit(1)
+    filename = filenames[0]
     # You can use print statements as follows for debugging, they'll be visible when running tests.
-
     print("Logs from your program will appear here!", file=sys.stderr)
-
     if command == "tokenize":
-
-        return tokenize(file_contents)
-
-    elif command == "parse":
-
+        output_format = options.get("format", "text")
+        if output_format not in token_writers:
+            print(f"Unknown format: {output_format}", file=sys.stderr)
+            exit(1)
+        return tokenize(source_chunks(filename), output_format)
+    if command == "watch":
+        engine = options.get("engine", "tree")
+        if engine not in run_engines:
+            print(f"Unknown engine: {engine}", file=sys.stderr)
+            exit(1)
+        return watch(filename, engine)
+    file_contents = read_source(filename)
+    if command == "parse":
         return parse(file_contents)
-
     elif command == "evaluate":
-
         return evaluate(file_contents)
-
+    elif command == "transpile":
+        return transpile(file_contents)
+    elif command == "disasm":
+        return disasm(file_contents)
     elif command == "run":
-
-        return run(file_contents)
-
+        engine = options.get("engine", "tree")
+        if engine not in run_engines:
+            print(f"Unknown engine: {engine}", file=sys.stderr)
+            exit(1)
+        return run(file_contents, engine)
     else:
-
         print(f"Unknown command: {command}", file=sys.stderr)
-
         exit(1)
-
 if __name__ == "__main__":
-
     exit(main())
@@ -0,0 +1,37 @@
+import sys
+from time import perf_counter
+from app import main
+# run from the repository root: python -m benchmarks.calls [n] [--no-free-list]
+# the --no-free-list run is the baseline for the call frame recycling
+fib_source = """
+fun fib(n) {
+  if (n < 2) return n;
+  return fib(n - 1) + fib(n - 2);
+}
+fib(%d);
+"""
+def fib_calls(n):
+    if n < 2:
+        return 1
+    return fib_calls(n - 1) + fib_calls(n - 2) + 1
+def calls_per_second(engine, n, repeat=5):
+    source = fib_source % n
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        main.run(source, engine)
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return fib_calls(n) / best
+def bench():
+    n = 20
+    for arg in sys.argv[1:]:
+        if arg == "--no-free-list":
+            main.max_free_frames = 0
+        else:
+            n = int(arg)
+    for engine in main.run_engines:
+        print(f"{engine:>8}: {calls_per_second(engine, n):>12,.0f} calls/sec")
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,121 @@
+import gc
+import io
+import sys
+from contextlib import redirect_stdout
+from math import log
+from time import perf_counter
+from app import main
+# run from the repository root: python -m benchmarks.scaling [steps] [--repeat=N]
+# times every front end stage on inputs of doubling size for each pathological
+# shape, fits cost ~ size ** k and exits with 1 when any stage grows faster
+# than linear
+# growth exponents above this count as superlinear, timing noise stays below it
+superlinear_exponent = 1.3
+# the growth is fitted over the largest sizes, where quadratic terms show
+fitted_sizes = 3
+# stages whose largest input takes less than this are too quick to fit
+min_fit_seconds = 10e-3
+# nested shapes recurse once per level in the parser and the interpreter
+nesting_recursion_limit = 100000
+# shape name, smallest size, source for a size
+shapes = [
+    ("long string", 1 << 18, lambda n: 'print "' + "s" * n + '";\n'),
+    (
+        "long identifier",
+        1 << 18,
+        lambda n: "var " + "i" * n + " = 1;\nprint " + "i" * n + ";\n",
+    ),
+    ("long comment", 1 << 18, lambda n: "// " + "c" * n + "\nprint 1;\n"),
+    ("nested parens", 1 << 9, lambda n: "print " + "(" * n + "1" + ")" * n + ";\n"),
+    ("nested braces", 1 << 9, lambda n: "{" * n + "print 1;" + "}" * n + "\n"),
+    ("plus chain", 1 << 12, lambda n: "print " + " + ".join(["1"] * n) + ";\n"),
+    (
+        "functions",
+        1 << 8,
+        lambda n: "".join(f"fun f{i}(x) {{ return x + {i}; }}\n" for i in range(n)),
+    ),
+]
+def tokenize(source, tokens):
+    main.tokenize_with_list(source)
+def parse_all(source, tokens):
+    main.Parser(tokens).parse_all()
+def compile_program(source, tokens):
+    main.Parser(tokens).compile_program()
+def interpret(source, tokens):
+    with redirect_stdout(io.StringIO()):
+        main.Interpreter(tokens).evaluate_all()
+stages = [
+    ("tokenize_with_list", tokenize),
+    ("parse_all", parse_all),
+    ("compile_program", compile_program),
+    ("interpreter", interpret),
+]
+def best_times(function, inputs, repeat):
+    # collections would land on random sizes, so they are kept out as in timeit
+    times = []
+    gc.collect()
+    gc.disable()
+    try:
+        for source, tokens in inputs:
+            best = None
+            for _ in range(repeat):
+                start = perf_counter()
+                function(source, tokens)
+                elapsed = perf_counter() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            times.append(best)
+    finally:
+        gc.enable()
+    return times
+def growth_exponent(sizes, times):
+    # least squares slope of log time over log size
+    xs = [log(size) for size in sizes]
+    ys = [log(max(time, 1e-9)) for time in times]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+def bench():
+    steps = 5
+    repeat = 5
+    for arg in sys.argv[1:]:
+        if arg.startswith("--repeat="):
+            repeat = int(arg[len("--repeat=") :])
+        else:
+            steps = int(arg)
+    sys.setrecursionlimit(nesting_recursion_limit)
+    superlinear = []
+    for shape, smallest, make_source in shapes:
+        sizes = [smallest << step for step in range(steps)]
+        sources = [make_source(size) for size in sizes]
+        inputs = [(source, main.tokenize_with_list(source)) for source in sources]
+        print(f"{shape} (sizes {sizes[0]}..{sizes[-1]})")
+        for stage, function in stages:
+            times = best_times(function, inputs, repeat)
+            millis = " ".join(f"{time * 1000:9.2f}" for time in times)
+            if times[-1] < min_fit_seconds:
+                print(f"  {stage:>18}: {millis} ms")
+                continue
+            exponent = growth_exponent(sizes[-fitted_sizes:], times[-fitted_sizes:])
+            if exponent > superlinear_exponent:
+                # a stall on a busy machine looks the same, so time it again
+                retimed = best_times(function, inputs, repeat)
+                times = [min(pair) for pair in zip(times, retimed)]
+                millis = " ".join(f"{time * 1000:9.2f}" for time in times)
+                exponent = growth_exponent(
+                    sizes[-fitted_sizes:], times[-fitted_sizes:]
+                )
+            flag = ""
+            if exponent > superlinear_exponent:
+                flag = "  superlinear"
+                superlinear.append((shape, stage))
+            print(f"  {stage:>18}: {millis} ms  ~n^{exponent:.2f}{flag}")
+    if superlinear:
+        print("superlinear stages:")
+        for shape, stage in superlinear:
+            print(f"  {shape}: {stage}")
+        return 1
+    return 0
+if __name__ == "__main__":
+    exit(bench())
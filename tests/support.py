@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+import tempfile
+# runs app.main as the test harness does, from the repository root
+repository_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+def run_lox(source, command="run", *options):
+    # returns the exit code, stdout and stderr of one command on the source
+    with tempfile.NamedTemporaryFile("w", suffix=".lox", delete=False) as file:
+        file.write(source)
+    try:
+        result = subprocess.run(
+            [sys.executable, "-m", "app.main", command, *options, file.name],
+            cwd=repository_root,
+            capture_output=True,
+            text=True,
+        )
+    finally:
+        os.unlink(file.name)
+    return result.returncode, result.stdout, result.stderr
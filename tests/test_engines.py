@@ -0,0 +1,151 @@
+import unittest
+from support import run_lox
+engines = ("tree", "closure", "vm", "python", "stack")
+# programs every engine has to run with the same output and exit code
+programs = {
+    "nil assignment": (
+        "var x = 1;\n"
+        "x = nil;\n"
+        "print x;\n"
+        "fun f() {\n"
+        "  var y = 2;\n"
+        "  y = nil;\n"
+        "  print y;\n"
+        "}\n"
+        "f();\n",
+        0,
+        "nil\nnil\n",
+    ),
+    "assignment in its own initializer": (
+        "{\n"
+        "  var x = (x = 1);\n"
+        "  print x;\n"
+        "  var y = 2 + (y = 1);\n"
+        "  print y;\n"
+        "}\n"
+        "fun f() {\n"
+        "  var z = (z = 5) * 2;\n"
+        "  return z;\n"
+        "}\n"
+        "print f();\n",
+        0,
+        "1\n3\n10\n",
+    ),
+    "closures and shadowing": (
+        "var a = \"global\";\n"
+        "{\n"
+        "  fun show() { print a; }\n"
+        "  show();\n"
+        "  var a = \"block\";\n"
+        "  show();\n"
+        "  print a;\n"
+        "}\n"
+        "fun counter() {\n"
+        "  var count = 0;\n"
+        "  fun next() {\n"
+        "    count = count + 1;\n"
+        "    return count;\n"
+        "  }\n"
+        "  return next;\n"
+        "}\n"
+        "var next = counter();\n"
+        "next();\n"
+        "print next();\n",
+        0,
+        "global\nglobal\nblock\n2\n",
+    ),
+    "recursion and loops": (
+        "fun fib(n) {\n"
+        "  if (n < 2) return n;\n"
+        "  return fib(n - 1) + fib(n - 2);\n"
+        "}\n"
+        "var total = 0;\n"
+        "for (var i = 0; i < 10; i = i + 1) total = total + fib(i);\n"
+        "print total;\n",
+        0,
+        "88\n",
+    ),
+    "globals and locals with look-alike names": (
+        'var x_1 = "global";\n'
+        'x_1 = "global2";\n'
+        "fun f() {\n"
+        '  var lox_x = "local";\n'
+        "  var l1_x = x_1;\n"
+        "  fun f_fn() { return lox_x; }\n"
+        "  print l1_x;\n"
+        "  print f_fn();\n"
+        "}\n"
+        "f();\n",
+        0,
+        "global2\nlocal\n",
+    ),
+    "reading a local in its own initializer": ("{\n  var x = x;\n}\n", 65, ""),
+    "runtime error": ("print 1;\nprint -\"a\";\nprint 2;\n", 70, "1\n"),
+}
+class EngineAgreementTest(unittest.TestCase):
+    def test_engines_agree(self):
+        for name, (source, exit_code, stdout) in programs.items():
+            for engine in engines:
+                with self.subTest(program=name, engine=engine):
+                    result = run_lox(source, "run", f"--engine={engine}")
+                    self.assertEqual(result[:2], (exit_code, stdout))
+    def test_clock_prints_alike(self):
+        for engine in engines:
+            with self.subTest(engine=engine):
+                result = run_lox("print clock;\n", "run", f"--engine={engine}")
+                self.assertEqual(result[0], 0)
+                self.assertRegex(result[1], r"^<\w+\.Clock object at 0x[0-9a-f]+>\n$")
+# a function, a for loop and a while loop running past the tier-up threshold,
+# the compiled code has to pick up the state the tree engine left
+tiering = (
+    "fun counter() {\n"
+    "  var count = 0;\n"
+    "  fun add(n) {\n"
+    "    count = count + n;\n"
+    "    return count;\n"
+    "  }\n"
+    "  return add;\n"
+    "}\n"
+    "var add = counter();\n"
+    "var total = 0;\n"
+    "for (var i = 0; i < 2500; i = i + 1) {\n"
+    "  var before = add(0);\n"
+    "  total = total + add(i) - before;\n"
+    "}\n"
+    "print total;\n"
+    "print add(0);\n"
+    "var j = 0;\n"
+    'var text = "";\n'
+    "while (j < 1500) {\n"
+    '  if (j == 999 or j == 1000) text = text + "x";\n'
+    "  j = j + 1;\n"
+    "}\n"
+    "print text;\n"
+    "print j;\n"
+)
+class TieringTest(unittest.TestCase):
+    def test_tiered_code_continues_where_the_tree_engine_stopped(self):
+        stdout = "3123750\n3123750\nxx\n1500\n"
+        returncode, tree_stdout, stderr = run_lox(tiering, "run", "--debug-tiering")
+        self.assertEqual((returncode, tree_stdout), (0, stdout))
+        for description in ("function add", "for loop", "while loop"):
+            self.assertIn(f"[tier-up] {description} after 1000 runs", stderr)
+        self.assertEqual(run_lox(tiering, "run", "--engine=closure")[:2], (0, stdout))
+deep_recursion = (
+    "fun sum(n) {\n"
+    "  if (n == 0) return 0;\n"
+    "  return n + sum(n - 1);\n"
+    "}\n"
+    "print sum(50000);\n"
+)
+class StackEngineTest(unittest.TestCase):
+    def test_deep_recursion(self):
+        result = run_lox(deep_recursion, "run", "--engine=stack")
+        self.assertEqual(result[:2], (0, "1250025000\n"))
+    def test_recursion_past_the_frame_limit(self):
+        options = ("--engine=stack", "--max-frames=1000")
+        returncode, _, stderr = run_lox(deep_recursion, "run", *options)
+        self.assertEqual(returncode, 70)
+        self.assertIn("Stack overflow.\n[line 3]", stderr)
+if __name__ == "__main__":
+    unittest.main()
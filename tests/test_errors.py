@@ -0,0 +1,144 @@
+import unittest
+from support import run_lox
+from test_engines import engines
+# programs failing at runtime, with what every engine prints to stderr
+runtime_errors = {
+    "negating a string": (
+        'var a = 1;\nprint a;\nprint -"x";\n',
+        "1\n",
+        ["Operand must be a number.", "[line 3]"],
+    ),
+    "operator on a later line": (
+        'fun f(x) {\n  return x *\n    "s";\n}\nprint f(2);\n',
+        "",
+        ["Operand must be a number.", "[line 2]"],
+    ),
+    "operator inside a multi-line expression": (
+        'var a = 1;\nprint (a + "x")\n\n +\n a;\n',
+        "",
+        ["Operand must be both number or strings.", "[line 2]"],
+    ),
+    "operator in the body of an inlined function": (
+        'var a = "s";\nfun f(x) {\n  return x\n    - 1;\n}\nprint 2 * f(a);\n',
+        "",
+        ["Operand must be a number.", "[line 4]"],
+    ),
+    "adding a string and a number": (
+        'print "a" + 1;\n',
+        "",
+        ["Operand must be both number or strings.", "[line 1]"],
+    ),
+    "dividing by a quotient of zero": (
+        "var x = 4 / 2;\nprint x;\nprint 1 / (x - 2);\n",
+        "2\n",
+        ["division by zero", "[line 3]"],
+    ),
+    "reading an undefined variable": (
+        "print 1;\nprint missing;\n",
+        "1\n",
+        ["Undefined variable 'missing'.", "[line 2]"],
+    ),
+    "assigning an undefined variable": (
+        "{\n  var q = 1;\n  missing = q;\n}\n",
+        "",
+        ["Undefined variable 'missing'.", "[line 3]"],
+    ),
+    "calling a string": (
+        'var s = "a";\n\ns();\n',
+        "",
+        ["Can only call functions and classes.", "[line 3]"],
+    ),
+    "calling with too few arguments": (
+        "fun two(a, b) { return a; }\nprint two(1);\n",
+        "",
+        ["Expected 2 arguments but got 1.", "[line 2]"],
+    ),
+    "the second of two calls on a line": (
+        "fun two(a, b) { return a; }\n"
+        'var s = "éé";\n'
+        'print s == "é" or two(1,\n  2) == two(\n  1);\n',
+        "",
+        ["Expected 2 arguments but got 1.", "[line 5]"],
+    ),
+    "calling with too many arguments": (
+        "fun none() {}\nnone(1,\n  2);\n",
+        "",
+        ["Expected 0 arguments but got 2.", "[line 3]"],
+    ),
+}
+def error_lines(stderr):
+    # the lines after the banner main prints first
+    return stderr.splitlines()[1:]
+class RuntimeErrorTest(unittest.TestCase):
+    def test_every_engine_reports_the_message_and_line(self):
+        for name, (source, stdout, stderr) in runtime_errors.items():
+            for engine in engines:
+                with self.subTest(name, engine=engine):
+                    result = run_lox(source, "run", f"--engine={engine}")
+                    self.assertEqual(result[:2], (70, stdout))
+                    self.assertEqual(error_lines(result[2]), stderr)
+    def test_tail_calls_report_their_own_line(self):
+        callee_fails = 'fun g(a) { return\n  -a; }\nfun f() { return g("x"); }\nf();\n'
+        call_fails = "fun g(a) { return a; }\nfun f() {\n  return g(1, 2);\n}\nf();\n"
+        for source, stderr in (
+            (callee_fails, ["Operand must be a number.", "[line 2]"]),
+            (call_fails, ["Expected 1 arguments but got 2.", "[line 3]"]),
+        ):
+            for engine in engines:
+                with self.subTest(stderr[0], engine=engine):
+                    options = ("--tail-calls", f"--engine={engine}")
+                    result = run_lox(source, "run", *options)
+                    self.assertEqual(result[0], 70)
+                    self.assertEqual(error_lines(result[2]), stderr)
+    def test_evaluate_reports_the_line(self):
+        result = run_lox('1 +\n  -"x"', "evaluate")
+        self.assertEqual(result[0], 70)
+        self.assertEqual(
+            error_lines(result[2]), ["Operand must be a number.", "[line 2]"]
+        )
+class CompileErrorTest(unittest.TestCase):
+    def assert_compile_error(self, source, stderr, *commands):
+        for command in commands:
+            with self.subTest(command=command):
+                result = run_lox(source, *command.split())
+                self.assertEqual(result[0], 65)
+                self.assertEqual(error_lines(result[2]), [stderr])
+    def test_parse_errors(self):
+        self.assert_compile_error(
+            "print 1\n",
+            "[line 2] Error at end: Expect ';' after value.",
+            "parse",
+            "run",
+        )
+        self.assert_compile_error(
+            "fun f() print 1;\n",
+            "[line 1] Error at 'print': Expect '{' before function body.",
+            "parse",
+            "run",
+        )
+        self.assert_compile_error(
+            "print (1 + );\n",
+            "[line 1] Error at ')': Expect expression.",
+            "parse",
+            "run",
+        )
+    def test_resolve_errors_point_at_their_line(self):
+        # disasm compiles without the Resolver, the VM compiler reports these
+        commands = ("run", "run --engine=vm", "disasm", "transpile")
+        self.assert_compile_error(
+            "print 1;\n\nreturn 2;\n",
+            "[line 3] Error at 'return': Can't return from top-level code.",
+            *commands,
+        )
+        self.assert_compile_error(
+            "{\n  var a = 1;\n  var a = 2;\n}\n",
+            "[line 3] Error at 'a': Already a variable with this name in this scope.",
+            *commands,
+        )
+        self.assert_compile_error(
+            "{\n  var a = 1;\n  {\n    var b = b;\n  }\n}\n",
+            "[line 4] Error at 'b': Can't read local variable in its own initializer.",
+            *commands,
+        )
+if __name__ == "__main__":
+    unittest.main()
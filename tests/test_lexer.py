@@ -0,0 +1,121 @@
+import io
+import json
+import unittest
+from app import main
+source = (
+    "var abc = 12.5; // a comment\n"
+    '<|TAB|>print "str\\ning" + x1;\n'
+    '  <|SPACE|>   @ 123456.78 "unterminated\n'
+    + "long_identifier_" * 8
+    + " 9999999 // the end"
+)
+class ChunkedScanTest(unittest.TestCase):
+    def test_every_chunk_size_scans_like_the_whole_text(self):
+        whole = list(main.scan_tokens(source))
+        for size in range(1, 48):
+            with self.subTest(size=size):
+                chunks = [source[i : i + size] for i in range(0, len(source), size)]
+                self.assertEqual(list(main.scan_token_chunks(chunks)), whole)
+    def test_tokens_spanning_many_chunks(self):
+        for text in (
+            'print "' + "s" * 5000 + '";',
+            "// " + "c" * 5000 + "\nprint 1;",
+            "var " + "i" * 5000 + " = 1;",
+            "print " + "9" * 5000 + ";",
+            "print 1;" + " \n" * 5000 + "print 2;",
+        ):
+            with self.subTest(text=text[:10]):
+                chunks = [text[i : i + 16] for i in range(0, len(text), 16)]
+                self.assertEqual(
+                    list(main.scan_token_chunks(chunks)), list(main.scan_tokens(text))
+                )
+class TokenStoreTest(unittest.TestCase):
+    def test_offsets_past_4_gib(self):
+        piece, _, _ = main.lex_piece("print 1;")
+        tokens = main.TokenStore()
+        tokens.extend(piece, 1 << 32)
+        self.assertEqual(list(tokens.offsets), [1 << 32, (1 << 32) + 6, (1 << 32) + 7])
+        tokens.splice(0, 1, main.TokenStore(), 1 << 32)
+        self.assertEqual(list(tokens.offsets), [(1 << 33) + 6, (1 << 33) + 7])
+# strings spanning lines end up cut between the pieces lexed in parallel
+multiline_source = "".join(
+    f'var s{i} = "line\n{i}\n";\nprint s{i} + "{i}"; // {i}\n' for i in range(400)
+)
+class ParallelLexTest(unittest.TestCase):
+    def assert_lexes_alike(self, text, workers):
+        tokens, errors, _ = main.lex_piece(text)
+        parallel_tokens, parallel_errors = main.lex_in_parallel(text, workers)
+        if errors:
+            self.assertEqual(parallel_errors[0], errors[0])
+            return
+        self.assertEqual(parallel_errors, [])
+        self.assertEqual(list(parallel_tokens), list(tokens))
+        self.assertEqual(parallel_tokens.offsets, tokens.offsets)
+    def test_pieces_stitch_together_like_one_scan(self):
+        for workers in (1, 2, 3, 8):
+            with self.subTest(workers=workers):
+                self.assert_lexes_alike(multiline_source, workers)
+    def test_errors_report_the_line_in_the_whole_source(self):
+        for text in (
+            multiline_source + "print @;\n" + multiline_source,
+            multiline_source + 'print "open\n' + multiline_source,
+        ):
+            with self.subTest(text=text[-20:]):
+                self.assert_lexes_alike(text, 4)
+def read_binary_tokens(data):
+    # the (kind, lexeme, offset) of every token in the binary format
+    assert data.startswith(main.binary_tokens_magic)
+    idx = len(main.binary_tokens_magic)
+    kinds = []
+    idx += 1
+    for _ in range(data[idx - 1]):
+        length = data[idx]
+        kinds.append(data[idx + 1 : idx + 1 + length].decode())
+        idx += length + 1
+    lexemes = []
+    tokens = []
+    while data[idx] != main.BINARY_END:
+        if data[idx] == main.BINARY_LEXEME:
+            _, kind, length = main.binary_lexeme_record.unpack_from(data, idx)
+            idx += main.binary_lexeme_record.size
+            lexemes.append((kinds[kind], data[idx : idx + length].decode()))
+            idx += length
+        else:
+            _, lexeme_id, offset = main.binary_token_record.unpack_from(data, idx)
+            idx += main.binary_token_record.size
+            tokens.append((*lexemes[lexeme_id], offset))
+    assert idx == len(data) - 1
+    return tokens
+class TokenWriterTest(unittest.TestCase):
+    def written(self, writer_class, tokens):
+        out = io.BytesIO()
+        writer = writer_class(out)
+        writer.write_tokens(tokens)
+        writer.write_end()
+        return out.getvalue()
+    def tokens(self):
+        tokens = [token for token in main.scan_tokens(source) if token[0] != "ERROR"]
+        # as if they came from far into a source larger than 4 GiB
+        return tokens + [(*token[:3], token[3] + (5 << 30)) for token in tokens]
+    def test_jsonl_round_trip(self):
+        tokens = self.tokens()
+        lines = self.written(main.JsonLinesTokenWriter, tokens).splitlines()
+        self.assertEqual(
+            json.loads(lines[-1]), {"kind": "EOF", "lexeme": "", "literal": None}
+        )
+        read = [json.loads(line) for line in lines[:-1]]
+        self.assertEqual(
+            [(r["kind"], r["lexeme"], r["literal"], r["offset"]) for r in read],
+            [
+                (kind, lexeme, None if literal == "null" else literal, offset)
+                for kind, lexeme, literal, offset in tokens
+            ],
+        )
+    def test_binary_round_trip(self):
+        tokens = self.tokens()
+        self.assertEqual(
+            read_binary_tokens(self.written(main.BinaryTokenWriter, tokens)),
+            [(kind, lexeme, offset) for kind, lexeme, _, offset in tokens],
+        )
+if __name__ == "__main__":
+    unittest.main()
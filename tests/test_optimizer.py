@@ -0,0 +1,186 @@
+import io
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from app import main
+from test_engines import engines
+def run_source(source, engine, optimize):
+    # the exit code, stdout and stderr of a run with or without the optimizers
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        if optimize:
+            status = main.run(source, engine)
+        else:
+            tokens = main.tokenize_with_list(source)
+            statements = main.Parser(tokens).compile_program()
+            main.Resolver(tokens).resolve_program(statements)
+            status = main.run_statements(statements, engine, tokens)
+    return status, stdout.getvalue(), stderr.getvalue()
+# programs the optimizers rewrite, with their exit code and output
+programs = {
+    "folded operator on a string": (
+        'print 1;\nprint "a" - 1;\n',
+        70,
+        "1\n",
+    ),
+    "folded division by zero": (
+        "var z = 0;\nprint 2;\nprint 1 / z;\n",
+        70,
+        "2\n",
+    ),
+    "failing invariant after an effect in the loop": (
+        "fun run(s) {\n"
+        "  var i = 0;\n"
+        "  while (i < 2) {\n"
+        "    print i;\n"
+        "    print s - 1;\n"
+        "    i = i + 1;\n"
+        "  }\n"
+        "}\n"
+        'run("a");\n',
+        70,
+        "0\n",
+    ),
+    "invariant division by zero in a for loop": (
+        "fun run(z) {\n"
+        "  var k = z * 3;\n"
+        "  for (var i = 0; i < 3; i = i + 1) {\n"
+        "    print i + k * k;\n"
+        "    print 10 / z;\n"
+        "  }\n"
+        "}\n"
+        "run(0);\n",
+        70,
+        "0\n",
+    ),
+    "failing invariants in loops that never run": (
+        "fun run(s, z, n) {\n"
+        "  while (n > 0) {\n"
+        "    print s - 1;\n"
+        "    n = n - 1;\n"
+        "  }\n"
+        "  for (var i = 0; i < n; i = i + 1) print 1 / z + -s;\n"
+        '  print "done";\n'
+        "}\n"
+        'run("a", 0, 0);\n',
+        0,
+        "done\n",
+    ),
+    "safe invariant in a loop that never runs": (
+        "fun run(n) {\n"
+        "  var x = n * 3;\n"
+        "  var y = 0;\n"
+        "  for (var i = 0; i < n; i = i + 1) {\n"
+        "    y = y + x * x;\n"
+        "  }\n"
+        "  print y;\n"
+        "}\n"
+        "run(0);\n",
+        0,
+        "0\n",
+    ),
+    "call assigning a global between reuses": (
+        "var a = 1;\n"
+        "var b = 2;\n"
+        "fun bump() {\n"
+        "  a = 10;\n"
+        "  return 0;\n"
+        "}\n"
+        "print (a + b) * (a + b) + bump() + (a + b);\n"
+        "a = 1;\n"
+        "var g = bump;\n"
+        "print a * b;\n"
+        "g();\n"
+        "print a * b;\n",
+        0,
+        "21\n2\n20\n",
+    ),
+    "closure assigning a local between reuses": (
+        "fun outer() {\n"
+        "  var x = 1;\n"
+        "  fun set() {\n"
+        "    x = 5;\n"
+        "    return 0;\n"
+        "  }\n"
+        "  print x * 2 + set() + x * 2;\n"
+        "}\n"
+        "outer();\n",
+        0,
+        "12\n",
+    ),
+    "assignment in a local's own initializer": (
+        "fun run(n) {\n"
+        "  var a = n * 2;\n"
+        "  {\n"
+        "    var a = a = n * 3;\n"
+        "    print a * a;\n"
+        "    print a * a;\n"
+        "  }\n"
+        "  print a * a;\n"
+        "}\n"
+        "run(1);\n",
+        0,
+        "9\n9\n4\n",
+    ),
+    "inlined arguments with effects": (
+        "fun note(s) {\n"
+        "  print s;\n"
+        "  return s;\n"
+        "}\n"
+        "fun pair(a, b) {\n"
+        "  return b + a;\n"
+        "}\n"
+        'print pair(note("x"), note("y"));\n',
+        0,
+        "x\ny\nyx\n",
+    ),
+    "inlined argument read before a later one assigns it": (
+        "var n = 1;\n"
+        "fun set(v) {\n"
+        "  n = v;\n"
+        "  return v;\n"
+        "}\n"
+        "fun sub(a, b) {\n"
+        "  return a - b;\n"
+        "}\n"
+        "print sub(n, set(5));\n"
+        "print n;\n",
+        0,
+        "-4\n5\n",
+    ),
+    "inlined body failing after its arguments ran": (
+        "fun note(s) {\n"
+        "  print s;\n"
+        "  return s;\n"
+        "}\n"
+        "fun g(a, b) {\n"
+        "  var c = a * 2;\n"
+        "  return b + c;\n"
+        "}\n"
+        'print g("s", note("z"));\n',
+        70,
+        "z\n",
+    ),
+    "inlined argument failing before a later one runs": (
+        "fun note(s) {\n"
+        "  print s;\n"
+        "  return s;\n"
+        "}\n"
+        "fun pair(a, b) {\n"
+        "  return b + a;\n"
+        "}\n"
+        'print pair(1 - "a", note("q"));\n',
+        70,
+        "",
+    ),
+}
+class OptimizerTest(unittest.TestCase):
+    def test_optimized_runs_like_unoptimized(self):
+        for name, (source, exit_code, stdout) in programs.items():
+            for engine in engines:
+                with self.subTest(program=name, engine=engine):
+                    optimized = run_source(source, engine, True)
+                    self.assertEqual(optimized[:2], (exit_code, stdout))
+                    self.assertEqual(optimized, run_source(source, engine, False))
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,15 @@
+import unittest
+from support import run_lox
+class ForClauseTest(unittest.TestCase):
+    def test_names_containing_block_are_clauses(self):
+        source = "for (var block = 0; block < 2; block = block + 1) print block;\n"
+        returncode, stdout, _ = run_lox(source, "parse")
+        self.assertEqual(returncode, 0)
+        self.assertIn("(for (group (< var_block 2.0)", stdout)
+        self.assertEqual(run_lox(source, "run")[:2], (0, "0\n1\n"))
+    def test_a_block_clause_is_an_error(self):
+        returncode, _, stderr = run_lox("for ({}) print 1;\n", "parse")
+        self.assertEqual(returncode, 65)
+        self.assertIn("[line 1] Error at '{': Expect expression.", stderr)
+if __name__ == "__main__":
+    unittest.main()
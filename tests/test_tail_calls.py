@@ -0,0 +1,33 @@
+import unittest
+from support import run_lox
+from test_engines import engines
+deep_recursion = (
+    "fun sumTo(n, acc) {\n"
+    "  if (n == 0) return acc;\n"
+    "  return sumTo(n - 1, acc + n);\n"
+    "}\n"
+    "print sumTo(100000, 0);\n"
+)
+captured_locals = (
+    "fun h(g, k) { return g() + k; }\n"
+    "fun f(n) {\n"
+    "  var x = n * 2;\n"
+    "  fun g() { return x; }\n"
+    "  return h(g, 1);\n"
+    "}\n"
+    "print f(5);\n"
+    "fun t() { return clock(); }\n"
+    "print t() > 0;\n"
+)
+class TailCallTest(unittest.TestCase):
+    def assert_runs_with_tail_calls(self, source, stdout):
+        for engine in engines:
+            with self.subTest(engine=engine):
+                result = run_lox(source, "run", "--tail-calls", f"--engine={engine}")
+                self.assertEqual(result[:2], (0, stdout))
+    def test_deep_tail_recursion_runs_on_every_engine(self):
+        self.assert_runs_with_tail_calls(deep_recursion, "5000050000\n")
+    def test_frames_left_by_tail_calls_keep_captured_locals(self):
+        self.assert_runs_with_tail_calls(captured_locals, "11\ntrue\n")
+if __name__ == "__main__":
+    unittest.main()
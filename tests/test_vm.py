@@ -0,0 +1,40 @@
+import unittest
+from support import run_lox
+def run_vm(source):
+    return run_lox(source, "run", "--engine=vm")
+class AssignmentTest(unittest.TestCase):
+    def test_assigning_nil_to_a_global(self):
+        self.assertEqual(run_vm("var x = 1;\nx = nil;\nprint x;\n")[:2], (0, "nil\n"))
+    def test_assigning_nil_to_locals_and_upvalues(self):
+        source = (
+            "fun f() {\n"
+            "  var y = 2;\n"
+            "  y = nil;\n"
+            "  print y;\n"
+            "  var z = 3;\n"
+            "  fun g() { z = nil; }\n"
+            "  g();\n"
+            "  print z;\n"
+            "}\n"
+            "f();\n"
+        )
+        self.assertEqual(run_vm(source)[:2], (0, "nil\nnil\n"))
+    def test_assigning_a_local_in_its_own_initializer(self):
+        source = (
+            "{\n"
+            "  var x = (x = 1);\n"
+            "  print x;\n"
+            "  var y = 2 + (y = 1);\n"
+            "  print y;\n"
+            "}\n"
+        )
+        self.assertEqual(run_vm(source)[:2], (0, "1\n3\n"))
+    def test_reading_a_local_in_its_own_initializer(self):
+        returncode, _, stderr = run_vm("{\n  var x = x;\n}\n")
+        self.assertEqual(returncode, 65)
+        self.assertIn(
+            "[line 2] Error at 'x': Can't read local variable in its own initializer.",
+            stderr,
+        )
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import io
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from app import main
+from test_engines import engines
+def run_program(program, source, engine):
+    # the exit code, stdout and stderr of one run of the watch command
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        statements = program.update(source)
+        status = main.run_statements(statements, engine, program.tokens)
+    return status, stdout.getvalue(), stderr.getvalue()
+failing = 'print 1;\nprint 2;\nprint -"a";\n'
+# g is tiered up before it fails, on the tree engine
+tiered = (
+    "fun g(x) {\n"
+    "  return x * 2;\n"
+    "}\n"
+    "var i = 0;\n"
+    "while (i < 1100) {\n"
+    "  g(i);\n"
+    "  i = i + 1;\n"
+    "}\n"
+    'print g("s");\n'
+)
+# every source is an edit of the one before
+edits = (
+    failing,
+    "print 0;\n\n\n\n" + failing,
+    "print 0;\n" + failing,
+    "print 0;\nprint 1; print 1.5;\nprint 2;\n\n" + failing[18:],
+    tiered,
+    "print 0;\n\n" + tiered,
+    "print 0;\n\n" + tiered.replace("x * 2;", "-x;\n  // negated"),
+    "var a = 1;\n" + tiered[:-15] + "print g(a);\n",
+)
+class IncrementalProgramTest(unittest.TestCase):
+    def test_edits_run_like_a_full_rebuild(self):
+        for engine in engines:
+            program = main.IncrementalProgram()
+            for idx, source in enumerate(edits):
+                with self.subTest(engine=engine, edit=idx):
+                    self.assertEqual(
+                        run_program(program, source, engine),
+                        run_program(main.IncrementalProgram(), source, engine),
+                    )
+if __name__ == "__main__":
+    unittest.main()